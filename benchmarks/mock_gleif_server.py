@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+from aiohttp import web
+
+COUNTRIES = ['GB', 'NL']
+
+
+def make_record(lei: str, payload_size: int = 0) -> Dict:
+    """
+    Builds a deterministic gleif LEI record for the LEI. The record is padded with `payload_size` bytes of filler
+    to mimic the size of the real records.
+    """
+    digest = hashlib.sha1(lei.encode()).hexdigest()
+    return {
+        'type': 'lei-records',
+        'id': lei,
+        'attributes': {
+            'lei': lei,
+            'entity': {
+                'legalName': {'name': f'COMPANY {digest[:8].upper()} LIMITED', 'language': 'en'},
+                'legalAddress': {'country': COUNTRIES[int(digest[8:10], 16) % len(COUNTRIES)]},
+            },
+            'bic': [f'{digest[10:14].upper()}GB2LXXX'],
+            'filler': 'x' * payload_size,
+        },
+    }
+
+
+class MockGleifServer:
+    """
+    A local stand-in for the lei-records endpoint of api.gleif.org.
+
+    Every well-formed LEI is known to it, and the records are generated from the LEI itself. The latency, the error
+    rate, the rate of 429 responses and the payload size can be configured to simulate a degraded API.
+
+    Responses carry an ETag and a Last-Modified header. Conditional requests get a 304 without a body if the records
+    haven't changed, which they only do when their LEIs are in `modified`.
+
+    Like the real API, it supports JSON:API sparse fieldsets (`fields[lei-records]=...`), and with `compress`,
+    responses are compressed with an encoding the request accepts.
+    """
+    LAST_MODIFIED = 'Mon, 01 Jan 2024 00:00:00 GMT'
+
+    def __init__(self, latency: float = 0.0, latency_jitter: float = 0.0, error_rate: float = 0.0,
+                 too_many_requests_rate: float = 0.0, payload_size: int = 0, seed: Optional[int] = None,
+                 compress: bool = True):
+        """
+        :param latency: The base latency of every response in seconds.
+        :param latency_jitter: A random latency of up to this many seconds added to every response.
+        :param error_rate: The share of requests answered with a 500.
+        :param too_many_requests_rate: The share of requests answered with a 429 and a Retry-After header.
+        :param payload_size: The number of filler bytes added to every record.
+        :param seed: The seed of the random generator used for latencies and errors.
+        :param compress: Whether responses are compressed if the request accepts it.
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.too_many_requests_rate = too_many_requests_rate
+        self.payload_size = payload_size
+        self.compress = compress
+        self.random = random.Random(seed)
+        self.modified = set()
+        self.requests = 0
+        self.statuses: Dict[int, int] = {}
+        self.runner = None
+        self.url = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/api/v1/lei-records', self.lei_records)
+        return app
+
+    async def lei_records(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency + self.random.random() * self.latency_jitter)
+
+        draw = self.random.random()
+        if draw < self.error_rate:
+            return self._count(web.json_response({'errors': [{'status': '500'}]}, status=500))
+        if draw < self.error_rate + self.too_many_requests_rate:
+            return self._count(web.json_response({'errors': [{'status': '429'}]}, status=429,
+                                                 headers={'Retry-After': '1'}))
+
+        leis = [lei for lei in request.query.get('filter[lei]', '').split(',') if len(lei) == 20]
+        page_size = int(request.query.get('page[size]', 10))
+        records = [make_record(lei, self.payload_size) for lei in leis[:page_size]]
+        fields = request.query.get('fields[lei-records]')
+        for record in records:
+            if record['id'] in self.modified:
+                record['attributes']['entity']['legalName']['name'] += ' (RENAMED)'
+            if fields is not None:
+                record['attributes'] = {name: record['attributes'][name] for name in fields.split(',')
+                                        if name in record['attributes']}
+        body = json.dumps({'meta': {'pagination': {'total': len(leis)}}, 'data': records})
+
+        modified = any(lei in self.modified for lei in leis)
+        headers = {'ETag': f'"{hashlib.sha1(body.encode()).hexdigest()}"',
+                   'Last-Modified': self.LAST_MODIFIED if not modified else 'Tue, 02 Jan 2024 00:00:00 GMT'}
+        if self._not_modified(request, headers):
+            return self._count(web.Response(status=304, headers=headers))
+        response = web.Response(text=body, content_type='application/json', headers=headers)
+        if self.compress:
+            response.enable_compression()
+        return self._count(response)
+
+    @staticmethod
+    def _not_modified(request: web.Request, headers: Dict[str, str]) -> bool:
+        if 'If-None-Match' in request.headers:
+            return request.headers['If-None-Match'] == headers['ETag']
+        if 'If-Modified-Since' in request.headers:
+            try:
+                return (parsedate_to_datetime(headers['Last-Modified'])
+                        <= parsedate_to_datetime(request.headers['If-Modified-Since']))
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _count(self, response: web.Response) -> web.Response:
+        self.statuses[response.status] = self.statuses.get(response.status, 0) + 1
+        return response
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        self.runner = web.AppRunner(self.make_app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f'http://{host}:{port}/api/v1/lei-records?filter[lei]='
+        return self.url
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--latency', type=float, default=0.05, help='The base latency of the responses in seconds.')
+    parser.add_argument('--latency_jitter', type=float, default=0.02,
+                        help='A random latency of up to this many seconds added to every response.')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='The share of requests answered with a 500.')
+    parser.add_argument('--too_many_requests_rate', type=float, default=0.0,
+                        help='The share of requests answered with a 429.')
+    parser.add_argument('--payload_size', type=int, default=2000,
+                        help='The number of filler bytes added to every record.')
+    parser.add_argument('--seed', type=int, default=None, help='The seed of the random latencies and errors.')
+    parser.add_argument('--compress', action=argparse.BooleanOptionalAction, default=True,
+                        help='Compress the responses if the request accepts it.')
+
+
+def serve(port: int, **options) -> None:
+    async def main():
+        server = MockGleifServer(**options)
+        url = await server.start(port=port)
+        print(f'Mock gleif API listening on {url}', flush=True)
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the gleif API.')
+    parser.add_argument('--port', type=int, default=8080, help='The port to listen on.')
+    add_server_arguments(parser)
+    args = vars(parser.parse_args())
+    serve(args.pop('port'), **args)
@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import resource
+import socket
+import string
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from benchmarks.mock_gleif_server import add_server_arguments, serve
+
+LEI_CHARACTERS = np.array(list(string.digits + string.ascii_uppercase))
+
+
+def make_lei(base: str) -> str:
+    """
+    Appends the ISO 17442 check digits to an 18 character LEI base.
+    """
+    number = int(''.join(str(int(char, 36)) for char in base) + '00')
+    return f'{base}{98 - number % 97:02d}'
+
+
+def generate_input(rows: int, cardinality: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Generates a trade file in the format of data/input_dataset.csv, with `cardinality` distinct LEIs.
+    """
+    rng = np.random.default_rng(seed)
+    bases = [''.join(chars) for chars in rng.choice(LEI_CHARACTERS, size=(cardinality, 18))]
+    leis = np.array([make_lei(base) for base in bases])
+
+    return pd.DataFrame({
+        'transaction_uti': [f'{i:032d}BENCHMARK' for i in range(rows)],
+        'isin': 'EZ9724VTXK48',
+        'notional': rng.integers(1, 1000, rows) * 1000.0,
+        'notional_currency': 'GBP',
+        'transaction_type': rng.choice(['Buy', 'Sell'], rows),
+        'transaction_datetime': '2020-11-25T15:06:22Z',
+        'rate': rng.uniform(0.001, 0.01, rows).round(7),
+        'lei': leis[rng.integers(0, cardinality, rows)],
+    })
+
+
+def run_size(rows: int, options: Dict) -> Dict:
+    """
+    Runs the enrichment on a synthetic input of `rows` rows, the same way the command line does, and reads the stage
+    timings and counters from the metrics of the run. It is run in a fresh process, so the peak RSS belongs to this
+    input size only.
+    """
+    from components.data_source import get_data_source
+    from components.metrics import metrics
+    from main import DataEnrichmentRunner
+
+    directory = tempfile.mkdtemp(prefix='benchmark_')
+    input_file = os.path.join(directory, f'input{options["extension"]}')
+    output_file = os.path.join(directory, f'output{options["extension"]}')
+    generated = generate_input(rows, options['cardinality'], options['seed'])
+    if options['extension'] == '.parquet':
+        generated.to_parquet(input_file, index=False)
+    else:
+        generated.to_csv(input_file, index=False)
+    del generated
+
+    runner = DataEnrichmentRunner(client='LeiLookupClient', base_url=options['url'], log_level='WARNING',
+                                  input_file=input_file, output_file=output_file,
+                                  chunk_size=options['chunk_size'], pipeline=options['pipeline'],
+                                  workers=options['workers'],
+                                  cache_size=options['cache_size'], cache_records=options['cache_records'],
+                                  requests_per_second=options['requests_per_second'], burst=options['burst'],
+                                  max_concurrency=options['max_concurrency'], page_size=options['page_size'],
+                                  retry_attempts=options['retry_attempts'],
+                                  sparse_fieldsets=options['sparse_fieldsets'],
+                                  compress_responses=options['compress_responses'])
+
+    start = time.perf_counter()
+    asyncio.run(runner.run())
+    total = time.perf_counter() - start
+
+    def total_of(name: str) -> float:
+        return sum(metrics.counters.get(name, {}).values())
+
+    def gauge(name: str) -> float:
+        return sum(metrics.gauges.get(name, {}).values())
+
+    # The stages overlap in the pipelined and sharded modes, so their times can add up to more than the total
+    stages = {dict(labels)['stage']: histogram.sum
+              for labels, histogram in metrics.histograms.get('enrichment_stage_seconds', {}).items()}
+    latencies = metrics.histograms.get('enrichment_request_seconds', {}).get(())
+    output = get_data_source(output_file, columns=['legal_name']).load_data(output_file)
+    return {
+        'rows': rows,
+        'rows_per_second': rows / total,
+        'total_seconds': total,
+        'stages': stages,
+        'requests': int(total_of('enrichment_requests_total')),
+        # The latency quantiles are the upper bounds of their histogram buckets
+        'p50_latency_ms': latencies.quantile(0.5) * 1000 if latencies else None,
+        'p99_latency_ms': latencies.quantile(0.99) * 1000 if latencies else None,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'rows_written': runner.rows_written,
+        'unenriched_rows': int(output['legal_name'].isnull().sum()) if 'legal_name' in output else None,
+        'cache_hits': int(gauge('enrichment_cache_hits')),
+        'cache_misses': int(gauge('enrichment_cache_misses')),
+        'response_mb': total_of('enrichment_response_bytes_total') / 2 ** 20,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f'The mock server did not start on port {port}.')
+
+
+def format_report(results: List[Dict]) -> str:
+    stage_names = list(results[0]['stages'])
+    header = ['rows', 'rows/s', 'requests', 'p50 ms', 'p99 ms', 'peak RSS MB', 'response MB'] + \
+        [f'{s} s' for s in stage_names]
+    lines = [' | '.join(f'{column:>11}' for column in header)]
+    for result in results:
+        values = [result['rows'], f'{result["rows_per_second"]:.0f}', result['requests'],
+                  f'{result["p50_latency_ms"] or 0:.1f}', f'{result["p99_latency_ms"] or 0:.1f}',
+                  f'{result["peak_rss_mb"]:.0f}', f'{result["response_mb"]:.1f}'] + \
+            [f'{result["stages"].get(s, 0):.3f}' for s in stage_names]
+        lines.append(' | '.join(f'{value:>11}' for value in values))
+    return '\n'.join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmarks the data enrichment against a local mock gleif API.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                        help='The input sizes to benchmark.')
+    parser.add_argument('--cardinality', type=int, default=2000, help='The number of distinct LEIs in the input.')
+    parser.add_argument('--extension', type=str, default='.csv', choices=['.csv', '.parquet'],
+                        help='The format of the input and output files.')
+    parser.add_argument('--chunk_size', type=int, default=None, help='Stream the input in chunks of this many rows.')
+    parser.add_argument('--pipeline', action='store_true', help='Overlap the stages of the chunks.')
+    parser.add_argument('--workers', type=int, default=1, help='The number of worker processes.')
+    parser.add_argument('--cache_size', type=int, default=100_000, help='The size of the cache.')
+    parser.add_argument('--cache_records', action='store_true', help='Cache the parsed records.')
+    parser.add_argument('--requests_per_second', type=float, default=1000, help='The client request rate.')
+    parser.add_argument('--burst', type=int, default=10, help='The client burst size.')
+    parser.add_argument('--max_concurrency', type=int, default=10, help='The client concurrency cap.')
+    parser.add_argument('--page_size', type=int, default=100, help='The number of LEIs per request.')
+    parser.add_argument('--retry_attempts', type=int, default=3, help='The number of retry attempts.')
+    parser.add_argument('--sparse_fieldsets', action='store_true',
+                        help='Request only the attributes the parser needs.')
+    parser.add_argument('--compress_responses', action=argparse.BooleanOptionalAction, default=True,
+                        help='Ask for compressed responses.')
+    parser.add_argument('--output', type=str, default=None, help='Write the results to this JSON file.')
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    port = free_port()
+    server = mp.Process(target=serve, args=(port,), daemon=True,
+                        kwargs=dict(latency=args.latency, latency_jitter=args.latency_jitter,
+                                    error_rate=args.error_rate, too_many_requests_rate=args.too_many_requests_rate,
+                                    payload_size=args.payload_size, seed=args.seed, compress=args.compress))
+    server.start()
+    wait_for_port(port)
+
+    options = vars(args)
+    options['url'] = f'http://127.0.0.1:{port}/api/v1/lei-records?filter[lei]='
+    options['seed'] = args.seed or 0
+
+    results = []
+    try:
+        for rows in args.rows:
+            # Each size runs in a fresh process, so the caches are cold and the peak RSS is per size
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn')) as executor:
+                results.append(executor.submit(run_size, rows, options).result())
+            print(json.dumps(results[-1]), flush=True)
+    finally:
+        server.terminate()
+
+    print(format_report(results))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
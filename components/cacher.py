@@ -1,29 +1,228 @@
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
 from abc import abstractmethod, ABC
 from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    size_bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self) -> str:
+        return (f'{self.hits} hits, {self.misses} misses ({self.hit_rate:.1%} hit rate), {self.evictions} evictions, '
+                f'{self.entries} entries, {self.size_bytes} bytes')
+
+
+def sizeof(value: Any) -> int:
+    """
+    Estimates the memory taken by a value, including the items of tuples, lists and dicts.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        size += sum(sizeof(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(sizeof(key) + sizeof(item) for key, item in value.items())
+    return size
 
 
 class ICache(ABC):
     @abstractmethod
-    def add(self, key, value):
+    def add(self, key, value, ttl: Optional[float] = None):
+        """
+        :param ttl: The time to live of this entry in seconds, e.g. shorter for negative results. Default is the
+        cache's default, if it has one.
+        """
         pass
 
     @abstractmethod
     def get(self, key):
         pass
 
+    @abstractmethod
+    def stats(self) -> CacheStats:
+        """
+        :return: The hit, miss and eviction counters and the current size of the cache.
+        """
+        pass
+
+    def get_many(self, keys: Iterable) -> Dict:
+        """
+        Returns the cached values of the given keys. Keys that aren't cached are left out.
+        """
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def add_many(self, items: Dict, ttl: Optional[float] = None) -> None:
+        for key, value in items.items():
+            self.add(key, value, ttl)
+
 
 class LeiLookupCache(ICache):
     """
-    A simple cache implementation using OrderedDict.
+    A simple LRU cache implementation using OrderedDict.
+
+    Entries are moved to the end on every hit, and the least recently used ones are evicted once the cache holds
+    more than `cache_size` entries or, if `max_bytes` is set, once their estimated size exceeds it. Entries added
+    with a TTL expire after it, the others are kept until they are evicted.
     """
-    def __init__(self, cache_size):
+    def __init__(self, cache_size, max_bytes: Optional[int] = None):
+        """
+        :param cache_size: The maximum number of entries.
+        :param max_bytes: The maximum estimated size of the keys and values in bytes. Default is no limit.
+        """
         self.cache_size = cache_size
+        self.max_bytes = max_bytes
         self.cache = OrderedDict()
+        self.sizes = {}
+        self.expires_at = {}
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def add(self, key, value, ttl: Optional[float] = None):
+        """
+        :param ttl: The time to live of this entry in seconds. Default is no expiry.
+        """
+        if key in self.cache:
+            self.size_bytes -= self.sizes[key]
 
-    def add(self, key, value):
-        if len(self.cache) >= self.cache_size:
-            self.cache.popitem(last=False)
         self.cache[key] = value
+        self.cache.move_to_end(key)
+        self.sizes[key] = sizeof(key) + sizeof(value)
+        self.size_bytes += self.sizes[key]
+        if ttl is None:
+            self.expires_at.pop(key, None)
+        else:
+            self.expires_at[key] = time.monotonic() + ttl
+
+        while self.cache and (len(self.cache) > self.cache_size or
+                              (self.max_bytes is not None and self.size_bytes > self.max_bytes)):
+            evicted_key, _ = self.cache.popitem(last=False)
+            self._forget(evicted_key)
+
+    def _forget(self, key) -> None:
+        self.size_bytes -= self.sizes.pop(key)
+        self.expires_at.pop(key, None)
+        self.evictions += 1
+
+    def get(self, key):
+        if key not in self.cache:
+            self.misses += 1
+            return None
+
+        if key in self.expires_at and self.expires_at[key] <= time.monotonic():
+            del self.cache[key]
+            self._forget(key)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.cache.move_to_end(key)
+        return self.cache[key]
+
+    def stats(self) -> CacheStats:
+        return CacheStats(self.hits, self.misses, self.evictions, len(self.cache), self.size_bytes)
+
+
+class SqliteCache(ICache):
+    """
+    A persistent cache stored in a SQLite file, so it is shared across runs and processes.
+
+    Every entry expires after its TTL. Values are pickled, so anything picklable can be cached. The database runs in
+    WAL mode, which lets several processes read while one writes, and writers wait for each other instead of failing.
+    """
+    # SQLite limits the number of variables in a single statement
+    MAX_VARIABLES = 500
+
+    def __init__(self, path: str, ttl: Optional[float] = 7 * 24 * 60 * 60, timeout: float = 30):
+        """
+        :param path: The path of the SQLite file. It's created if it doesn't exist.
+        :param ttl: The default time to live of the entries in seconds. None means entries never expire.
+        Default is 7 days.
+        :param timeout: How long to wait for another process to release the database lock, in seconds.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)')
+        self.purge_expired()
+
+    def _expires_at(self, ttl: Optional[float]) -> Optional[float]:
+        ttl = self.ttl if ttl is None else ttl
+        return None if ttl is None else time.time() + ttl
+
+    def add(self, key, value, ttl: Optional[float] = None):
+        """
+        :param ttl: The time to live of this entry in seconds. Default is the cache's TTL.
+        """
+        self.add_many({key: value}, ttl)
+
+    def add_many(self, items: Dict, ttl: Optional[float] = None) -> None:
+        expires_at = self._expires_at(ttl)
+        rows = [(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires_at) for key, value in items.items()]
+        with self._lock:
+            self._connection.executemany('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)', rows)
 
     def get(self, key):
-        return self.cache.get(key)
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable) -> Dict[Any, Any]:
+        keys = list(keys)
+        values = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(keys), self.MAX_VARIABLES):
+                chunk = keys[i:i + self.MAX_VARIABLES]
+                rows = self._connection.execute(
+                    f'SELECT key, value FROM cache WHERE key IN ({",".join("?" * len(chunk))}) '
+                    f'AND (expires_at IS NULL OR expires_at > ?)', (*chunk, now))
+                values.update((key, pickle.loads(value)) for key, value in rows)
+        self.hits += len(values)
+        self.misses += len(keys) - len(values)
+        return values
+
+    def purge_expired(self) -> None:
+        with self._lock:
+            cursor = self._connection.execute('DELETE FROM cache WHERE expires_at <= ?', (time.time(),))
+            self.evictions += cursor.rowcount
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            entries, size_bytes = self._connection.execute(
+                'SELECT COUNT(*), COALESCE(SUM(LENGTH(key) + LENGTH(value)), 0) FROM cache').fetchone()
+        return CacheStats(self.hits, self.misses, self.evictions, entries, size_bytes)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,71 @@
+import json
+import os
+from typing import Dict, Optional
+
+from globals import Logger
+
+logger = Logger.get_logger(__name__)
+
+
+class CheckpointJournal:
+    """
+    An append-only journal of the progress of a chunked run, so a crashed or killed run can be resumed.
+
+    The first line describes the run, e.g. the input and output files and the chunk size. Every chunk written to the
+    output file then adds a line with its index, the number of rows written so far and the size of the output file.
+    A line torn by a crash is ignored, so the journal always points at the last chunk that was completely written.
+    """
+    def __init__(self, path: str):
+        """
+        :param path: The path to the journal file.
+        """
+        self.path = path
+
+    def start(self, run: Dict) -> None:
+        """
+        Starts a new journal, replacing the journal of a previous run.
+
+        :param run: The description of the run. A resumed run has to match it.
+        """
+        with open(self.path, 'w') as file:
+            file.write(json.dumps(run) + '\n')
+
+    def resume(self, run: Dict) -> Optional[Dict]:
+        """
+        :param run: The description of the run. It has to match the one the journal was started with.
+        :return: The entry of the last chunk written, or None if there is no journal or no chunk was written.
+        """
+        if not os.path.exists(self.path):
+            logger.warning(f'No checkpoint found at {self.path}, starting from the beginning.')
+            return None
+
+        with open(self.path) as file:
+            lines = file.read().splitlines()
+
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f'Ignoring a torn line in the checkpoint {self.path}.')
+
+        if len(entries) < len(lines):
+            # Rewrite the journal without the torn lines, so new entries aren't appended to them
+            with open(self.path, 'w') as file:
+                file.writelines(json.dumps(entry) + '\n' for entry in entries)
+
+        if not entries or entries[0] != run:
+            raise ValueError(f'The checkpoint {self.path} belongs to another run: {entries[0] if entries else None}')
+
+        if len(entries) == 1:
+            return None
+        return entries[-1]
+
+    def record(self, **entry) -> None:
+        """
+        Appends an entry and flushes it to disk before returning.
+        """
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
@@ -0,0 +1,113 @@
+import time
+from collections import deque
+from typing import Callable, Optional, Union
+
+from globals import Logger
+
+logger = Logger.get_logger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a request is refused because the circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to an unhealthy API, so an outage doesn't make every request go through all of its
+    retries.
+
+    The breaker tracks the outcomes of the last `window` requests. Once at least `min_requests` outcomes are known
+    and the share of failures reaches `failure_rate`, the circuit opens and requests fail fast. After `open_seconds`,
+    a single probe request is let through: if it succeeds the circuit closes, otherwise it stays open for another
+    `open_seconds`.
+
+    `allow` returns a ticket, which is passed back with the outcome of the request. While the circuit isn't closed,
+    only the outcome of the probe counts, not those of requests that were let through before the circuit opened.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_rate: float = 0.5, window: int = 20, min_requests: int = 10, open_seconds: float = 30,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param failure_rate: The share of failed requests in the window that opens the circuit. Default is 0.5.
+        :param window: The number of recent request outcomes tracked. Default is 20.
+        :param min_requests: The number of outcomes needed before the circuit can open, so a couple of early
+        failures don't open it. Default is 10.
+        :param open_seconds: How long the circuit stays open before a probe request is let through, in seconds.
+        Default is 30 seconds.
+        :param clock: The clock, returning seconds.
+        """
+        if not 0 < failure_rate <= 1:
+            raise ValueError(f'Invalid failure rate: {failure_rate}')
+        if not 1 <= min_requests <= window:
+            raise ValueError(f'Invalid min requests: {min_requests}')
+
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._retry_at = 0.0
+        # Tickets are numbered from 1, so they are truthy. The number changes whenever the circuit opens or a probe
+        # is let through, so the outcomes of older requests can be told apart
+        self._ticket = 1
+
+    def allow(self) -> Union[int, bool]:
+        """
+        :return: A ticket if a request may be sent now, False otherwise. While the circuit is open, only one probe
+        request is let through every `open_seconds`.
+        """
+        if self.state == self.CLOSED:
+            return self._ticket
+
+        now = self.clock()
+        if now < self._retry_at:
+            return False
+
+        # A probe whose outcome never arrives, e.g. because it was cancelled, is replaced after open_seconds
+        self.state = self.HALF_OPEN
+        self._retry_at = now + self.open_seconds
+        self._ticket += 1
+        return self._ticket
+
+    def record_success(self, ticket: Optional[int] = None) -> None:
+        """
+        :param ticket: The ticket `allow` returned for the request. Default is the latest one.
+        """
+        if self.state != self.CLOSED:
+            if not self._is_probe(ticket):
+                return
+            logger.info('The probe request succeeded, closing the circuit.')
+            self.state = self.CLOSED
+            self._outcomes.clear()
+        self._outcomes.append(False)
+
+    def record_failure(self, ticket: Optional[int] = None) -> None:
+        """
+        :param ticket: The ticket `allow` returned for the request. Default is the latest one.
+        """
+        if self.state != self.CLOSED:
+            if self._is_probe(ticket):
+                self._open()
+            return
+
+        self._outcomes.append(True)
+        failures = sum(self._outcomes)
+        if len(self._outcomes) >= self.min_requests and failures >= self.failure_rate * len(self._outcomes):
+            logger.warning(f'{failures} of the last {len(self._outcomes)} requests failed, opening the circuit for '
+                           f'{self.open_seconds} seconds.')
+            self._open()
+
+    def _is_probe(self, ticket: Optional[int]) -> bool:
+        # Before the first probe, the latest ticket belongs to a request sent while the circuit was closed
+        return self.state == self.HALF_OPEN and ticket in (None, self._ticket)
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._retry_at = self.clock() + self.open_seconds
+        self._ticket += 1
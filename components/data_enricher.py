@@ -1,25 +1,94 @@
 import aiohttp
 import asyncio
-from typing import Optional, List
+import hashlib
+import json
+import logging
+import time
+from typing import Optional, List, Dict, NamedTuple, Sequence, Tuple, Union
 from collections import OrderedDict
 
 import pandas as pd
 from aiohttp import ClientError
 
 from components.cacher import ICache, LeiLookupCache
-from components.data_parser import IDataParser
+from components.circuit_breaker import CircuitBreaker, CircuitOpenError
+from components.data_parser import IDataParser, LEIDataParser, json_loads
+from components.golden_copy import GoldenCopyStore
+from components.http_session import SessionOptions, session_pool
+from components.metrics import metrics, RETRY_BUCKETS
+from components.rate_limiter import IRateLimiter, TokenBucketRateLimiter
+from components.retry_policy import RetryPolicy
 from globals import Logger
+from logger.sampling import LogAggregator
 
 logger = Logger.get_logger(__name__)
 from abc import ABC, abstractmethod
 from aiohttp import ClientError
 
+# A raw API response, or a record parsed from it
+Response = Union[str, Tuple]
+
+# Cached for the IDs whose fetch failed, so they aren't retried again until the entry expires
+FAILED_FETCH = '<fetch failed>'
+
+
+class CachedResponse(NamedTuple):
+    """
+    The cached data of a LEI with the validators of the request it came from, so it can be revalidated with a
+    conditional request once it's stale. See the `revalidate_after` option of `LeiLookupClient`.
+    """
+    value: Response
+    # The request the data came from, as a hash of its url, and the number of LEIs requested with it
+    page: str
+    page_size: int
+    etag: Optional[str]
+    last_modified: Optional[str]
+    # When the data was fetched or last revalidated, as a Unix timestamp
+    checked_at: float
+
+
+class FetchResult(NamedTuple):
+    status: int
+    body: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+
 
 class IClient(ABC):
     @abstractmethod
-    async def fetch(self, id_: str) -> Optional[str]:
+    async def fetch(self, id_: str) -> Optional[Response]:
+        pass
+
+    async def fetch_many(self, ids: List[str]) -> Dict[str, Optional[Response]]:
+        """
+        Fetches the data for several IDs. Clients that can't batch requests fall back to one fetch per ID.
+
+        :param ids: The IDs to fetch.
+        :return: A dict mapping every ID to its fetched data, or None if it couldn't be fetched.
+        """
+        responses = await asyncio.gather(*(self.fetch(id_) for id_ in ids))
+        return dict(zip(ids, responses))
+
+    async def initialize(self) -> None:
+        """
+        Opens the resources of the client, e.g. its HTTP session. Called when entering `async with client`.
+        """
+        pass
+
+    async def close(self) -> None:
+        """
+        Releases the resources of the client. Called when leaving `async with client`.
+        """
         pass
 
+    # If you want to use it with the `with` statement, auto-initialize and close the client
+    async def __aenter__(self):
+        await self.initialize()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
 
 class LeiLookupClient(IClient):
     """
@@ -33,98 +102,546 @@ class LeiLookupClient(IClient):
     defined by the `ICache` interface, which defines the contract for cache implementations.
 
     The client uses aiohttp library for asynchronous requests. The session is initialized when the client is
-    initialized and closed when the client is closed.
+    initialized and closed when the client is closed. Its connection pool, keep-alive, DNS cache and timeouts are
+    configured with `SessionOptions`. By default, clients with the same options share one session, and so one pool of
+    warm connections, while they are open.
+
+    Failed requests are retried according to a `RetryPolicy`: only transient errors are retried, with exponential
+    backoff and jitter, respecting Retry-After headers, within a retry budget shared by all requests.
+
+    The client uses a rate limiter to avoid overwhelming the server with requests. Every request, retries included,
+    goes through it. The rate limiter implementation is defined by the `IRateLimiter` interface, the default is a
+    token bucket allowing 1 request per second with at most 10 requests in flight.
+
+    Several LEIs can be fetched with a single request using `fetch_many`. The gleif API accepts a comma-separated
+    list in the LEI filter, so up to `page_size` LEIs are packed into one request and the returned records are
+    split back out per LEI.
 
-    The client uses a simple rate limiting approach to avoid overwhelming the server with requests.
-    The default rate limit is 0.6 seconds between requests, which means that the client will wait for 0.6 seconds
+    Concurrent requests for the same LEI are coalesced: the first caller fetches it and the others await the same
+    shared future instead of sending requests of their own.
 
+    With a `record_parser`, the responses are parsed as soon as they arrive, and only the compact records are
+    cached and returned instead of the raw JSON responses.
+
+    Negative results are cached too, with shorter TTLs: LEIs unknown to the API for `negative_ttl`, and LEIs whose
+    fetch failed for `failure_ttl`, so duplicate rows and later chunks don't go through the retries again. A
+    `CircuitBreaker` stops sending requests once too many of them fail, so an outage doesn't make every request go
+    through all of its retries. While it's open, the requests fail fast and their LEIs get None.
+
+    With `revalidate_after`, the ETag and Last-Modified validators of each response are cached with the data of its
+    LEIs. Once the data is older than `revalidate_after`, it's stale: the LEIs of a request whose data is all stale
+    are revalidated with a conditional request for the same url, and a 304 response refreshes them without
+    transferring the records again. With `stale_while_revalidate`, stale data is returned at once and revalidated in
+    the background. If a revalidation fails, the stale data is returned.
+
+    To keep the payloads small, compressed responses are asked for (see `SessionOptions.compress`), and with
+    `fields`, only the attributes the parser needs are requested with a JSON:API sparse fieldset. The body is read
+    as bytes and decoded by the JSON parser directly, without decoding it to a string first.
     """
-    def __init__(self, cache: ICache = LeiLookupCache(100), sleep_rate: float = 0.6, retry_attempts: int = 3):
+    def __init__(self, cache: ICache = LeiLookupCache(100), rate_limiter: IRateLimiter = None, retry_attempts: int = 3,
+                 page_size: int = 100, base_url: str = 'https://api.gleif.org/api/v1/lei-records?filter[lei]=',
+                 record_parser: Optional[LEIDataParser] = None,
+                 trace_configs: Optional[List[aiohttp.TraceConfig]] = None,
+                 session_options: Optional[SessionOptions] = None,
+                 share_session: bool = True,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 negative_ttl: Optional[float] = 24 * 60 * 60,
+                 failure_ttl: Optional[float] = 5 * 60,
+                 circuit_breaker: Optional[CircuitBreaker] = None,
+                 revalidate_after: Optional[float] = None,
+                 stale_while_revalidate: bool = False,
+                 fields: Optional[Sequence[str]] = None):
         """
         :param cache: An instance of the cache to store fetched data. Default is LeiLookupCache with a cache size of 100.
-        :param sleep_rate: The rate at which to pause between requests to adhere to rate limiting. Default is 0.6 seconds.
-        :param retry_attempts: The number of retry attempts in case of failed requests. Default is 3 attempts.
+        :param rate_limiter: An instance of the rate limiter every request goes through. Default is a
+        TokenBucketRateLimiter with its default settings.
+        :param retry_attempts: The number of attempts in case of failed requests, used if no retry policy is given.
+        Default is 3 attempts.
+        :param page_size: The maximum number of LEIs packed into one request by `fetch_many`. The gleif API
+        allows up to 200. Default is 100.
+        :param base_url: The LEI lookup url, the LEI filter is appended to it.
+        :param record_parser: If given, the responses are parsed into compact records with it, and the records are
+        cached and returned instead of the raw responses. Default is None.
+        :param trace_configs: aiohttp trace configs attached to the session, e.g. to measure request latencies.
+        :param session_options: The connection pool and timeout settings of the session. Default is SessionOptions
+        with its default settings.
+        :param share_session: Whether to share the session with other clients using the same options. Default is True.
+        :param retry_policy: Decides which failed requests are retried and how long to wait before. Default is a
+        RetryPolicy with `retry_attempts` attempts.
+        :param negative_ttl: How long LEIs unknown to the API are cached, in seconds. None means they aren't cached.
+        Default is 1 day.
+        :param failure_ttl: How long LEIs whose fetch failed are cached as failed, in seconds. None means they aren't
+        cached. Default is 5 minutes.
+        :param circuit_breaker: Stops sending requests while the API is failing. Default is a CircuitBreaker with its
+        default settings.
+        :param revalidate_after: How long fetched data is used before it's revalidated, in seconds. The cache's TTL
+        then bounds how long stale data is kept for revalidation. None means the data is used until the cache entry
+        expires and is fetched again. Default is None.
+        :param stale_while_revalidate: Whether stale data is returned at once and revalidated in the background.
+        Default is False.
+        :param fields: The attributes of the records to request, with a JSON:API sparse fieldset, e.g.
+        `LEIDataParser.sparse_fields()`. The API has to support sparse fieldsets. None requests the whole records.
+        Default is None.
         """
+        if not 1 <= page_size <= 200:
+            raise ValueError(f'Invalid page size: {page_size}')
+
         self.session = None
         self.cache = cache
-        self.base_url = 'https://api.gleif.org/api/v1/lei-records?filter[lei]='
-        self.rate_limit_pause = sleep_rate
-        self.retry_attempts = retry_attempts
+        self.base_url = base_url
+        self.rate_limiter = rate_limiter or TokenBucketRateLimiter()
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=retry_attempts)
+        self.page_size = page_size
+        self.record_parser = record_parser
+        self.trace_configs = trace_configs
+        self.session_options = session_options or SessionOptions()
+        self.share_session = share_session
+        self.negative_ttl = negative_ttl
+        self.failure_ttl = failure_ttl
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.revalidate_after = revalidate_after
+        self.stale_while_revalidate = stale_while_revalidate
+        self.fields = fields
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._background_tasks = set()
+        # Per-ID messages are aggregated into counts, logging each ID would flood the log
+        self.log_aggregator = LogAggregator(logger)
+
+    async def fetch(self, id_: str) -> Optional[Response]:
+        return (await self.fetch_many([id_]))[id_]
+
+    async def fetch_many(self, ids: List[str]) -> Dict[str, Optional[Response]]:
+        """
+        Fetches the data for several LEIs, packing up to `page_size` of them into each request.
+
+        Every LEI is mapped to a response in the same shape `fetch` returns, so the result can be parsed the same
+        way. LEIs unknown to the API get a response with an empty data array, or an empty record with a
+        `record_parser`, and LEIs whose request failed get None.
+
+        :param ids: The LEIs to fetch.
+        :return: A dict mapping every LEI to its data.
+        """
+        unique_ids = list(dict.fromkeys(ids))
+        results = self.cache.get_many(unique_ids)
+        stale = self._check_cached(results)
+        if stale and self.stale_while_revalidate:
+            self.log_aggregator.add('Served stale data for {count} IDs while revalidating them.', len(stale))
+            results.update({id_: entry.value for id_, entry in stale.items()})
+            self._revalidate_in_background(stale)
+
+        missing = []
+        in_flight = {}
+        for id_ in unique_ids:
+            if id_ in results:
+                continue
+            elif id_ in self._in_flight:
+                in_flight[id_] = self._in_flight[id_]
+            else:
+                missing.append(id_)
+
+        if results:
+            self.log_aggregator.add('Fetched data for {count} IDs from cache.', len(results))
+        if in_flight:
+            self.log_aggregator.add('Waited for the in-flight requests of {count} IDs.', len(in_flight))
+
+        self._claim(missing)
+        try:
+            results.update(await self._fetch_ids(missing, stale))
+        finally:
+            self._release({id_: results.get(id_) for id_ in missing})
+
+        shared_results = await asyncio.shield(asyncio.gather(*in_flight.values()))
+        results.update(zip(in_flight, shared_results))
+
+        return results
+
+    def _claim(self, ids: List[str]) -> None:
+        """
+        Registers a shared future for each ID, so concurrent callers wait for this request instead of sending
+        their own.
+        """
+        loop = asyncio.get_running_loop()
+        for id_ in ids:
+            self._in_flight[id_] = loop.create_future()
+
+    def _release(self, results: Dict[str, Optional[Response]]) -> None:
+        """
+        Hands the results to everyone waiting on the shared futures. IDs whose request failed or was cancelled
+        resolve to None.
+        """
+        for id_, data in results.items():
+            future = self._in_flight.pop(id_)
+            if not future.done():
+                future.set_result(data)
+
+    def _check_cached(self, results: Dict) -> Dict[str, CachedResponse]:
+        """
+        Unwraps the cached data in `results` in place. IDs whose fetch failed recently get None, and stale data is
+        taken out.
+
+        :return: The stale cache entries.
+        """
+        failed = 0
+        stale = {}
+        now = time.time()
+        for id_, data in list(results.items()):
+            if isinstance(data, CachedResponse):
+                if self.revalidate_after is None or now - data.checked_at < self.revalidate_after:
+                    results[id_] = data.value
+                else:
+                    stale[id_] = results.pop(id_)
+            elif data == FAILED_FETCH:
+                results[id_] = None
+                failed += 1
+
+        if failed:
+            self.log_aggregator.add('Skipped {count} IDs whose fetch failed recently.', failed, level=logging.WARNING)
+        return stale
+
+    def _revalidate_in_background(self, stale: Dict[str, CachedResponse]) -> None:
+        ids = [id_ for id_ in stale if id_ not in self._in_flight]
+        if not ids:
+            return
+
+        async def revalidate():
+            results = {}
+            try:
+                results = await self._fetch_ids(ids, stale)
+            except Exception as e:
+                logger.error(f'Revalidating {len(ids)} IDs in the background failed: {e!r}')
+            finally:
+                self._release({id_: results.get(id_) for id_ in ids})
+
+        # The IDs are claimed, so they are revalidated only once while concurrent callers get the stale data
+        self._claim(ids)
+        task = asyncio.create_task(revalidate())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
 
-    async def fetch(self, id_: str) -> Optional[str]:
-        data = self.cache.get(id_)
-        if data:
-            logger.info(f'Fetching data for ID {id_} from cache.')
-            return data
+    async def _fetch_ids(self, ids: List[str], stale: Dict[str, CachedResponse]) -> Dict[str, Optional[Response]]:
+        """
+        Fetches the IDs in pages of up to `page_size`. The stale IDs making up the whole page of an earlier request
+        are revalidated with a conditional request for that page.
+        """
+        rest = []
+        groups: Dict[str, List[str]] = {}
+        for id_ in ids:
+            if id_ in stale:
+                groups.setdefault(stale[id_].page, []).append(id_)
+            else:
+                rest.append(id_)
+
+        conditional = []
+        for page, group in groups.items():
+            group.sort()
+            entry = stale[group[0]]
+            if (entry.etag or entry.last_modified) and len(group) == entry.page_size and self._page_key(group) == page:
+                conditional.append(group)
+            else:
+                rest.extend(group)
+
+        # The IDs of a page are sorted, so the same LEIs are requested with the same url when they are revalidated
+        rest.sort()
+        pages = [rest[i:i + self.page_size] for i in range(0, len(rest), self.page_size)]
+
+        requests = [self._fetch_page(page, stale, validators=stale[page[0]]) for page in conditional]
+        requests += [self._fetch_page(page, stale) for page in pages]
+        results = {}
+        for page_results in await asyncio.gather(*requests):
+            results.update(page_results)
+        return results
+
+    def _page_url(self, ids: List[str]) -> str:
+        url = f'{self.base_url}{",".join(ids)}&page[size]={len(ids)}'
+        if self.fields:
+            url += f'&fields[lei-records]={",".join(self.fields)}'
+        return url
+
+    def _page_key(self, ids: List[str]) -> str:
+        return hashlib.blake2b(self._page_url(ids).encode(), digest_size=8).hexdigest()
+
+    async def _fetch_page(self, ids: List[str], stale: Dict[str, CachedResponse],
+                          validators: Optional[CachedResponse] = None) -> Dict[str, Optional[Response]]:
+        """
+        Fetches a page of IDs. With validators, the request is conditional, and a 304 response refreshes the stale
+        data of the IDs.
+        """
+        headers = {}
+        if validators is not None and validators.etag:
+            headers['If-None-Match'] = validators.etag
+        if validators is not None and validators.last_modified:
+            headers['If-Modified-Since'] = validators.last_modified
+
+        try:
+            result = await self._get(self._page_url(ids), f'ID {ids[0]}' if len(ids) == 1 else f'{len(ids)} IDs',
+                                     headers)
+        except CircuitOpenError:
+            self.log_aggregator.add('Skipped {count} IDs, the circuit breaker is open.', len(ids),
+                                    level=logging.WARNING)
+            return self._serve_stale(ids, stale)
+
+        if result is None:
+            self._cache_failures([id_ for id_ in ids if id_ not in stale])
+            return self._serve_stale(ids, stale)
+
+        if result.status == 304:
+            return self._refresh(ids, stale, result)
+
+        if validators is not None:
+            metrics.increment('enrichment_revalidations_total', len(ids), result='modified')
+        results = self._split_response(ids, result)
+        self.log_aggregator.add('Fetched data for {count} IDs from the server.', len(ids))
+        return results
+
+    def _serve_stale(self, ids: List[str], stale: Dict[str, CachedResponse]) -> Dict[str, Optional[Response]]:
+        """
+        Falls back to the stale data of the IDs whose fetch failed, the others get None.
+        """
+        served = {id_: stale[id_].value for id_ in ids if id_ in stale}
+        if served:
+            self.log_aggregator.add('Served stale data for {count} IDs whose revalidation failed.', len(served),
+                                    level=logging.WARNING)
+        return {id_: served.get(id_) for id_ in ids}
+
+    def _refresh(self, ids: List[str], stale: Dict[str, CachedResponse],
+                 result: FetchResult) -> Dict[str, Optional[Response]]:
+        """
+        Marks the stale data of the IDs as fresh after a 304 response.
+        """
+        now = time.time()
+        entries = {id_: stale[id_]._replace(etag=result.etag or stale[id_].etag,
+                                            last_modified=result.last_modified or stale[id_].last_modified,
+                                            checked_at=now) for id_ in ids}
+        self.cache.add_many(entries)
+        metrics.increment('enrichment_revalidations_total', len(ids), result='not_modified')
+        self.log_aggregator.add('Revalidated {count} unchanged IDs without transferring them.', len(ids))
+        return {id_: entry.value for id_, entry in entries.items()}
+
+    def _split_response(self, ids: List[str], result: FetchResult) -> Dict[str, Optional[Response]]:
+        """
+        Splits a response holding the records of several LEIs into the data of each LEI, and caches the LEIs found.
+        """
+        data = result.body
+        try:
+            if self.record_parser:
+                records = self.record_parser.parse_batch_records(data)
+                empty = self.record_parser.empty_record()
+                found = {id_: records[id_] for id_ in ids if id_ in records}
+            else:
+                records = {record['attributes']['lei']: record for record in json_loads(data)['data']}
+                empty = json.dumps({'data': []})
+                found = {id_: json.dumps({'data': [records[id_]]}) for id_ in ids if id_ in records}
+        except (KeyError, TypeError, json.JSONDecodeError) as e:
+            logger.error(f'Unexpected response received for {len(ids)} IDs: {e}')
+            metrics.increment('enrichment_parse_failures_total', len(ids))
+            self._cache_failures(ids)
+            return {id_: None for id_ in ids}
+
+        # Add the data to the cache to avoid fetching it again. LEIs unknown to the API are cached for a shorter time,
+        # e.g. a new LEI may not be published yet
+        if self.revalidate_after is None:
+            self.cache.add_many(found)
+        else:
+            page, now = self._page_key(ids), time.time()
+            self.cache.add_many({id_: CachedResponse(value, page, len(ids), result.etag, result.last_modified, now)
+                                 for id_, value in found.items()})
+        if self.negative_ttl is not None and len(found) < len(ids):
+            self.cache.add_many({id_: empty for id_ in ids if id_ not in found}, ttl=self.negative_ttl)
+
+        return {id_: found.get(id_, empty) for id_ in ids}
+
+    def _cache_failures(self, ids: List[str]) -> None:
+        if self.failure_ttl is not None:
+            self.cache.add_many(dict.fromkeys(ids, FAILED_FETCH), ttl=self.failure_ttl)
+
+    async def _get(self, url: str, description: str, headers: Optional[Dict[str, str]] = None) -> Optional[FetchResult]:
+        """
+        :param headers: The headers of the request, e.g. the validators of a conditional request.
+        :return: The response, or None if the request failed. A 304 response is only returned to conditional requests.
+        :raises CircuitOpenError: If the circuit breaker is open.
+        """
+        policy = self.retry_policy
+        policy.budget.record_request()
 
+        attempt = 0
         try:
-            url = f'{self.base_url}{id_}'
-            for attempt in range(self.retry_attempts):
-                async with self.session.get(url, ssl=False) as response:
-                    # Check if the response is successful
-                    if response.status == 200:
-                        data = await response.text()
-
-                        # Add the data to the cache to avoid fetching it again
-                        self.cache.add(id_, data)
-
-                        await asyncio.sleep(self.rate_limit_pause)
-                        logger.info(f'Fetched data for ID {id_} from the server.')
-                        return data
-                    else:
-                        logger.warning(
-                            f'Response code {response.status} received for ID {id_}. '
-                            f'Retrying ({attempt + 1}/{self.retry_attempts})...')
-                        await asyncio.sleep(1)  # Wait for 1 second before retrying
-
-            logger.error(f'Reached maximum retry attempts for ID {id_}. Unable to fetch data.')
-            return None
-
-        except ClientError as e:
-            logger.error(f'An error occurred during fetch for ID {id_}: {e}')
-            return None
+            for attempt in range(policy.max_attempts):
+                retry_after = None
+                try:
+                    async with self.rate_limiter:
+                        # The breaker is checked once the rate limiter lets the request through, as it may have
+                        # opened while the request was waiting
+                        ticket = self.circuit_breaker.allow()
+                        if not ticket:
+                            metrics.increment('enrichment_requests_short_circuited_total')
+                            raise CircuitOpenError(f'The circuit breaker is open, not fetching {description}.')
+
+                        # The latency is measured from the moment the rate limiter lets the request through
+                        start = time.perf_counter()
+                        status = 'error'
+                        try:
+                            async with self.session.get(url, ssl=False, headers=headers or None) as response:
+                                status = response.status
+                                # Check if the response is successful
+                                if response.status == 200 or (response.status == 304 and headers):
+                                    # aiohttp decompresses the response while reading it, the whole body is then
+                                    # parsed at once. It is kept as bytes, which saves decoding it to a string first
+                                    body = await response.read()
+                                    metrics.increment('enrichment_response_bytes_total', len(body))
+                                    self.circuit_breaker.record_success(ticket)
+                                    return FetchResult(response.status, body, response.headers.get('ETag'),
+                                                       response.headers.get('Last-Modified'))
+
+                                if not policy.should_retry_status(response.status):
+                                    # The API is up, the request itself is at fault
+                                    self.circuit_breaker.record_success(ticket)
+                                    logger.error(f'Response code {response.status} received for {description}. '
+                                                 f'Not retrying.')
+                                    return None
+
+                                self.circuit_breaker.record_failure(ticket)
+                                reason = f'Response code {response.status} received'
+                                retry_after = response.headers.get('Retry-After')
+                        finally:
+                            metrics.observe('enrichment_request_seconds', time.perf_counter() - start)
+                            metrics.increment('enrichment_requests_total', status=status)
+
+                except (ClientError, asyncio.TimeoutError) as e:
+                    if not policy.is_transient_error(e):
+                        logger.error(f'An error occurred during fetch for {description}: {e!r}')
+                        return None
+
+                    self.circuit_breaker.record_failure(ticket)
+                    reason = f'A transient error occurred ({e!r})'
+
+                if attempt + 1 == policy.max_attempts:
+                    break
+
+                if not policy.budget.try_spend():
+                    logger.error(f'{reason} for {description}. The retry budget is exhausted, not retrying.')
+                    return None
+
+                delay = policy.get_delay(attempt, retry_after)
+                logger.warning(f'{reason} for {description}. '
+                               f'Retrying in {delay:.2f} seconds ({attempt + 1}/{policy.max_attempts - 1})...')
+                await asyncio.sleep(delay)
+        finally:
+            metrics.observe('enrichment_request_retries', attempt, RETRY_BUCKETS)
+
+        logger.error(f'Reached maximum retry attempts for {description}. Unable to fetch data.')
+        return None
 
     async def close(self) -> None:
-        if not self.session.closed:
-            await self.session.close()
+        # Let the background revalidations finish, so the refreshed data is cached
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        self.log_aggregator.flush()
+        await session_pool.release(self.session)
 
     async def initialize(self):
-        self.session = aiohttp.ClientSession()
+        if self.share_session:
+            self.session = session_pool.acquire(self.session_options, self.trace_configs)
+        else:
+            self.session = self.session_options.create_session(self.trace_configs)
 
-    # If you want to use it with the `with` statement, auto-initialize and close the session
-    async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
-        return self
 
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.close()
+class LocalLeiClient(IClient):
+    """
+    Client answering LEI lookups from a local `GoldenCopyStore` instead of the gleif API, so the LEIs in the store are
+    enriched without the network.
+
+    `fetch_many` looks all the LEIs up with a few bulk queries. LEIs missing from the store are fetched with the
+    `fallback` client if there is one. Otherwise they get an empty record, like LEIs unknown to the API.
+    """
+    def __init__(self, store: GoldenCopyStore, fallback: Optional[IClient] = None,
+                 record_parser: LEIDataParser = LEIDataParser()):
+        """
+        :param store: The local store of LEI records.
+        :param fallback: The client fetching the LEIs missing from the store, e.g. a LeiLookupClient. Default is None.
+        :param record_parser: Builds the empty records of the LEIs missing from the store. Default is LEIDataParser.
+        """
+        self.store = store
+        self.fallback = fallback
+        self.record_parser = record_parser
+        self.log_aggregator = LogAggregator(logger)
+
+    async def fetch(self, id_: str) -> Optional[Response]:
+        return (await self.fetch_many([id_]))[id_]
+
+    async def fetch_many(self, ids: List[str]) -> Dict[str, Optional[Response]]:
+        ids = list(dict.fromkeys(ids))
+        # The queries run in a thread, so a large batch doesn't block the event loop
+        results: Dict[str, Optional[Response]] = await asyncio.to_thread(self.store.get_many, ids)
+        self.log_aggregator.add('Fetched data for {count} IDs from the local store.', len(results))
+
+        missing = [id_ for id_ in ids if id_ not in results]
+        if missing and self.fallback is not None:
+            self.log_aggregator.add('Fetched data for {count} IDs missing from the local store with the fallback '
+                                    'client.', len(missing))
+            results.update(await self.fallback.fetch_many(missing))
+        elif missing:
+            self.log_aggregator.add('{count} IDs not found in the local store.', len(missing), level=logging.WARNING)
+            results.update(dict.fromkeys(missing, self.record_parser.empty_record()))
+
+        return results
+
+    async def close(self) -> None:
+        self.log_aggregator.flush()
+        if self.fallback is not None:
+            await self.fallback.__aexit__(None, None, None)
+
+    async def initialize(self):
+        if self.fallback is not None:
+            await self.fallback.__aenter__()
 
 
 class DataEnricher:
-    def __init__(self, client: IClient, data_parser: IDataParser):
+    def __init__(self, client: IClient, data_parser: IDataParser, batch_size: int = 100):
         """
                Initializes the DataEnricher.
 
                :param client: An instance of the client used to fetch data from the API. It's injected as a dependency.
                :param data_parser: An instance of the parser used to parse the fetched data. Check the `IDataParser`
+               :param batch_size: The number of IDs handed to the client in each `fetch_many` call.
         """
         self.client = client
         self.data_parser = data_parser
+        self.batch_size = batch_size
 
     async def enrich_data(self, df, ids: List[str]):
-        tasks = [self.client.fetch(id_) for id_ in ids]
-        responses = await asyncio.gather(*tasks)
+        """
+        Adds the fetched fields of each row's ID to the DataFrame, e.g. legal_name, bic and country.
+
+        Each unique ID is fetched and parsed only once, into a small table with one row per unique ID. The table is
+        then joined back to the rows as categorical columns: per row, only a small integer code is stored, pointing
+        into the distinct values of the field. The caller's DataFrame is neither reindexed nor modified.
 
-        # Parse the responses into a list of dicts
-        parsed_responses = self.data_parser.parse_data(responses)
+        :param df: The DataFrame to enrich.
+        :param ids: The ID of each row of df, in the same order.
+        :return: A new DataFrame with the index of df and the fetched fields added as categorical columns.
+        """
+        unique_ids = list(dict.fromkeys(ids))
+        chunks = [unique_ids[i:i + self.batch_size] for i in range(0, len(unique_ids), self.batch_size)]
+        results = {}
+        with metrics.timer('enrichment_stage_seconds', stage='fetch'):
+            for chunk_results in await asyncio.gather(*(self.client.fetch_many(chunk) for chunk in chunks)):
+                results.update(chunk_results)
 
-        # Convert the parsed responses to a DataFrame
-        response_df = pd.DataFrame(parsed_responses)
+        # Parse the raw responses into a list of dicts, the records parsed by the client only need converting
+        with metrics.timer('enrichment_stage_seconds', stage='parse'):
+            responses = [results.get(id_) for id_ in unique_ids]
+            parsed_raw = iter(self.data_parser.parse_data([r for r in responses if not isinstance(r, tuple)]))
+            parsed_responses = [r._asdict() if isinstance(r, tuple) else next(parsed_raw) for r in responses]
+        if not parsed_responses:
+            return df.copy()
 
-        # Reset index of the original DataFrame
-        df.reset_index(drop=True, inplace=True)
+        # The position of each row's ID in the unique IDs
+        row_positions = pd.Index(unique_ids).get_indexer(ids)
 
-        # Concatenate the response data with the original DataFrame
-        enriched_df = pd.concat([df, response_df], axis=1)
+        columns = {}
+        for name in parsed_responses[0]:
+            # The codes of the unique IDs into the distinct values of the field, missing values get -1
+            codes, categories = pd.factorize(pd.Series([parsed[name] for parsed in parsed_responses]), sort=True)
+            columns[name] = pd.Categorical.from_codes(codes[row_positions], categories=categories)
 
-        return enriched_df
+        return df.assign(**columns)
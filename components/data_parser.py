@@ -1,9 +1,16 @@
 import logging
 import json
 from abc import ABC, abstractmethod
-from typing import List, Tuple, Dict
+from typing import Any, Callable, List, NamedTuple, Tuple, Dict, Sequence, Union
+from components.metrics import metrics
 from globals import Logger
 
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 logger = Logger.get_logger(__name__)
 class IDataParser(ABC):
 
@@ -13,53 +20,186 @@ class IDataParser(ABC):
         pass
 
 
+Path = Sequence[Union[str, int]]
+
+
+class LEIRecord(NamedTuple):
+    """
+    The fields extracted from a LEI record. It's a plain tuple, so it takes a fraction of the memory of the raw
+    JSON response it was parsed from.
+    """
+    legal_name: str
+    bic: str
+    country: str
+
+
+class FieldExtractor:
+    """
+    Extracts several fields from a nested record in a single pass.
+
+    The field paths are merged into a tree once, when the extractor is created, so a prefix shared by several fields,
+    e.g. attributes -> entity, is looked up only once per record. Fields whose path doesn't exist get the default value.
+    """
+    def __init__(self, fields: Dict[str, Path], default: Any = ''):
+        """
+        :param fields: Maps each field name to its path in the record, a sequence of dict keys and list indexes.
+        :param default: The value of the fields missing from a record.
+        """
+        self.names = tuple(fields)
+        self.default = default
+
+        tree = {}
+        for index, path in enumerate(fields.values()):
+            node = tree
+            for key in path[:-1]:
+                node = node.setdefault(key, ([], {}))[1]
+            node.setdefault(path[-1], ([], {}))[0].append(index)
+
+        self._walk = self._compile(tree)
+
+    @classmethod
+    def _compile(cls, tree: Dict) -> Callable[[Any, list], None]:
+        steps = [(key, tuple(indexes), cls._compile(children) if children else None)
+                 for key, (indexes, children) in tree.items()]
+
+        def walk(node: Any, values: list) -> None:
+            for key, indexes, walk_child in steps:
+                try:
+                    child = node[key]
+                except (KeyError, IndexError, TypeError):
+                    continue
+                for index in indexes:
+                    values[index] = child
+                if walk_child:
+                    walk_child(child, values)
+
+        return walk
+
+    def extract(self, record: Any) -> Tuple:
+        """
+        :return: The values of the fields, in the order they were given.
+        """
+        values = [self.default] * len(self.names)
+        self._walk(record, values)
+        return tuple(values)
+
+
 class LEIDataParser(IDataParser):
-    @staticmethod
-    def parse_legal_name(item: dict) -> str:
-        try:
-            return item['data'][0]['attributes']['entity']['legalName']['name']
-        except (KeyError, IndexError) as e:
-            logger.warning(f'Failed to parse legal name from data. \n {e}')
-            return ''
+    """
+    Parses gleif API responses. The extracted fields are declared in `FIELDS` as paths into a single LEI record;
+    subclasses can override it to extract other fields.
 
-    @staticmethod
-    def parse_bic(item: dict) -> str:
-        try:
-            return item['data'][0]['attributes']['bic'][0]
-        except (KeyError, IndexError) as e:
-            logger.warning(f'Failed to parse BIC from data. \n {e}')
-            return ''
+    The fields can also be parsed into compact `RECORD` tuples, e.g. to cache them instead of the raw responses.
+    Subclasses that override `FIELDS` should override `RECORD` with a matching NamedTuple.
 
-    @staticmethod
-    def parse_country(item: dict) -> str:
-        try:
-            return item['data'][0]['attributes']['entity']['legalAddress']['country']
-        except (KeyError, IndexError) as e:
-            logger.warning(f'Failed to parse country from data. \n {e}')
-            return ''
+    JSON is decoded with orjson if it is installed, and with the standard json module otherwise.
+    """
+    FIELDS: Dict[str, Path] = {
+        'legal_name': ('attributes', 'entity', 'legalName', 'name'),
+        'bic': ('attributes', 'bic', 0),
+        'country': ('attributes', 'entity', 'legalAddress', 'country'),
+    }
+
+    # The path of the LEI in a record, used to split multi-record responses
+    LEI_PATH: Path = ('attributes', 'lei')
+
+    RECORD = LEIRecord
+
+    extractor = FieldExtractor(FIELDS)
+    lei_extractor = FieldExtractor({'lei': LEI_PATH}, default=None)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.extractor = FieldExtractor(cls.FIELDS)
+        cls.lei_extractor = FieldExtractor({'lei': cls.LEI_PATH}, default=None)
 
     @classmethod
     def parse_data(cls, data: List[str]) -> List[Dict]:
         """
         Parses the data into a list of dictionaries. If there is any changes in json structure,
-        this function does not need to be changed. Just change the parse functions above.
+        this function does not need to be changed. Just change the field paths in `FIELDS`.
 
         :param data: The list of API response strings.
         :return: The parsed data as a list of dictionaries.
         """
+        names = cls.extractor.names
         parsed_data = []
+        failed = incomplete = 0
         for item in data:
             try:
-                item = json.loads(item)
-                legal_name = cls.parse_legal_name(item)
-                bic = cls.parse_bic(item)
-                country = cls.parse_country(item)
-                parsed_data.append({
-                    'legal_name': legal_name,
-                    'bic': bic,
-                    'country': country,
-                })
+                records = json_loads(item)['data']
+                values = cls.extractor.extract(records[0] if records else None)
             except (IndexError, KeyError, json.JSONDecodeError, TypeError) as e:
-                parsed_data.append({'legal_name': None, 'bic': None, 'country': None})
-                logger.error(f'Error occurred while parsing data. \n {e}' )
+                parsed_data.append(dict.fromkeys(names))
+                failed += 1
+                logger.debug(f'Error occurred while parsing data. \n {e}')
+                continue
+
+            incomplete += cls.extractor.default in values
+            parsed_data.append(dict(zip(names, values)))
+
+        if failed:
+            logger.error(f'Error occurred while parsing {failed} of {len(data)} responses.')
+            metrics.increment('enrichment_parse_failures_total', failed)
+        if incomplete:
+            logger.warning(f'Failed to parse some fields of {incomplete} of {len(data)} responses.')
+            metrics.increment('enrichment_parse_incomplete_total', incomplete)
         return parsed_data
+
+    @classmethod
+    def parse_records(cls, records: List[dict]) -> List[Dict]:
+        """
+        Parses already decoded LEI records, e.g. the elements of a multi-record data array.
+
+        :param records: The list of LEI records.
+        :return: The parsed data as a list of dictionaries.
+        """
+        names = cls.extractor.names
+        parsed_data = []
+        incomplete = 0
+        for record in records:
+            values = cls.extractor.extract(record)
+            incomplete += cls.extractor.default in values
+            parsed_data.append(dict(zip(names, values)))
+
+        if incomplete:
+            logger.warning(f'Failed to parse some fields of {incomplete} of {len(records)} records.')
+            metrics.increment('enrichment_parse_incomplete_total', incomplete)
+        return parsed_data
+
+    @classmethod
+    def sparse_fields(cls) -> List[str]:
+        """
+        :return: The attributes and relationships of a record that the fields and the LEI are read from, e.g. to
+        request only them with a JSON:API sparse fieldset.
+        """
+        paths = [*cls.FIELDS.values(), cls.LEI_PATH]
+        return sorted({path[1] for path in paths if len(path) > 1 and path[0] in ('attributes', 'relationships')})
+
+    @classmethod
+    def parse_batch(cls, data: Union[str, bytes]) -> Dict[str, Dict]:
+        """
+        Parses a response holding several LEI records in its data array.
+
+        :param data: The API response string.
+        :return: The parsed data of each record, keyed by LEI.
+        """
+        return {lei: record._asdict() for lei, record in cls.parse_batch_records(data).items()}
+
+    @classmethod
+    def parse_batch_records(cls, data: Union[str, bytes]) -> Dict[str, Tuple]:
+        """
+        Parses a response holding several LEI records in its data array into compact `RECORD` tuples.
+
+        :param data: The API response, as a string or as the raw bytes of the body.
+        :return: The record of each LEI in the response, keyed by LEI.
+        """
+        return {cls.lei_extractor.extract(record)[0]: cls.RECORD(*cls.extractor.extract(record))
+                for record in json_loads(data)['data']}
+
+    @classmethod
+    def empty_record(cls) -> Tuple:
+        """
+        :return: The record of a LEI unknown to the API, with every field missing.
+        """
+        return cls.RECORD(*[cls.extractor.default] * len(cls.extractor.names))
@@ -1,6 +1,6 @@
 import os
 from abc import ABC, abstractmethod
-from typing import Callable, Union
+from typing import Callable, Dict, Iterator, List, Optional, Union
 
 from globals import Logger
 
@@ -8,6 +8,34 @@ logger = Logger.get_logger(__name__)
 
 import pandas as pd
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+class DataSourceError(Exception):
+    """
+    Raised when a file streamed in chunks turns out to be unreadable part of the way through.
+    """
+
+
+def handle_stream_errors(chunks: Iterator[pd.DataFrame], filename: str) -> Iterator[pd.DataFrame]:
+    """
+    The chunks of a file are read after `load_data` has returned, so `handle_io_errors` doesn't see the errors of a
+    file that is malformed half way. They are logged like there and raised as a `DataSourceError`, so the run can
+    stop after the chunks read so far.
+    """
+    try:
+        yield from chunks
+    except pd.errors.ParserError as e:
+        logger.error(f"Error parsing data from file {filename}. {e}")
+        raise DataSourceError(f"Reading {filename} failed.") from e
+    except Exception as e:
+        logger.error(f"An unexpected error occurred while reading {filename}: {e}")
+        raise DataSourceError(f"Reading {filename} failed.") from e
+
+
 def handle_io_errors(is_save_function: bool):
     def decorator(func: Callable):
         def wrapper(*args, **kwargs):
@@ -40,33 +68,206 @@ def handle_io_errors(is_save_function: bool):
 
 
 class IDataSource(ABC):
+    # Whether the files written by the data source can be truncated, e.g. to resume an interrupted run
+    truncatable = False
 
     @abstractmethod
-    def save_data(self, file, filename: str):
+    def save_data(self, file, filename: str, append: bool = False):
+        pass
+
+    def load_data(self, filename: str, chunk_size: Optional[int] = None):
         pass
 
-    def load_data(self, filename: str):
+    def close(self) -> None:
+        """
+        Finalizes the files written with `save_data(..., append=True)`.
+        """
         pass
 
+    def truncate(self, filename: str, size: int) -> None:
+        """
+        Truncates a file written with `save_data` to `size` bytes, e.g. to drop a chunk that was partially written
+        when a run crashed.
+        """
+        raise NotImplementedError(f'Truncating is not supported by {type(self).__name__}.')
+
 
 class CsvDataSource(IDataSource):
     """
     This class is responsible for saving and loading data from CSV files.
     You can use it as a template for other data sources, e.g. databases.
+
+    Large files can be streamed: with a chunk size, `load_data` yields the file in chunks, and each processed chunk
+    can be appended to the output file with `save_data(..., append=True)`.
     """
+    truncatable = True
+
+    def __init__(self, columns: Optional[List[str]] = None):
+        """
+        :param columns: The columns to load. Default is all columns.
+        """
+        self.columns = columns
 
     @handle_io_errors(is_save_function=True)
-    def save_data(self, file: pd.DataFrame, filename: str) -> Union[bool, None]:
+    def save_data(self, file: pd.DataFrame, filename: str, append: bool = False) -> Union[bool, None]:
+        if append:
+            # Only the first chunk written to a file gets the header
+            header = not os.path.exists(filename) or os.path.getsize(filename) == 0
+            file.to_csv(filename, mode='a', header=header, index=False)
+            logger.info(f"{len(file)} rows appended to {filename}")
+            return True
+
         file.to_csv(filename, index=False)
         logger.info(f"Data saved to {filename}")
         return True
 
     @handle_io_errors(is_save_function=False)
-    def load_data(self, filename: str) -> pd.DataFrame:
+    def load_data(self, filename: str, chunk_size: Optional[int] = None) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+        """
+        :param filename: The path to the CSV file.
+        :param chunk_size: If given, the file is streamed and an iterator of DataFrames with up to chunk_size rows
+        is returned instead of a single DataFrame.
+        """
+        if not os.path.exists(filename):
+            logger.error(f"File {filename} does not exist.")
+            return pd.DataFrame()
+
+        if chunk_size:
+            return handle_stream_errors(self._load_chunks(filename, chunk_size), filename)
+
+        data = pd.read_csv(filename, usecols=self.columns) if self.columns else pd.read_csv(filename)
+        logger.info(f"Data loaded from {filename} with shape {data.shape}")
+        return data
+
+    def _load_chunks(self, filename: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+        with pd.read_csv(filename, chunksize=chunk_size, usecols=self.columns) as reader:
+            for chunk in reader:
+                logger.info(f"Chunk loaded from {filename} with shape {chunk.shape}")
+                yield chunk
+
+    def truncate(self, filename: str, size: int) -> None:
+        os.truncate(filename, size)
+        logger.info(f"{filename} truncated to {size} bytes")
+
+
+class ParquetDataSource(IDataSource):
+    """
+    This class is responsible for saving and loading data from Parquet files. It requires pyarrow.
+
+    Parquet keeps the column dtypes, only the requested columns are read, and files are compressed. With a chunk
+    size, `load_data` streams the file batch by batch. Chunks saved with `save_data(..., append=True)` go to an open
+    writer, call `close` once all of them are written.
+    """
+    def __init__(self, columns: Optional[List[str]] = None, compression: str = 'zstd'):
+        """
+        :param columns: The columns to load. Default is all columns.
+        :param compression: The compression codec of the written files, e.g. zstd, snappy, gzip or none.
+        Default is zstd.
+        """
+        if pq is None:
+            raise ImportError('pyarrow is required for Parquet files. Install it with `pip install pyarrow`.')
+
+        self.columns = columns
+        self.compression = compression
+        self._writers: Dict[str, pq.ParquetWriter] = {}
+
+    @handle_io_errors(is_save_function=True)
+    def save_data(self, file: pd.DataFrame, filename: str, append: bool = False) -> Union[bool, None]:
+        table = self._to_table(file)
+
+        if not append:
+            self._close_writer(filename)
+            pq.write_table(table, filename, compression=self.compression)
+            logger.info(f"Data saved to {filename}")
+            return True
+
+        writer = self._writers.get(filename)
+        if writer is None:
+            # A Parquet file can't be appended to in place, so the rows already in it are rewritten first
+            existing = pq.read_table(filename) if os.path.exists(filename) else None
+            if existing is not None:
+                existing = existing.cast(self._chunk_schema(existing.schema))
+            writer = pq.ParquetWriter(filename, (existing or table).schema, compression=self.compression)
+            self._writers[filename] = writer
+            if existing is not None:
+                writer.write_table(existing)
+
+        writer.write_table(table.cast(writer.schema))
+        logger.info(f"{len(file)} rows appended to {filename}")
+        return True
+
+    @classmethod
+    def _to_table(cls, file: pd.DataFrame) -> 'pa.Table':
+        table = pa.Table.from_pandas(file, preserve_index=False)
+        return table.cast(cls._chunk_schema(table.schema))
+
+    @staticmethod
+    def _chunk_schema(schema: 'pa.Schema') -> 'pa.Schema':
+        """
+        Returns the schema that all the chunks appended to a file share, as the writer's schema is fixed by the first
+        chunk.
+
+        Categorical columns get the narrowest index type for their number of categories, which differs between
+        chunks, so the indexes are widened to int32. Columns without any values, e.g. the enriched columns of a chunk
+        whose LEIs are all unknown, get the null type, which no other chunk can be cast to, so they become strings.
+        """
+        def chunk_type(data_type: 'pa.DataType') -> 'pa.DataType':
+            if pa.types.is_dictionary(data_type):
+                return pa.dictionary(pa.int32(), chunk_type(data_type.value_type))
+            return pa.string() if pa.types.is_null(data_type) else data_type
+
+        return pa.schema([field.with_type(chunk_type(field.type)) for field in schema], metadata=schema.metadata)
+
+    @handle_io_errors(is_save_function=False)
+    def load_data(self, filename: str, chunk_size: Optional[int] = None) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+        """
+        :param filename: The path to the Parquet file.
+        :param chunk_size: If given, the file is streamed and an iterator of DataFrames with up to chunk_size rows
+        is returned instead of a single DataFrame.
+        """
         if not os.path.exists(filename):
             logger.error(f"File {filename} does not exist.")
             return pd.DataFrame()
 
-        data = pd.read_csv(filename)
+        if chunk_size:
+            return handle_stream_errors(self._load_chunks(filename, chunk_size), filename)
+
+        data = pq.read_table(filename, columns=self.columns).to_pandas()
         logger.info(f"Data loaded from {filename} with shape {data.shape}")
-        return data
\ No newline at end of file
+        return data
+
+    def _load_chunks(self, filename: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+        with pq.ParquetFile(filename) as parquet_file:
+            for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=self.columns):
+                chunk = batch.to_pandas()
+                logger.info(f"Chunk loaded from {filename} with shape {chunk.shape}")
+                yield chunk
+
+    def _close_writer(self, filename: str) -> None:
+        writer = self._writers.pop(filename, None)
+        if writer is not None:
+            writer.close()
+
+    def close(self) -> None:
+        for filename in list(self._writers):
+            self._close_writer(filename)
+
+
+DATA_SOURCES = {
+    '.csv': CsvDataSource,
+    '.parquet': ParquetDataSource,
+    '.pq': ParquetDataSource,
+}
+
+
+def get_data_source(filename: str, **kwargs) -> IDataSource:
+    """
+    Returns the data source for the file's extension.
+
+    :param filename: The path to the file.
+    :param kwargs: Passed to the data source, e.g. columns.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in DATA_SOURCES:
+        raise NotImplementedError(f'Files with the extension {extension} are not supported yet.')
+    return DATA_SOURCES[extension](**kwargs)
\ No newline at end of file
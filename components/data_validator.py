@@ -1,10 +1,60 @@
 from abc import ABC, abstractmethod
+import string
+from typing import Tuple
+
+import numpy as np
 import pandas as pd
 from pandas.api.types import is_numeric_dtype
 from globals import Logger
 
 logger = Logger.get_logger(__name__)
 
+LEI_LENGTH = 20
+
+# The value of each ASCII character in the ISO 17442 check digit calculation: 0-9 for digits, 10-35 for A-Z, and -1
+# for the characters that aren't allowed in a LEI
+CHARACTER_VALUES = np.full(128, -1, dtype=np.int64)
+for value, character in enumerate(string.digits + string.ascii_uppercase):
+    CHARACTER_VALUES[ord(character)] = value
+
+
+def check_leis(leis: pd.Series) -> np.ndarray:
+    """
+    Validates LEIs against ISO 17442: 20 characters, 18 digits or upper case letters followed by 2 check digits, and
+    the whole LEI, with letters converted to numbers, must be 1 modulo 97.
+
+    The checks are array operations over the distinct LEIs, there is no loop over the rows.
+
+    :param leis: The LEIs.
+    :return: The reason each LEI is invalid: 'missing', 'length', 'characters' or 'check digits', and '' for the
+    valid ones.
+    """
+    codes, uniques = pd.factorize(leis)
+    uniques = pd.Series(uniques, dtype=object).astype(str)
+    reasons = np.full(len(uniques), '', dtype=object)
+
+    lengths = uniques.str.len().to_numpy()
+    reasons[lengths != LEI_LENGTH] = 'length'
+    has_length = lengths == LEI_LENGTH
+
+    # One row of code points per LEI, mapped to their values
+    points = np.asarray(uniques[has_length].tolist(), dtype=f'U{LEI_LENGTH}').view(np.uint32)
+    points = points.reshape(-1, LEI_LENGTH)
+    values = np.where(points < 128, CHARACTER_VALUES[np.minimum(points, 127)], -1)
+    valid_characters = (values >= 0).all(axis=1) & (values[:, -2:] < 10).all(axis=1)
+
+    # The LEI read as a number modulo 97, one character at a time: a digit shifts it by 1 decimal, a letter by 2
+    remainders = np.zeros(len(values), dtype=np.int64)
+    for column in values.T:
+        remainders = (remainders * np.where(column < 10, 10, 100) + column) % 97
+
+    reasons[np.flatnonzero(has_length)[~valid_characters]] = 'characters'
+    reasons[np.flatnonzero(has_length)[valid_characters & (remainders != 1)]] = 'check digits'
+
+    # Missing LEIs are -1 in codes
+    row_reasons = np.where(codes >= 0, reasons[codes] if len(reasons) else '', 'missing')
+    return row_reasons.astype(object)
+
 
 
 class IDataValidator(ABC):
@@ -16,6 +66,15 @@ class IDataValidator(ABC):
     def validate_output_data(self, df: pd.DataFrame) -> bool:
         pass
 
+    def split_invalid_rows(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Splits off the rows that can't be enriched, e.g. with a malformed ID, so they aren't fetched.
+
+        :return: The valid rows, and the invalid rows with the reason in a reject_reason column. By default all the
+        rows are valid.
+        """
+        return df, df.iloc[:0].assign(reject_reason=pd.Series(dtype=object))
+
 
 class LEIDataValidator(IDataValidator):
     """
@@ -38,6 +97,23 @@ class LEIDataValidator(IDataValidator):
         logger.info("Input data validated successfully!")
         return True
 
+    def split_invalid_rows(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Splits off the rows with a missing or malformed LEI, see `check_leis`. Sending them to the API would only
+        waste requests and retries.
+        """
+        reasons = check_leis(df['lei'])
+        invalid = reasons != ''
+        if not invalid.any():
+            return df, df.iloc[:0].assign(reject_reason=pd.Series(dtype=object))
+
+        rejects = df[invalid].assign(reject_reason=reasons[invalid])
+        counts = rejects['reject_reason'].value_counts()
+        logger.warning(f"{len(rejects)} of {len(df)} rows have an invalid LEI ("
+                       f"{', '.join(f'{reason}: {count}' for reason, count in counts.items())}), e.g. "
+                       f"{', '.join(map(str, rejects['lei'].drop_duplicates().head(3)))}")
+        return df[~invalid], rejects
+
     def validate_output_data(self, df: pd.DataFrame) -> bool:
         expected_columns = ['lei', 'notional', 'rate', 'legal_name', 'country', 'transaction_costs']
         missing_columns = [col for col in expected_columns if col not in df.columns]
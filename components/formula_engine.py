@@ -0,0 +1,215 @@
+import ast
+import json
+import operator
+from typing import Callable, Dict, Iterable, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+from globals import Logger
+
+logger = Logger.get_logger(__name__)
+
+Columns = Dict[str, np.ndarray]
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+UNARY_OPERATORS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+FUNCTIONS = {
+    'abs': np.abs,
+    'sqrt': np.sqrt,
+    'log': np.log,
+    'exp': np.exp,
+    'min': np.minimum,
+    'max': np.maximum,
+    'round': np.round,
+}
+
+
+class Expression:
+    """
+    An arithmetic expression over the columns of a DataFrame, e.g. "abs(notional * (1 / rate) - notional)".
+
+    The expression is parsed and compiled once into a tree of closures, which is then evaluated on numpy arrays.
+    Only numbers, column names, arithmetic operators and the functions in FUNCTIONS are allowed, so expressions read
+    from a config file can't run arbitrary code.
+    """
+    def __init__(self, source: str):
+        """
+        :param source: The expression, a Python arithmetic expression.
+        """
+        self.source = source
+        self.columns: Set[str] = set()
+        try:
+            self._evaluate = self._compile(ast.parse(source, mode='eval').body)
+        except SyntaxError as e:
+            raise ValueError(f'Invalid expression {source!r}: {e.msg}') from e
+
+    def __call__(self, columns: Columns) -> np.ndarray:
+        return self._evaluate(columns)
+
+    def __repr__(self) -> str:
+        return f'Expression({self.source!r})'
+
+    def _compile(self, node: ast.AST) -> Callable[[Columns], np.ndarray]:
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) \
+                and not isinstance(node.value, bool):
+            value = float(node.value)
+            return lambda columns: value
+
+        if isinstance(node, ast.Name):
+            name = node.id
+            self.columns.add(name)
+            return lambda columns: columns[name]
+
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+            function = BINARY_OPERATORS[type(node.op)]
+            left, right = self._compile(node.left), self._compile(node.right)
+            return lambda columns: function(left(columns), right(columns))
+
+        if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+            function = UNARY_OPERATORS[type(node.op)]
+            operand = self._compile(node.operand)
+            return lambda columns: function(operand(columns))
+
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS \
+                and not node.keywords:
+            function = FUNCTIONS[node.func.id]
+            arguments = [self._compile(argument) for argument in node.args]
+            return lambda columns: function(*(argument(columns) for argument in arguments))
+
+        raise ValueError(f'Unsupported syntax in expression {self.source!r}: {ast.dump(node)}')
+
+
+class RuleTable:
+    """
+    The rules of one derived column: one expression per key, e.g. per country. Rows whose key has no rule or is
+    missing, e.g. after a failed enrichment, get the default expression, or NaN if there is none.
+    """
+    def __init__(self, rules: Dict[str, str], default: Optional[str] = None):
+        """
+        :param rules: The expression of each key.
+        :param default: The expression of the keys without a rule. Default is None, leaving them as NaN.
+        """
+        self.rules = {key: Expression(source) for key, source in rules.items()}
+        self.default = Expression(default) if default is not None else None
+
+    def get(self, key) -> Optional[Expression]:
+        return self.rules.get(key, self.default)
+
+    @property
+    def columns(self) -> Set[str]:
+        expressions = list(self.rules.values()) + ([self.default] if self.default else [])
+        return set().union(*(expression.columns for expression in expressions))
+
+
+class FormulaEngine:
+    """
+    Calculates several derived columns from rule tables in a single pass over the DataFrame.
+
+    The rows are grouped by the key column once. Each group is then calculated with vector operations on its rows
+    only, for all the rule tables at once, so adding a key or a column doesn't add another pass over the data.
+
+    Example config:
+        {
+            "key": "country",
+            "formulas": {
+                "transaction_costs": {
+                    "rules": {"GB": "notional * rate - notional", "NL": "abs(notional * (1 / rate) - notional)"},
+                    "default": null
+                }
+            }
+        }
+    """
+    def __init__(self, tables: Dict[str, RuleTable], key: str = 'country'):
+        """
+        :param tables: The rule table of each derived column.
+        :param key: The column the rules are selected by. Default is 'country'.
+        """
+        self.tables = tables
+        self.key = key
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'FormulaEngine':
+        tables = {name: RuleTable(table['rules'], table.get('default'))
+                  for name, table in config['formulas'].items()}
+        return cls(tables, key=config.get('key', 'country'))
+
+    @classmethod
+    def from_file(cls, filename: str) -> 'FormulaEngine':
+        with open(filename) as file:
+            return cls.from_config(json.load(file))
+
+    @property
+    def columns(self) -> Set[str]:
+        return set().union(*(table.columns for table in self.tables.values()))
+
+    def evaluate(self, df: pd.DataFrame, names: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """
+        :param df: input DataFrame
+        :param names: The derived columns to calculate. Default is all of them.
+        :return: The derived columns, aligned with df's index. Rows without a matching rule are NaN.
+        """
+        tables = {name: self.tables[name] for name in (names or self.tables)}
+
+        missing_columns = sorted((set().union(*(t.columns for t in tables.values())) | {self.key}) - set(df.columns))
+        if missing_columns:
+            raise ValueError(f'Missing columns for the formulas: {", ".join(missing_columns)}')
+
+        codes, keys = pd.factorize(df[self.key])
+        results = {name: np.full(len(df), np.nan) for name in tables}
+        matched = dict.fromkeys(tables, 0)
+
+        # Sort the row positions by key once, so every group is a contiguous slice of `order`. The rows with a missing
+        # key have the code -1 and come first, they get the default expressions
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(-1, len(keys) + 1))
+
+        arrays: Columns = {}
+        for code, key in [(-1, None), *enumerate(keys)]:
+            expressions = {name: table.get(key) for name, table in tables.items()}
+            expressions = {name: expression for name, expression in expressions.items() if expression is not None}
+            if not expressions:
+                continue
+
+            rows = order[bounds[code + 1]:bounds[code + 2]]
+            if not len(rows):
+                continue
+            needed = set().union(*(expression.columns for expression in expressions.values()))
+            for column in needed - arrays.keys():
+                arrays[column] = df[column].to_numpy(dtype=float)
+            group = {column: arrays[column][rows] for column in needed}
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for name, expression in expressions.items():
+                    results[name][rows] = expression(group)
+                    matched[name] += len(rows)
+
+        for name, count in matched.items():
+            unmatched = len(df) - count
+            if unmatched:
+                logger.warning(f'{name} not calculated for {unmatched} rows without a matching rule.')
+        logger.info(f'{", ".join(results)} calculated for {len(df)} rows.')
+
+        return pd.DataFrame(results, index=df.index)
+
+    def calculate(self, df: pd.DataFrame, names: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """
+        :return: df with the derived columns added.
+        """
+        result = self.evaluate(df, names)
+        for name in result.columns:
+            df[name] = result[name]
+        return df
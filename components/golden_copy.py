@@ -0,0 +1,157 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Iterator, List
+
+import pandas as pd
+
+from components.data_parser import LEIDataParser, LEIRecord, json_loads
+from globals import Logger
+
+logger = Logger.get_logger(__name__)
+
+# The columns of the GLEIF golden copy and BIC-to-LEI mapping CSV files, mapped to the columns of the store
+CSV_COLUMNS = {
+    'LEI': 'lei',
+    'Entity.LegalName': 'legal_name',
+    'Entity.LegalAddress.Country': 'country',
+    'BIC': 'bic',
+}
+
+STORE_COLUMNS = ['lei', 'legal_name', 'bic', 'country']
+
+
+class GoldenCopyStore:
+    """
+    A local store of LEI records in a SQLite file, keyed by LEI and holding the legal name, BIC and country, so the
+    LEIs it holds can be enriched without the network.
+
+    It's filled by `ingest` from local files:
+    - GLEIF golden copy and delta CSV files (LEI-CDF format), plain or zipped. Only the LEI, Entity.LegalName and
+      Entity.LegalAddress.Country columns are read.
+    - GLEIF BIC-to-LEI mapping CSV files, with LEI and BIC columns.
+    - JSON files of lei-records in the format of the gleif API, either a response with a data array or one record
+      per line.
+
+    Records are upserted, so a delta file simply overwrites the records it changes. Columns missing from a file, e.g.
+    the BIC of the golden copy, keep their stored value.
+    """
+    # SQLite limits the number of variables in a single statement
+    MAX_VARIABLES = 500
+
+    def __init__(self, path: str, timeout: float = 30):
+        """
+        :param path: The path of the SQLite file. It's created if it doesn't exist.
+        :param timeout: How long to wait for another process to release the database lock, in seconds.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS lei_records (lei TEXT PRIMARY KEY, legal_name TEXT NOT NULL DEFAULT '', "
+            "bic TEXT NOT NULL DEFAULT '', country TEXT NOT NULL DEFAULT '') WITHOUT ROWID")
+
+    def upsert(self, df: pd.DataFrame) -> int:
+        """
+        Inserts or updates records.
+
+        :param df: The records, with a lei column and any of the legal_name, bic and country columns.
+        :return: The number of records upserted.
+        """
+        columns = [column for column in STORE_COLUMNS if column in df.columns]
+        if 'lei' not in columns:
+            raise ValueError(f'No lei column in the records: {list(df.columns)}')
+
+        updates = ', '.join(f'{column} = excluded.{column}' for column in columns if column != 'lei')
+        conflict = f'DO UPDATE SET {updates}' if updates else 'DO NOTHING'
+        df = df[columns].fillna('')
+        df = df[df['lei'] != '']
+
+        with self._lock:
+            self._connection.execute('BEGIN')
+            try:
+                self._connection.executemany(
+                    f'INSERT INTO lei_records ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+                    f'ON CONFLICT (lei) {conflict}', df.itertuples(index=False, name=None))
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+        return len(df)
+
+    def ingest(self, filename: str, chunk_size: int = 100_000) -> int:
+        """
+        Loads a golden copy, delta, BIC mapping or JSON file into the store.
+
+        :param filename: The path to the file.
+        :param chunk_size: The number of records read and written at once.
+        :return: The number of records upserted.
+        """
+        count = 0
+        for chunk in self._read(filename, chunk_size):
+            count += self.upsert(chunk)
+            logger.info(f'{count} records ingested from {filename}.')
+        return count
+
+    def _read(self, filename: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+        name = filename.lower()
+        if name.endswith(('.csv', '.csv.zip', '.zip', '.csv.gz')):
+            with pd.read_csv(filename, usecols=lambda column: column in CSV_COLUMNS, dtype=str,
+                             keep_default_na=False, chunksize=chunk_size) as reader:
+                for chunk in reader:
+                    yield chunk.rename(columns=CSV_COLUMNS)
+        elif name.endswith(('.json', '.jsonl')):
+            for records in self._read_json(filename, chunk_size):
+                yield pd.DataFrame([{'lei': LEIDataParser.lei_extractor.extract(record)[0], **parsed}
+                                    for record, parsed in zip(records, LEIDataParser.parse_records(records))])
+        else:
+            raise NotImplementedError(f'Ingesting {filename} is not supported yet.')
+
+    @staticmethod
+    def _read_json(filename: str, chunk_size: int) -> Iterator[List[Dict]]:
+        with open(filename, 'rb') as file:
+            if filename.lower().endswith('.jsonl'):
+                records = []
+                for line in file:
+                    if line.strip():
+                        records.append(json_loads(line))
+                    if len(records) == chunk_size:
+                        yield records
+                        records = []
+                if records:
+                    yield records
+                return
+
+            data = json_loads(file.read())
+
+        records = data['data'] if isinstance(data, dict) else data
+        for i in range(0, len(records), chunk_size):
+            yield records[i:i + chunk_size]
+
+    def get_many(self, leis: Iterable[str]) -> Dict[str, LEIRecord]:
+        """
+        :return: The records of the LEIs in the store, keyed by LEI. LEIs missing from the store are left out.
+        """
+        leis = list(leis)
+        records = {}
+        with self._lock:
+            for i in range(0, len(leis), self.MAX_VARIABLES):
+                chunk = leis[i:i + self.MAX_VARIABLES]
+                rows = self._connection.execute(f'SELECT lei, legal_name, bic, country FROM lei_records '
+                                                f'WHERE lei IN ({",".join("?" * len(chunk))})', chunk)
+                records.update((lei, LEIRecord(legal_name, bic, country)) for lei, legal_name, bic, country in rows)
+        return records
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM lei_records').fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
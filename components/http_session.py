@@ -0,0 +1,107 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+from globals import Logger
+
+logger = Logger.get_logger(__name__)
+
+# aiohttp decodes brotli responses only if one of these packages is installed, so br is only asked for then
+try:
+    import brotli  # noqa: F401
+    HAS_BROTLI = True
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        HAS_BROTLI = True
+    except ImportError:
+        HAS_BROTLI = False
+
+
+def accept_encoding(compress: bool = True) -> str:
+    """
+    :return: The Accept-Encoding header asking for the compressions that can be decoded, or for uncompressed responses.
+    """
+    if not compress:
+        return 'identity'
+    return 'gzip, deflate, br' if HAS_BROTLI else 'gzip, deflate'
+
+
+@dataclass(frozen=True)
+class SessionOptions:
+    """
+    Connection pool and timeout settings of an aiohttp session.
+    """
+    # The maximum number of open connections, and of open connections to a single host
+    pool_size: int = 100
+    pool_size_per_host: int = 10
+    # How long idle connections are kept alive for reuse, in seconds
+    keepalive_timeout: float = 30
+    # How long resolved host names are cached, in seconds. None caches them forever
+    dns_cache_ttl: Optional[int] = 300
+    # Timeouts in seconds. None disables the timeout
+    connect_timeout: Optional[float] = 10
+    read_timeout: Optional[float] = 30
+    total_timeout: Optional[float] = 60
+    # Whether compressed responses are asked for. They are decompressed as they are read
+    compress: bool = True
+
+    def create_session(self, trace_configs: Optional[List[aiohttp.TraceConfig]] = None) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.pool_size_per_host,
+                                         keepalive_timeout=self.keepalive_timeout, use_dns_cache=True,
+                                         ttl_dns_cache=self.dns_cache_ttl)
+        timeout = aiohttp.ClientTimeout(total=self.total_timeout, sock_connect=self.connect_timeout,
+                                        sock_read=self.read_timeout)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=trace_configs,
+                                     headers={'Accept-Encoding': accept_encoding(self.compress)})
+
+
+class SessionPool:
+    """
+    Shares aiohttp sessions, and so their connection pools, between clients.
+
+    Clients acquiring a session with the same options in the same event loop get the same session. The session is
+    closed when the last of them releases it.
+    """
+    def __init__(self):
+        self._sessions: Dict[Tuple, aiohttp.ClientSession] = {}
+        self._references: Dict[aiohttp.ClientSession, int] = {}
+        self._keys: Dict[aiohttp.ClientSession, Tuple] = {}
+
+    def acquire(self, options: SessionOptions,
+                trace_configs: Optional[List[aiohttp.TraceConfig]] = None) -> aiohttp.ClientSession:
+        # Trace configs are bound to the session, so sessions with different trace configs can't be shared
+        key = (asyncio.get_running_loop(), options, tuple(trace_configs or ()))
+        session = self._sessions.get(key)
+        if session is None or session.closed:
+            session = options.create_session(list(trace_configs) if trace_configs else None)
+            self._sessions[key] = session
+            self._references[session] = 0
+            self._keys[session] = key
+            logger.debug(f'Created a new session with {options}.')
+
+        self._references[session] += 1
+        return session
+
+    async def release(self, session: aiohttp.ClientSession) -> None:
+        if session not in self._references:
+            # Not a shared session
+            if not session.closed:
+                await session.close()
+            return
+
+        self._references[session] -= 1
+        if self._references[session] > 0:
+            return
+
+        del self._references[session]
+        key = self._keys.pop(session)
+        if self._sessions.get(key) is session:
+            del self._sessions[key]
+        if not session.closed:
+            await session.close()
+
+
+session_pool = SessionPool()
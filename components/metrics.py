@@ -0,0 +1,213 @@
+import copy
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+from globals import Logger
+
+logger = Logger.get_logger(__name__)
+
+# Upper bounds of the histogram buckets, in seconds for timings
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+STAGE_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+RETRY_BUCKETS = (0, 1, 2, 3, 5, 10)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    Counts observations in cumulative buckets, like a Prometheus histogram. Quantiles are estimated as the upper
+    bound of the bucket they fall in.
+    """
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def merge(self, other: 'Histogram') -> None:
+        if other.buckets != self.buckets:
+            raise ValueError(f'Histograms with different buckets can not be merged: {other.buckets}')
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+    def cumulative_counts(self) -> Iterator[Tuple[float, int]]:
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        for bound, total in self.cumulative_counts():
+            if total >= q * self.count:
+                return bound
+        return math.inf
+
+
+class MetricsRegistry:
+    """
+    Collects the counters, gauges and histograms of a run, and exports them as a Prometheus text file or as JSON.
+
+    Metrics are identified by a name and optional labels, e.g. `increment('requests_total', status='200')`. The
+    registry is thread-safe, so the stages of the pipelined mode can record from their threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters: Dict[str, Dict[Labels, float]] = {}
+            self.gauges: Dict[str, Dict[Labels, float]] = {}
+            self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    @staticmethod
+    def _labels(labels: Dict[str, object]) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        key = self._labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self.gauges.setdefault(name, {})[self._labels(labels)] = value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, **labels) -> None:
+        key = self._labels(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, buckets: Sequence[float] = STAGE_BUCKETS, **labels):
+        """
+        Observes the duration of the block in seconds, e.g. `with metrics.timer('stage_seconds', stage='load'):`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, buckets, **labels)
+
+    def snapshot(self) -> Dict:
+        """
+        :return: A copy of the metrics, e.g. to send them from a worker process to the parent process.
+        """
+        with self._lock:
+            return copy.deepcopy({'counters': self.counters, 'gauges': self.gauges, 'histograms': self.histograms})
+
+    def merge(self, snapshot: Dict) -> None:
+        """
+        Adds the metrics of a snapshot, e.g. of a worker process. Counters, gauges and histograms are summed.
+        """
+        with self._lock:
+            for kind in ('counters', 'gauges'):
+                for name, series in snapshot[kind].items():
+                    target = getattr(self, kind).setdefault(name, {})
+                    for labels, value in series.items():
+                        target[labels] = target.get(labels, 0) + value
+
+            for name, series in snapshot['histograms'].items():
+                target = self.histograms.setdefault(name, {})
+                for labels, histogram in series.items():
+                    if labels in target:
+                        target[labels].merge(histogram)
+                    else:
+                        target[labels] = copy.deepcopy(histogram)
+
+    def to_prometheus(self) -> str:
+        """
+        :return: The metrics in the Prometheus text exposition format, e.g. for the node exporter's textfile collector.
+        """
+        def format_labels(labels: Labels, extra: Labels = ()) -> str:
+            labels = labels + extra
+            return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}' if labels else ''
+
+        def format_bound(bound: float) -> str:
+            return '+Inf' if bound == math.inf else repr(float(bound))
+
+        lines = []
+        with self._lock:
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for name, series in sorted(metrics.items()):
+                    lines.append(f'# TYPE {name} {kind}')
+                    lines.extend(f'{name}{format_labels(labels)} {value}' for labels, value in sorted(series.items()))
+
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f'# TYPE {name} histogram')
+                for labels, histogram in sorted(series.items()):
+                    lines.extend(f'{name}_bucket{format_labels(labels, (("le", format_bound(bound)),))} {count}'
+                                 for bound, count in histogram.cumulative_counts())
+                    lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+                    lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self) -> Dict:
+        def series_name(name: str, labels: Labels) -> str:
+            return name + (f'{{{",".join(f"{key}={value}" for key, value in labels)}}}' if labels else '')
+
+        with self._lock:
+            result = {
+                'counters': {series_name(name, labels): value
+                             for name, series in self.counters.items() for labels, value in series.items()},
+                'gauges': {series_name(name, labels): value
+                           for name, series in self.gauges.items() for labels, value in series.items()},
+                'histograms': {series_name(name, labels): {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'p50': histogram.quantile(0.5),
+                    'p90': histogram.quantile(0.9),
+                    'p99': histogram.quantile(0.99),
+                    'buckets': {format(bound): count for bound, count in histogram.cumulative_counts()},
+                } for name, series in self.histograms.items() for labels, histogram in series.items()},
+            }
+        return result
+
+    def export(self, filename: str) -> None:
+        """
+        Writes the metrics to a JSON file if the filename ends with .json, and to a Prometheus text file otherwise.
+        """
+        with open(filename, 'w') as file:
+            if filename.lower().endswith('.json'):
+                json.dump(self.to_dict(), file, indent=2, default=str)
+            else:
+                file.write(self.to_prometheus())
+        logger.info(f'Metrics written to {filename}')
+
+    def summary(self) -> str:
+        """
+        :return: A human readable summary of the stage timings, requests and counters.
+        """
+        data = self.to_dict()
+        lines = ['Run summary:']
+        for name, histogram in sorted(data['histograms'].items()):
+            if histogram['count']:
+                lines.append(f'  {name}: {histogram["count"]} observations, total {histogram["sum"]:.3f}, '
+                             f'mean {histogram["sum"] / histogram["count"]:.3f}, p50 <= {histogram["p50"]}, '
+                             f'p99 <= {histogram["p99"]}')
+        for name, value in sorted({**data['counters'], **data['gauges']}.items()):
+            lines.append(f'  {name}: {value:g}')
+        return '\n'.join(lines)
+
+
+metrics = MetricsRegistry()
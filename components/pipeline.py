@@ -0,0 +1,126 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from globals import Logger
+
+logger = Logger.get_logger(__name__)
+
+# Marks the end of the stream of batches
+DONE = object()
+
+
+class PipelineStopped(Exception):
+    """
+    Raised by a stage to stop the pipeline, e.g. when a batch is invalid.
+    """
+
+
+class Stage(NamedTuple):
+    """
+    A stage of a pipeline. Coroutine functions run on the event loop, e.g. network requests. Plain functions are
+    blocking, e.g. pandas operations or file writes, and run in an executor so they don't block the event loop.
+    """
+    name: str
+    function: Callable[[Any], Any]
+
+
+async def run_pipeline(source: Iterable, stages: List[Stage], depth: int = 2,
+                       executor: Optional[Executor] = None) -> Dict[str, float]:
+    """
+    Moves the batches of `source` through the stages concurrently: while one batch is written, the next one can be
+    calculated and the one after it fetched. The stages are connected by queues of `depth` batches, so a slow stage
+    holds back the stages before it and at most about `depth` batches per stage are in memory at once.
+
+    The wall time approaches the time of the slowest stage instead of the sum of all stages.
+
+    If a stage raises `PipelineStopped`, no more batches are loaded and the batches the stage hasn't processed yet
+    are dropped, but the batches it already passed on still go through the later stages, like in a sequential run.
+    The exception is raised once they are done. Any other exception cancels all the stages.
+
+    :param source: The batches, e.g. the chunks of an input file. It is iterated in the executor, as reading is
+    blocking too. It may raise `PipelineStopped` as well.
+    :param stages: The stages, in order. Each one gets the output of the previous one.
+    :param depth: The maximum number of batches waiting between two stages. Default is 2.
+    :param executor: The executor of the blocking stages. Default is the default executor of the event loop.
+    :return: The time each stage spent working, in seconds.
+    """
+    if depth < 1:
+        raise ValueError(f'Invalid pipeline depth: {depth}')
+
+    loop = asyncio.get_running_loop()
+    queues = [asyncio.Queue(maxsize=depth) for _ in stages]
+    busy = {'load': 0.0, **{stage.name: 0.0 for stage in stages}}
+    # The exceptions of the stages that stopped the pipeline by their position, -1 for the source
+    stopped: Dict[int, PipelineStopped] = {}
+    in_flight = set()
+
+    async def call(function: Callable, *args) -> Any:
+        # A cancelled task can't stop a running thread, so the call is shielded and waited for before returning
+        future = loop.run_in_executor(executor, function, *args)
+        in_flight.add(future)
+        future.add_done_callback(in_flight.discard)
+        return await asyncio.shield(future)
+
+    async def load() -> None:
+        iterator = iter(source)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = DONE if stopped else await call(next, iterator, DONE)
+            except PipelineStopped as e:
+                stopped[-1] = e
+                batch = DONE
+            busy['load'] += time.perf_counter() - start
+            await queues[0].put(batch)
+            if batch is DONE:
+                return
+
+    async def work(position: int, stage: Stage, inbox: asyncio.Queue, outbox: Optional[asyncio.Queue]) -> None:
+        while True:
+            batch = await inbox.get()
+            if batch is DONE:
+                break
+            # The batches behind the one that stopped the pipeline are dropped
+            if any(stop >= position for stop in stopped):
+                continue
+
+            start = time.perf_counter()
+            try:
+                if asyncio.iscoroutinefunction(stage.function):
+                    batch = await stage.function(batch)
+                else:
+                    batch = await call(stage.function, batch)
+            except PipelineStopped as e:
+                stopped[position] = e
+                continue
+            finally:
+                busy[stage.name] += time.perf_counter() - start
+
+            if outbox is not None:
+                await outbox.put(batch)
+
+        if outbox is not None:
+            await outbox.put(DONE)
+
+    tasks = [asyncio.create_task(load())]
+    for i, stage in enumerate(stages):
+        outbox = queues[i + 1] if i + 1 < len(stages) else None
+        tasks.append(asyncio.create_task(work(i, stage, queues[i], outbox)))
+
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # If a stage failed, the stages before it would wait forever on its full queue
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if in_flight:
+            await asyncio.wait(in_flight)
+
+    if stopped:
+        raise next(iter(stopped.values()))
+
+    logger.info('Pipeline stage times: ' + ', '.join(f'{name} {seconds:.2f}s' for name, seconds in busy.items()))
+    return busy
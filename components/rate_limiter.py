@@ -0,0 +1,164 @@
+import asyncio
+import multiprocessing
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from globals import Logger
+
+logger = Logger.get_logger(__name__)
+
+
+class IRateLimiter(ABC):
+    """
+    Limits how fast and how many requests are sent. Use it as an async context manager around each request:
+    `async with rate_limiter: ...`
+    """
+    @abstractmethod
+    async def acquire(self) -> None:
+        pass
+
+    @abstractmethod
+    def release(self) -> None:
+        pass
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class TokenBucketRateLimiter(IRateLimiter):
+    """
+    A token bucket rate limiter with a cap on the number of requests in flight.
+
+    The bucket holds up to `burst` tokens and is refilled at `requests_per_second`. Every request takes a token,
+    and waits only as long as it takes for the next token to arrive, so the client runs at exactly the allowed
+    throughput without idle sleeps. Waiting requests are served in arrival order.
+    """
+    def __init__(self, requests_per_second: float = 1.0, burst: int = 1, max_concurrency: Optional[int] = 10):
+        """
+        :param requests_per_second: The rate at which tokens are added to the bucket. Default is 1 request per second,
+        the gleif API allows 60 requests per minute.
+        :param burst: The capacity of the bucket, i.e. how many requests can be sent at once after an idle period.
+        Default is 1.
+        :param max_concurrency: The maximum number of requests in flight. None means no limit. Default is 10.
+        """
+        if requests_per_second <= 0:
+            raise ValueError(f'Invalid requests per second: {requests_per_second}')
+        if burst < 1:
+            raise ValueError(f'Invalid burst: {burst}')
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(f'Invalid max concurrency: {max_concurrency}')
+
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.requests_per_second)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        if self._semaphore:
+            await self._semaphore.acquire()
+
+        try:
+            # The lock is held while waiting for a token, so waiting requests take the tokens in arrival order
+            async with self._lock:
+                self._refill()
+                if self._tokens < 1:
+                    await asyncio.sleep((1 - self._tokens) / self.requests_per_second)
+                    self._refill()
+                self._tokens -= 1
+        except BaseException:
+            if self._semaphore:
+                self._semaphore.release()
+            raise
+
+    def release(self) -> None:
+        if self._semaphore:
+            self._semaphore.release()
+
+
+class SharedTokenBucketRateLimiter(IRateLimiter):
+    """
+    A token bucket rate limiter shared by several processes, e.g. the workers of a sharded run, so the request rate of
+    all of them together stays within the API limit.
+
+    The bucket lives in shared memory. A request reserves its token under a process-shared lock and then sleeps until
+    the token is due outside of it, so the lock is only held for a few microseconds. The cap on the requests in
+    flight applies to each process separately.
+
+    Create it in the parent process and hand it to the workers when they are started, e.g. with the `initargs` of a
+    `ProcessPoolExecutor`.
+    """
+    def __init__(self, requests_per_second: float = 1.0, burst: int = 1, max_concurrency: Optional[int] = 10,
+                 context=multiprocessing):
+        """
+        :param requests_per_second: The rate at which tokens are added to the bucket, for all the processes together.
+        :param burst: The capacity of the bucket. Default is 1.
+        :param max_concurrency: The maximum number of requests in flight per process. None means no limit.
+        Default is 10.
+        :param context: The multiprocessing context the workers are started with.
+        """
+        if requests_per_second <= 0:
+            raise ValueError(f'Invalid requests per second: {requests_per_second}')
+        if burst < 1:
+            raise ValueError(f'Invalid burst: {burst}')
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(f'Invalid max concurrency: {max_concurrency}')
+
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+
+        # time.monotonic is system-wide, so the processes agree on it
+        self._lock = context.Lock()
+        self._tokens = context.RawValue('d', float(burst))
+        self._updated_at = context.RawValue('d', time.monotonic())
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def __getstate__(self):
+        # The semaphore belongs to the event loop of one process
+        return {**self.__dict__, '_semaphore': None}
+
+    def _reserve(self) -> float:
+        """
+        Takes a token, possibly one that is only due in the future.
+
+        :return: How long to wait for the token in seconds.
+        """
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.burst, self._tokens.value + (now - self._updated_at.value) * self.requests_per_second)
+            self._tokens.value = tokens - 1
+            self._updated_at.value = now
+        return max(0.0, (1 - tokens) / self.requests_per_second)
+
+    async def acquire(self) -> None:
+        if self.max_concurrency and self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._semaphore:
+            await self._semaphore.acquire()
+
+        try:
+            delay = self._reserve()
+            if delay:
+                await asyncio.sleep(delay)
+        except BaseException:
+            if self._semaphore:
+                self._semaphore.release()
+            raise
+
+    def release(self) -> None:
+        if self._semaphore:
+            self._semaphore.release()
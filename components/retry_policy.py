@@ -0,0 +1,155 @@
+import asyncio
+import multiprocessing
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, FrozenSet, Optional
+
+from aiohttp import ClientConnectionError, ClientPayloadError
+
+from globals import Logger
+
+logger = Logger.get_logger(__name__)
+
+
+class RetryBudget:
+    """
+    Caps the retries of all requests together, so a degraded API isn't hit with a storm of retries.
+
+    Every request adds `ratio` to the budget and every retry spends 1 from it. `min_retries` retries are always
+    allowed, so a few failures early in a run can still be retried.
+    """
+    def __init__(self, ratio: float = 0.2, min_retries: int = 10):
+        """
+        :param ratio: The number of retries allowed per request. Default is 0.2, i.e. one retry per five requests.
+        :param min_retries: The number of retries allowed regardless of the number of requests. Default is 10.
+        """
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.requests = 0
+        self.retries = 0
+
+    def record_request(self) -> None:
+        self.requests += 1
+
+    def try_spend(self) -> bool:
+        """
+        :return: Whether a retry is allowed. If it is, it's counted against the budget.
+        """
+        if self.retries >= self.min_retries + self.ratio * self.requests:
+            return False
+        self.retries += 1
+        return True
+
+
+class SharedRetryBudget(RetryBudget):
+    """
+    A retry budget shared by several processes, e.g. the workers of a sharded run, so the retries of all of them
+    together are capped. Create it in the parent process and hand it to the workers when they are started.
+    """
+    def __init__(self, ratio: float = 0.2, min_retries: int = 10, context=multiprocessing):
+        """
+        :param ratio: The number of retries allowed per request. Default is 0.2, i.e. one retry per five requests.
+        :param min_retries: The number of retries allowed regardless of the number of requests. Default is 10.
+        :param context: The multiprocessing context the workers are started with.
+        """
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self._lock = context.Lock()
+        self._requests = context.RawValue('q', 0)
+        self._retries = context.RawValue('q', 0)
+
+    @property
+    def requests(self) -> int:
+        return self._requests.value
+
+    @property
+    def retries(self) -> int:
+        return self._retries.value
+
+    def record_request(self) -> None:
+        with self._lock:
+            self._requests.value += 1
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._retries.value >= self.min_retries + self.ratio * self._requests.value:
+                return False
+            self._retries.value += 1
+            return True
+
+
+class RetryPolicy:
+    """
+    Decides whether and when a failed request is retried.
+
+    - Only the statuses in `retry_statuses` are retried, e.g. a 404 is final.
+    - Transient network errors such as refused connections and timeouts are retried.
+    - The delay grows exponentially with full jitter: a random delay between 0 and base_delay * 2 ** attempt, capped at
+      max_delay, so clients failing together don't retry in lockstep.
+    - A Retry-After header is respected: the delay is at least as long as the server asks for.
+    - A `RetryBudget` shared by all requests caps the total number of retries.
+    """
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 30,
+                 retry_statuses: FrozenSet[int] = frozenset({408, 429, 500, 502, 503, 504}),
+                 respect_retry_after: bool = True, max_retry_after: float = 300,
+                 budget: Optional[RetryBudget] = None, random_: Callable[[], float] = random.random):
+        """
+        :param max_attempts: The maximum number of attempts of a request, the first one included. Default is 3.
+        :param base_delay: The maximum delay before the first retry in seconds. Default is 0.5 seconds.
+        :param max_delay: The maximum backoff delay in seconds. Default is 30 seconds.
+        :param retry_statuses: The response statuses that are retried.
+        :param respect_retry_after: Whether to wait as long as the Retry-After header asks for. Default is True.
+        :param max_retry_after: The longest Retry-After delay respected, in seconds. Default is 300 seconds.
+        :param budget: The retry budget shared by all requests. Default is a RetryBudget with its default settings.
+        :param random_: The random number generator of the jitter, returning values in [0, 1).
+        """
+        if max_attempts < 1:
+            raise ValueError(f'Invalid max attempts: {max_attempts}')
+
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+        self.respect_retry_after = respect_retry_after
+        self.max_retry_after = max_retry_after
+        self.budget = budget or RetryBudget()
+        self.random = random_
+
+    def should_retry_status(self, status: int) -> bool:
+        return status in self.retry_statuses
+
+    @staticmethod
+    def is_transient_error(error: BaseException) -> bool:
+        return isinstance(error, (ClientConnectionError, ClientPayloadError, asyncio.TimeoutError))
+
+    def get_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        :param attempt: The number of the failed attempt, starting from 0.
+        :param retry_after: The Retry-After header of the failed response, if any.
+        :return: The delay before the next attempt in seconds.
+        """
+        delay = self.random() * min(self.max_delay, self.base_delay * 2 ** attempt)
+
+        if self.respect_retry_after and retry_after is not None:
+            requested = self.parse_retry_after(retry_after)
+            if requested is not None:
+                delay = max(delay, min(requested, self.max_retry_after))
+
+        return delay
+
+    @staticmethod
+    def parse_retry_after(value: str) -> Optional[float]:
+        """
+        Parses a Retry-After header, either a number of seconds or an HTTP date.
+        """
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError, IndexError):
+            logger.warning(f'Invalid Retry-After header: {value}')
+            return None
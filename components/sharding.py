@@ -0,0 +1,70 @@
+from typing import Iterable, Iterator, List
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from globals import Logger
+
+logger = Logger.get_logger(__name__)
+
+# The position of each row in the input, carried through the shards so the output can be merged in the input order
+ROW_COLUMN = '_row_number'
+
+
+def shard_ids(keys: pd.Series, shards: int) -> np.ndarray:
+    """
+    Assigns the rows to shards by the hash of their key, e.g. the LEI, so all the rows of a key go to the same
+    shard and each key is fetched and cached by one worker only. The hash is stable across processes and runs.
+
+    :param keys: The keys of the rows.
+    :param shards: The number of shards.
+    :return: The shard of each row, from 0 to shards - 1.
+    """
+    if shards < 1:
+        raise ValueError(f'Invalid number of shards: {shards}')
+    return (pd.util.hash_array(keys.astype(str).to_numpy(dtype=object)) % np.uint64(shards)).astype(np.int64)
+
+
+def merge_shards(shards: List[Iterable[pd.DataFrame]], column: str = ROW_COLUMN) -> Iterator[pd.DataFrame]:
+    """
+    Merges the chunks of several shards, each sorted by `column`, into chunks sorted by `column`. Only about one
+    chunk per shard is in memory at once.
+
+    :param shards: The chunks of each shard, e.g. the outputs of the workers loaded in chunks.
+    :param column: The column the shards are sorted by.
+    """
+    iterators = [iter(shard) for shard in shards]
+
+    def next_chunk(iterator: Iterator[pd.DataFrame]):
+        for chunk in iterator:
+            if not chunk.empty:
+                return chunk
+        return None
+
+    buffers = [next_chunk(iterator) for iterator in iterators]
+    while any(buffer is not None for buffer in buffers):
+        # The rows up to the smallest last row of the buffered chunks can't be preceded by a row that isn't loaded yet
+        bound = min(buffer[column].iloc[-1] for buffer in buffers if buffer is not None)
+
+        parts = []
+        for i, buffer in enumerate(buffers):
+            if buffer is None:
+                continue
+            ready = buffer[column].to_numpy() <= bound
+            parts.append(buffer[ready])
+            buffers[i] = buffer[~ready] if not ready.all() else next_chunk(iterators[i])
+
+        yield _concat(parts).sort_values(column, kind='stable')
+
+
+def _concat(parts: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenates the parts like `pd.concat`, but keeps the columns that are categorical in all of them categorical,
+    instead of falling back to object columns when their categories differ.
+    """
+    df = pd.concat(parts)
+    for name in df.columns:
+        if all(isinstance(part[name].dtype, pd.CategoricalDtype) for part in parts):
+            df[name] = union_categoricals([part[name] for part in parts], sort_categories=True)
+    return df
@@ -1,11 +1,11 @@
 from abc import ABC, abstractmethod
 from multiprocessing import cpu_count, Pool
-from typing import Optional, Callable
+from typing import Optional
 
 import numpy as np
 import pandas as pd
 from globals import Logger
-import multiprocessing as mp
+from logger.sampling import LogSampler
 
 logger = Logger.get_logger(__name__)
 
@@ -15,11 +15,36 @@ class Formula(ABC):
     def apply(self, row: pd.Series) -> Optional[float]:
         pass
 
+    def apply_frame(self, df: pd.DataFrame) -> pd.Series:
+        """
+        Calculates the whole column. By default `apply` is called for each row, with the rows distributed over a
+        process pool. Override it with column operations to calculate the column at once.
+
+        :param df: input DataFrame
+        :return: The calculated values, aligned with df's index.
+        """
+        cores = cpu_count()
+        pool = Pool(cores)
+
+        # Apply the formula's apply method to each row in the DataFrame
+        values = pool.map(self.apply, [row for _, row in df.iterrows()])
+
+        pool.close()
+        pool.join()
+
+        return pd.Series(values, index=df.index)
+
 
 class TransactionCostsFormula(Formula):
     """
     Formula to calculate transaction costs. You can use this as an example to implement your own formula.
     """
+    def __init__(self, log_every: int = 1000):
+        """
+        :param log_every: The row-wise `apply` logs one of every this many calculations. Default is 1000.
+        """
+        self.calculated_log = LogSampler(log_every)
+        self.unknown_country_log = LogSampler(log_every)
 
     def apply(self, row: pd.Series) -> Optional[float]:
         legal_address_country = row['country']
@@ -28,17 +53,43 @@ class TransactionCostsFormula(Formula):
 
         if legal_address_country == 'GB':
             transaction_costs = notional * rate - notional
-            logger.info(f"Transaction costs calculated for country 'GB': {transaction_costs}")
-            return transaction_costs
-
         elif legal_address_country == 'NL':
             transaction_costs = abs(notional * (1 / rate) - notional)
-            logger.info(f"Transaction costs calculated for country 'NL': {transaction_costs}")
-            return transaction_costs
         else:
-            logger.warning(f"No transaction costs calculated for unknown country: {legal_address_country}")
+            suffix = self.unknown_country_log.sample()
+            if suffix is not None:
+                logger.warning(f"No transaction costs calculated for unknown country: {legal_address_country}{suffix}")
             return None
 
+        suffix = self.calculated_log.sample()
+        if suffix is not None:
+            logger.info(f"Transaction costs calculated for country '{legal_address_country}': {transaction_costs}"
+                        f"{suffix}")
+        return transaction_costs
+
+    def apply_frame(self, df: pd.DataFrame) -> pd.Series:
+        country = df['country'].to_numpy()
+        notional = df['notional'].to_numpy(dtype=float)
+        rate = df['rate'].to_numpy(dtype=float)
+
+        is_gb = country == 'GB'
+        is_nl = country == 'NL'
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            transaction_costs = np.select(
+                [is_gb, is_nl],
+                [notional * rate - notional, np.abs(notional * (1 / rate) - notional)],
+                default=np.nan)
+
+        unknown = ~(is_gb | is_nl)
+        if unknown.any():
+            unknown_countries = ', '.join(sorted(set(map(str, country[unknown]))))
+            logger.warning(f"No transaction costs calculated for {unknown.sum()} rows with unknown countries: "
+                           f"{unknown_countries}")
+
+        logger.info(f"Transaction costs calculated for {len(df) - unknown.sum()} rows.")
+        return pd.Series(transaction_costs, index=df.index)
+
 
 def calculate(df: pd.DataFrame, column_name: str, formula: Formula) -> pd.DataFrame:
     """
@@ -46,15 +97,9 @@ def calculate(df: pd.DataFrame, column_name: str, formula: Formula) -> pd.DataFr
     :param column_name: name of the column to calculation result will be set
     :param formula: Check Formula abstract class to get an idea of how to implement a formula.
     You have to override apply function. apply(self, row: pd.Series) -> Optional[float]
+    If the formula also overrides apply_frame(self, df: pd.DataFrame) -> pd.Series, the whole column is calculated
+    at once. Otherwise the rows are distributed over a process pool.
     :return: df with new column. df[column_name] = formula.apply(row)
     """
-    cores = cpu_count()
-    pool = Pool(cores)
-
-    # Apply the formula's apply method to each row in the DataFrame
-    df[column_name] = pool.map(formula.apply, [row for _, row in df.iterrows()])
-
-    pool.close()
-    pool.join()
-
+    df[column_name] = formula.apply_frame(df)
     return df
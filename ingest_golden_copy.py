@@ -0,0 +1,38 @@
+import argparse
+import time
+
+from components.golden_copy import GoldenCopyStore
+from globals import Logger
+
+logger = Logger.get_logger(__name__)
+
+
+def ingest(store_path: str, files, chunk_size: int = 100_000) -> None:
+    """
+    Loads GLEIF golden copy, delta, BIC mapping or JSON files into the local store of the LocalLeiClient. The files
+    are applied in order, so a golden copy should come before its deltas.
+    """
+    store = GoldenCopyStore(store_path)
+    try:
+        for filename in files:
+            start = time.perf_counter()
+            count = store.ingest(filename, chunk_size=chunk_size)
+            logger.info(f'{count} records ingested from {filename} in {time.perf_counter() - start:.1f}s.')
+        logger.info(f'{len(store)} records in {store_path}.')
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Loads GLEIF golden copy files into the local LEI store.')
+    parser.add_argument('files', nargs='+',
+                        help='Golden copy, delta or BIC mapping CSV files, plain or zipped, or lei-records JSON files.')
+    parser.add_argument('--golden_copy_path', type=str, default='data/golden_copy.sqlite',
+                        help='The path to the local store.')
+    parser.add_argument('--chunk_size', type=int, default=100_000,
+                        help='The number of records read and written at once.')
+    parser.add_argument('--log_level', type=str, default='INFO', help='The log level.')
+
+    args = parser.parse_args()
+    Logger.set_log_level(args.log_level)
+    ingest(args.golden_copy_path, args.files, chunk_size=args.chunk_size)
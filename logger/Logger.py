@@ -1,8 +1,10 @@
+import atexit
 import logging
 import os
+import queue
 import sys
-from logging.handlers import TimedRotatingFileHandler
-from typing import Any, Union
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Any, List, Optional, Union
 
 from .CustomFormatter import CustomFormatter
 
@@ -26,6 +28,10 @@ class LoggerSingleton:
 
     def __init__(self) -> None:
         self.loggers = {}
+        # One set of handlers is shared by all loggers
+        self.handlers: Optional[List[logging.Handler]] = None
+        self.queue_handler: Optional[QueueHandler] = None
+        self.listener: Optional[QueueListener] = None
 
     def check_log_level(self, level: Union[str, int]) -> None:
         if isinstance(level, str):
@@ -70,14 +76,60 @@ class LoggerSingleton:
     def get_file_formatter(self) -> logging.Formatter:
         return logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
+    def get_handlers(self) -> List[logging.Handler]:
+        if self.handlers is None:
+            self.handlers = [self.get_console_handler(), self.get_file_handler()]
+        return self.handlers
+
+    def enable_queue(self) -> None:
+        """
+        Switches to queued logging: loggers only put their records on a queue, and a background thread formats them
+        and writes them to the console and the log file, so logging doesn't block the calling thread.
+        """
+        if self.listener is not None:
+            return
+
+        log_queue = queue.SimpleQueue()
+        self.queue_handler = QueueHandler(log_queue)
+        self.listener = QueueListener(log_queue, *self.get_handlers(), respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.disable_queue)
+
+        for logger in self.loggers.values():
+            self.attach_handlers(logger)
+
+    def disable_queue(self) -> None:
+        """
+        Switches back to synchronous logging, after writing the records left on the queue.
+        """
+        if self.listener is None:
+            return
+
+        self.listener.stop()
+        self.listener = None
+        self.queue_handler = None
+        atexit.unregister(self.disable_queue)
+
+        for logger in self.loggers.values():
+            self.attach_handlers(logger)
+
+    def attach_handlers(self, logger: logging.Logger) -> None:
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+
+        if self.queue_handler is not None:
+            logger.addHandler(self.queue_handler)
+        else:
+            for handler in self.get_handlers():
+                logger.addHandler(handler)
+
     def get_logger(self, logger_name: str) -> logging.Logger:
         if logger_name in self.loggers:
             return self.loggers[logger_name]
 
         logger = logging.getLogger(logger_name)
         logger.setLevel(self.__log_level)  # Use the current log level
-        logger.addHandler(self.get_console_handler())
-        logger.addHandler(self.get_file_handler())
+        self.attach_handlers(logger)
         logger.propagate = False
 
         self.loggers[logger_name] = logger
@@ -95,3 +147,11 @@ def set_log_level(level) -> None:
 
 def set_log_dir(dir_path: str) -> None:
     LoggerSingleton.get_instance().set_log_dir(dir_path)
+
+
+def enable_queue() -> None:
+    LoggerSingleton.get_instance().enable_queue()
+
+
+def disable_queue() -> None:
+    LoggerSingleton.get_instance().disable_queue()
@@ -0,0 +1,79 @@
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+
+class LogSampler:
+    """
+    Samples repetitive per-row messages: only one of every `every` messages is logged.
+
+    Usage:
+        suffix = sampler.sample()
+        if suffix is not None:
+            logger.info(f'Row processed{suffix}')
+    """
+    def __init__(self, every: int = 1000):
+        """
+        :param every: Log one of every this many messages. Default is 1000.
+        """
+        if every < 1:
+            raise ValueError(f'Invalid sampling rate: {every}')
+
+        self.every = every
+        self.count = 0
+
+    def sample(self) -> Optional[str]:
+        """
+        :return: None if this message should be skipped. Otherwise a suffix to append to the message, mentioning
+        the number of messages skipped since the last logged one.
+        """
+        self.count += 1
+        if (self.count - 1) % self.every:
+            return None
+        skipped = self.every - 1 if self.count > 1 else 0
+        return f' ({skipped} similar messages skipped)' if skipped else ''
+
+
+class LogAggregator:
+    """
+    Aggregates repetitive per-row messages into counts, e.g. "1500 IDs fetched from cache.". The first occurrence
+    of a message is logged right away, later ones at most once every `interval` seconds and when flushed.
+    """
+    def __init__(self, logger: logging.Logger, interval: float = 10.0):
+        """
+        :param logger: The logger the aggregated messages are written to.
+        :param interval: The minimum time between two lines of the same message, in seconds. Default is 10 seconds.
+        """
+        self.logger = logger
+        self.interval = interval
+        self.counts: Dict[Tuple[str, int], int] = {}
+        self.logged_at: Dict[Tuple[str, int], float] = {}
+
+    def add(self, message: str, count: int = 1, level: int = logging.INFO) -> None:
+        """
+        :param message: The message template, with a {count} placeholder.
+        :param count: The number of occurrences to add.
+        :param level: The level the message is logged at.
+        """
+        if not self.logger.isEnabledFor(level):
+            return
+
+        key = (message, level)
+        self.counts[key] = self.counts.get(key, 0) + count
+
+        now = time.monotonic()
+        last = self.logged_at.get(key)
+        if last is None or now - last >= self.interval:
+            self._log(key)
+            self.logged_at[key] = now
+
+    def flush(self) -> None:
+        for key in list(self.counts):
+            self._log(key)
+        self.logged_at.clear()
+
+    def _log(self, key: Tuple[str, int]) -> None:
+        count = self.counts.pop(key, 0)
+        if count:
+            message, level = key
+            self.logger.log(level, message.format(count=count))
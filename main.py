@@ -1,11 +1,30 @@
 import argparse
 import asyncio
+import itertools
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
 
+import numpy as np
+import pandas as pd
 
-from components.data_enricher import LeiLookupClient, DataEnricher, LeiLookupCache
-from components.data_source import CsvDataSource
+from components.cacher import SqliteCache
+from components.checkpoint import CheckpointJournal
+from components.circuit_breaker import CircuitBreaker
+from components.data_enricher import LeiLookupClient, LocalLeiClient, DataEnricher, LeiLookupCache
+from components.data_source import get_data_source, DataSourceError, ParquetDataSource
 from components.data_validator import LEIDataValidator
 from components.data_parser import LEIDataParser
+from components.http_session import SessionOptions
+from components.rate_limiter import IRateLimiter, SharedTokenBucketRateLimiter, TokenBucketRateLimiter
+from components.retry_policy import RetryPolicy, RetryBudget, SharedRetryBudget
+from components.formula_engine import FormulaEngine
+from components.metrics import metrics
+from components.golden_copy import GoldenCopyStore
+from components.pipeline import run_pipeline, PipelineStopped, Stage
+from components.sharding import merge_shards, shard_ids, ROW_COLUMN
 from components.transaction_calculator import calculate, TransactionCostsFormula
 from globals import Logger
 
@@ -16,62 +35,656 @@ from logger.str_tool import boxify
 
 class DataEnrichmentRunner:
     def __init__(self, client=None,
+                 base_url='https://api.gleif.org/api/v1/lei-records?filter[lei]=',
                  cache_size=100,
-                 sleep_rate=0.6,
+                 cache_max_bytes=None,
+                 cache_backend='memory',
+                 cache_path='data/lei_cache.sqlite',
+                 cache_ttl=7 * 24 * 60 * 60,
+                 requests_per_second=1.0,
+                 burst=1,
+                 max_concurrency=10,
                  retry_attempts=3,
+                 retry_base_delay=0.5,
+                 retry_max_delay=30,
+                 retry_budget_ratio=0.2,
+                 negative_cache_ttl=24 * 60 * 60,
+                 failure_cache_ttl=5 * 60,
+                 breaker_failure_rate=0.5,
+                 breaker_open_seconds=30,
+                 revalidate_after: Optional[float] = None,
+                 stale_while_revalidate=False,
+                 page_size=100,
+                 pool_size=100,
+                 pool_size_per_host=10,
+                 keepalive_timeout=30,
+                 dns_cache_ttl=300,
+                 connect_timeout=10,
+                 read_timeout=30,
+                 total_timeout=60,
+                 compress_responses=True,
+                 sparse_fieldsets=False,
+                 cache_records=False,
                  log_level='INFO',
+                 log_queue=True,
                  input_file: str = None,
-                 output_file: str = None):
+                 output_file: str = None,
+                 chunk_size: Optional[int] = None,
+                 input_columns: Optional[str] = None,
+                 formulas_file: Optional[str] = 'config/formulas.json',
+                 pipeline=False,
+                 pipeline_depth=2,
+                 resume=False,
+                 checkpoint_file: Optional[str] = None,
+                 incremental=False,
+                 incremental_key='transaction_uti',
+                 golden_copy_path='data/golden_copy.sqlite',
+                 golden_copy_fallback=False,
+                 rejects_file: Optional[str] = None,
+                 metrics_out: Optional[str] = None,
+                 workers=1,
+                 rate_limiter: Optional[IRateLimiter] = None,
+                 retry_budget: Optional[RetryBudget] = None):
+        # The workers of a sharded run are created with the same options
+        self.options = {name: value for name, value in locals().items() if name != 'self'}
 
         logger.info('Initializing the components...')
         Logger.set_log_level(log_level)
+        if log_queue:
+            Logger.enable_queue()
 
         self.input_file = input_file
         self.output_file = output_file
+        self.chunk_size = chunk_size
+        self.pipeline = pipeline
+        self.pipeline_depth = pipeline_depth
+        if pipeline and not chunk_size:
+            raise ValueError('The pipeline mode needs a chunk size.')
+
+        # Chunked runs record every chunk written in a journal, so they can be resumed with --resume
+        self.resume = resume
+        if resume and not chunk_size:
+            raise ValueError('Resuming needs a chunk size.')
+        self.journal = CheckpointJournal(checkpoint_file or f'{output_file}.checkpoint')
+        self.rows_written = 0
+        self.append = False
+
+        # Incremental runs only enrich the input rows whose key isn't in the output file yet, and append them to it
+        self.incremental = incremental
+        self.incremental_key = incremental_key
+
+        # The rows with an invalid LEI are dropped before fetching, and written to the rejects file if there is one
+        self.rejects_file = rejects_file
+        self.rejects_source = get_data_source(rejects_file) if rejects_file else None
+        self.rejected_rows = 0
+
+        # The stage timings, request latencies and counters of the run are summarized at the end, and exported to
+        # metrics_out if given: a Prometheus text file, or JSON if it ends with .json
+        self.metrics_out = metrics_out
+
+        # Sharded runs enrich the input in worker processes, which share one rate limiter and retry budget so the API
+        # limits hold for all of them together
+        self.workers = workers
+        if workers < 1:
+            raise ValueError(f'Invalid number of workers: {workers}')
+        if workers > 1:
+            if resume or incremental:
+                raise NotImplementedError('Resuming and the incremental mode are not supported with workers yet.')
+            self.context = multiprocessing.get_context('spawn')
+            # The cap on the requests in flight applies to each worker, so it's split between them
+            rate_limiter = SharedTokenBucketRateLimiter(requests_per_second, burst, -(-max_concurrency // workers),
+                                                        context=self.context)
+            retry_budget = SharedRetryBudget(ratio=retry_budget_ratio, context=self.context)
+        self.rate_limiter = rate_limiter or TokenBucketRateLimiter(requests_per_second, burst, max_concurrency)
+        self.retry_budget = retry_budget or RetryBudget(ratio=retry_budget_ratio)
 
         self.data_parser = LEIDataParser()
+        # The rule tables are compiled once, and all the derived columns are calculated in one pass per chunk
+        self.formula_engine = FormulaEngine.from_file(formulas_file) if formulas_file else None
         self.data_validator = LEIDataValidator()
-        self.data_source = CsvDataSource()
-
-        if client == 'LeiLookupClient':
-            self.lookup_client = \
-                LeiLookupClient(LeiLookupCache(cache_size), sleep_rate=sleep_rate, retry_attempts=retry_attempts)
+        # The data sources are picked by the file extensions, so e.g. a CSV file can be converted to Parquet
+        self.input_source = get_data_source(input_file, columns=input_columns.split(',') if input_columns else None)
+        self.output_source = get_data_source(output_file)
+        if resume and not self.output_source.truncatable:
+            raise NotImplementedError('Resuming is only supported for CSV output files yet.')
 
+        if cache_backend == 'memory':
+            self.cache = LeiLookupCache(cache_size, max_bytes=cache_max_bytes)
+        elif cache_backend == 'sqlite':
+            self.cache = SqliteCache(cache_path, ttl=cache_ttl)
         else:
+            raise NotImplementedError('This cache backend is not implemented yet.')
+
+        if client not in ('LeiLookupClient', 'LocalLeiClient'):
             raise NotImplementedError('This client is not implemented yet.')
 
-        self.data_enricher = DataEnricher(client=self.lookup_client, data_parser=self.data_parser)
+        http_client = LeiLookupClient(self.cache,
+                                      rate_limiter=self.rate_limiter,
+                                      retry_policy=RetryPolicy(max_attempts=retry_attempts,
+                                                               base_delay=retry_base_delay, max_delay=retry_max_delay,
+                                                               budget=self.retry_budget),
+                                      negative_ttl=negative_cache_ttl,
+                                      failure_ttl=failure_cache_ttl,
+                                      circuit_breaker=CircuitBreaker(failure_rate=breaker_failure_rate,
+                                                                     open_seconds=breaker_open_seconds),
+                                      revalidate_after=revalidate_after,
+                                      stale_while_revalidate=stale_while_revalidate,
+                                      page_size=page_size,
+                                      base_url=base_url,
+                                      record_parser=self.data_parser if cache_records else None,
+                                      session_options=SessionOptions(pool_size, pool_size_per_host, keepalive_timeout,
+                                                                     dns_cache_ttl, connect_timeout, read_timeout,
+                                                                     total_timeout, compress_responses),
+                                      fields=self.data_parser.sparse_fields() if sparse_fieldsets else None)
+
+        if client == 'LeiLookupClient':
+            self.lookup_client = http_client
+            batch_size = page_size
+        else:
+            self.lookup_client = LocalLeiClient(GoldenCopyStore(golden_copy_path),
+                                                fallback=http_client if golden_copy_fallback else None,
+                                                record_parser=self.data_parser)
+            # The local store is probed with bulk queries, so larger batches only mean fewer round trips to it
+            batch_size = 10_000
+
+        self.data_enricher = DataEnricher(client=self.lookup_client, data_parser=self.data_parser,
+                                          batch_size=batch_size)
 
     async def run(self) -> None:
         logger.info('Starting the enrichment process...')
-        df = self.data_source.load_data(self.input_file)
+        metrics.reset()
+        try:
+            if self.workers > 1:
+                await self.run_sharded()
+            elif self.pipeline:
+                await self.run_pipelined()
+            elif self.chunk_size:
+                await self.run_chunked()
+            else:
+                await self.run_whole()
+        finally:
+            if self.rejects_source:
+                self.rejects_source.close()
+            if self.rejected_rows:
+                logger.warning(f'{self.rejected_rows} rows with an invalid LEI were not enriched'
+                               + (f', they were written to {self.rejects_file}.' if self.rejects_file else '.'))
+            if self.workers == 1:
+                logger.info(f'Cache stats: {self.cache.stats()}')
+            self._report_metrics()
 
-        if not self.data_validator.validate_input_data(df):
-            logger.error('Input data validation failed!')
+    async def run_whole(self) -> None:
+        """
+        Loads, enriches, calculates and saves the whole input file at once.
+        """
+        with self._timer('load'):
+            df = self.input_source.load_data(self.input_file)
+        if self.incremental:
+            df = self._drop_existing(df, self._load_existing_keys())
+            if df.empty:
+                logger.info(f'No new rows in {self.input_file}.')
+                return
+
+        df = self._drop_invalid(df)
+        if df.empty:
+            logger.error(f'No valid rows in {self.input_file}.')
+            return
+
+        async with self.lookup_client:
+            df = await self._process(df)
+
+        if df is None:
             return
 
+        try:
+            if self._save(df, append=self.incremental):
+                self.rows_written = len(df)
+        finally:
+            self.output_source.close()
+
+    async def run_chunked(self) -> None:
+        """
+        Streams the input file in chunks of `chunk_size` rows. Each chunk is validated, enriched, calculated and
+        appended to the output file before the next one is loaded, so memory usage doesn't grow with the input size.
+        """
+        start = self._start_checkpoint()
         async with self.lookup_client:
-            df = await self.data_enricher.enrich_data(df, df['lei'].tolist())
+            try:
+                for i, chunk in self._load_chunks(start):
+                    chunk = await self._process(chunk)
+                    if chunk is None or not self._save_chunk(i, chunk):
+                        logger.error(f'Stopping at chunk {i}, {self.rows_written} rows were written to '
+                                     f'{self.output_file}.')
+                        return
+            except DataSourceError as e:
+                logger.error(f'{e} Stopping, {self.rows_written} rows were written to {self.output_file}.')
+                return
+            finally:
+                self.output_source.close()
+
+        logger.info(f'{self.rows_written} rows enriched and written to {self.output_file}.')
 
-        df = calculate(df=df, formula=TransactionCostsFormula(), column_name='transaction_costs')
+    async def run_pipelined(self) -> None:
+        """
+        Streams the input file in chunks like `run_chunked`, but overlaps the stages: while a chunk is fetched, the
+        previous one is calculated and the one before it written. The blocking stages run in threads, and the stages
+        are connected by queues of `pipeline_depth` chunks, so memory usage stays bounded.
+        """
+        # The batches are (chunk index, chunk) pairs, the index is recorded in the checkpoint journal
+        async def enrich(batch: Tuple[int, pd.DataFrame]) -> Tuple[int, pd.DataFrame]:
+            i, chunk = batch
+            if not self._validate_input(chunk):
+                raise PipelineStopped('Input data validation failed!')
+            return i, await self._enrich(chunk)
+
+        def calculate_chunk(batch: Tuple[int, pd.DataFrame]) -> Tuple[int, pd.DataFrame]:
+            i, chunk = batch
+            chunk = self._calculate(chunk)
+            if not self._validate_output(chunk):
+                raise PipelineStopped('Output data validation failed!')
+            return i, chunk
+
+        def save(batch: Tuple[int, pd.DataFrame]) -> None:
+            if not self._save_chunk(*batch):
+                raise PipelineStopped('Saving failed!')
+
+        def load_chunks(start: int) -> Iterator[Tuple[int, pd.DataFrame]]:
+            try:
+                yield from self._load_chunks(start)
+            except DataSourceError as e:
+                raise PipelineStopped(str(e)) from e
+
+        start = self._start_checkpoint()
+        async with self.lookup_client:
+            try:
+                await run_pipeline(load_chunks(start), [Stage('enrich', enrich),
+                                                        Stage('calculate', calculate_chunk),
+                                                        Stage('save', save)], depth=self.pipeline_depth)
+            except PipelineStopped as e:
+                logger.error(f'{e} Stopping, {self.rows_written} rows were written to {self.output_file}.')
+                return
+            finally:
+                self.output_source.close()
+
+        logger.info(f'{self.rows_written} rows enriched and written to {self.output_file}.')
+
+    async def run_sharded(self) -> None:
+        """
+        Partitions the input by the hash of the LEI into one shard per worker, enriches the shards in parallel worker
+        processes and merges their outputs in the order of the input rows. Each worker runs its own event loop, so the
+        parsing and pandas work of the shards uses all the cores. The workers share one rate limiter and retry budget.
+
+        All the rows of a LEI are in the same shard, so each LEI is only fetched and cached by one worker. With a
+        chunk size, the input is partitioned, the shards are enriched and the outputs are merged chunk by chunk.
+        """
+        directory = os.path.dirname(os.path.abspath(self.output_file))
+        with tempfile.TemporaryDirectory(prefix='shards-', dir=directory) as directory:
+            with self._timer('partition'):
+                counts = self._partition(directory)
+            if counts is None:
+                return
+
+            shards = [i for i, count in enumerate(counts) if count]
+            if not shards:
+                logger.error(f'No valid rows in {self.input_file}.')
+                return
+            logger.info(f'Enriching {sum(counts)} rows in {len(shards)} shards: '
+                        f'{", ".join(str(counts[i]) for i in shards)} rows.')
+
+            loop = asyncio.get_running_loop()
+            with ProcessPoolExecutor(len(shards), mp_context=self.context, initializer=_init_shard_worker,
+                                     initargs=(self.rate_limiter, self.retry_budget)) as pool:
+                results = await asyncio.gather(*(loop.run_in_executor(pool, _run_shard, self._shard_options(
+                    directory, i)) for i in shards))
+
+            for result in results:
+                metrics.merge(result['metrics'])
+
+            failed = [i for i, result in zip(shards, results) if result['rows_written'] != counts[i]]
+            if failed:
+                logger.error(f'Shards {", ".join(map(str, failed))} failed, nothing was written to '
+                             f'{self.output_file}.')
+                return
+
+            with self._timer('merge'):
+                self._merge(directory, shards)
+
+        logger.info(f'{self.rows_written} rows enriched and written to {self.output_file}.')
+
+    @staticmethod
+    def _shard_files(directory: str, i: int) -> Tuple[str, str]:
+        """
+        :return: The input and output files of a shard. They are Parquet files, which keep the dtypes of the rows
+        exactly, e.g. a CSV round trip can change the last digit of a float.
+        """
+        return os.path.join(directory, f'input-{i}.parquet'), os.path.join(directory, f'output-{i}.parquet')
+
+    def _shard_options(self, directory: str, i: int) -> Dict:
+        input_file, output_file = self._shard_files(directory, i)
+        return {**self.options, 'input_file': input_file, 'output_file': output_file,
+                'input_columns': None, 'checkpoint_file': f'{output_file}.checkpoint', 'rejects_file': None,
+                'metrics_out': None, 'workers': 1}
+
+    def _partition(self, directory: str) -> Optional[List[int]]:
+        """
+        Writes the valid input rows to one file per shard, with their position in the input.
+
+        :return: The number of rows of each shard, or None if the input is invalid.
+        """
+        if self.chunk_size:
+            chunks = (chunk for _, chunk in self._load_chunks(0))
+        else:
+            with self._timer('load'):
+                chunks = [self._drop_invalid(self.input_source.load_data(self.input_file))]
 
-        if not self.data_validator.validate_output_data(df):
+        shard_source = ParquetDataSource()
+        counts = [0] * self.workers
+        try:
+            for chunk in chunks:
+                if not self._validate_input(chunk):
+                    logger.error('Input data validation failed!')
+                    return None
+
+                chunk = chunk.assign(**{ROW_COLUMN: np.arange(sum(counts), sum(counts) + len(chunk))})
+                ids = shard_ids(chunk['lei'], self.workers)
+                for i in range(self.workers):
+                    shard = chunk[ids == i]
+                    if not shard.empty:
+                        shard_source.save_data(shard, self._shard_files(directory, i)[0], append=True)
+                        counts[i] += len(shard)
+        except DataSourceError as e:
+            logger.error(f'{e} Stopping, nothing was written to {self.output_file}.')
+            return None
+        finally:
+            shard_source.close()
+        return counts
+
+    def _merge(self, directory: str, shards: List[int]) -> None:
+        """
+        Merges the outputs of the shards in the order of the input rows and writes them to the output file.
+        """
+        def load(i: int):
+            filename = self._shard_files(directory, i)[1]
+            data = ParquetDataSource().load_data(filename, chunk_size=self.chunk_size)
+            return data if self.chunk_size else [data]
+
+        try:
+            for df in merge_shards([load(i) for i in shards]):
+                df = df.drop(columns=ROW_COLUMN)
+                if not self._save(df, append=self.rows_written > 0):
+                    logger.error(f'Stopping the merge, {self.rows_written} rows were written to {self.output_file}.')
+                    return
+                self.rows_written += len(df)
+        except DataSourceError as e:
+            logger.error(f'{e} Stopping the merge, {self.rows_written} rows were written to {self.output_file}.')
+        finally:
+            self.output_source.close()
+
+    def _start_checkpoint(self) -> int:
+        """
+        Starts the checkpoint journal of a chunked run. With --resume, the journal of the previous run is picked up
+        instead, and the output file is truncated to its last completely written chunk.
+
+        :return: The index of the first chunk to process.
+        """
+        run = {'input_file': self.input_file, 'output_file': self.output_file, 'chunk_size': self.chunk_size,
+               'incremental': self.incremental}
+
+        if self.resume:
+            last = self.journal.resume(run)
+            if last is not None:
+                self.output_source.truncate(self.output_file, last['output_bytes'])
+                self.rows_written = last['rows']
+                self.append = True
+                logger.info(f'Resuming after chunk {last["chunk"]}, {last["rows"]} rows were already written.')
+                return last['chunk'] + 1
+
+        self.journal.start(run)
+        # Incremental runs append to the output of previous runs, the other runs overwrite it
+        self.append = self.incremental
+        self.journal.record(chunk=-1, rows=0, output_bytes=self._output_bytes() if self.incremental else 0)
+        return 0
+
+    def _load_chunks(self, start: int) -> Iterator[Tuple[int, pd.DataFrame]]:
+        """
+        Yields the input chunks from the chunk `start` on, with their indexes. In incremental mode, the rows already in
+        the output file are dropped.
+        """
+        existing = self._load_existing_keys() if self.incremental else None
+        chunks = iter(self.input_source.load_data(self.input_file, chunk_size=self.chunk_size))
+        for i in itertools.count():
+            with self._timer('load'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            if i < start:
+                continue
+            if existing is not None:
+                chunk = self._drop_existing(chunk, existing)
+            chunk = self._drop_invalid(chunk)
+            if chunk.empty:
+                continue
+            yield i, chunk
+
+    def _drop_invalid(self, df: pd.DataFrame) -> pd.DataFrame:
+        if 'lei' not in df.columns:
+            # Reported by the input validation
+            return df
+
+        with self._timer('validate'):
+            df, rejects = self.data_validator.split_invalid_rows(df)
+        if not rejects.empty and self.rejects_source:
+            self.rejects_source.save_data(rejects, self.rejects_file, append=self.rejected_rows > 0)
+        self.rejected_rows += len(rejects)
+        return df
+
+    def _save_chunk(self, i: int, chunk: pd.DataFrame) -> bool:
+        if not self._save(chunk, append=self.append or self.rows_written > 0):
+            return False
+
+        self.rows_written += len(chunk)
+        self.journal.record(chunk=i, rows=self.rows_written, output_bytes=self._output_bytes())
+        return True
+
+    def _output_bytes(self) -> Optional[int]:
+        """
+        :return: The size of the output file, which a resumed run truncates it to. None if the output can't be
+        truncated, e.g. an open Parquet file, whose size means nothing until its footer is written.
+        """
+        if not self.output_source.truncatable:
+            return None
+        return os.path.getsize(self.output_file) if os.path.exists(self.output_file) else 0
+
+    def _load_existing_keys(self) -> pd.Index:
+        if not os.path.exists(self.output_file):
+            return pd.Index([])
+
+        existing = get_data_source(self.output_file, columns=[self.incremental_key]).load_data(self.output_file)
+        if self.incremental_key not in existing.columns:
+            logger.warning(f'No {self.incremental_key} column in {self.output_file}, all rows are enriched.')
+            return pd.Index([])
+
+        logger.info(f'{len(existing)} rows are already in {self.output_file}.')
+        return pd.Index(existing[self.incremental_key].unique())
+
+    def _drop_existing(self, df: pd.DataFrame, existing: pd.Index) -> pd.DataFrame:
+        if self.incremental_key not in df.columns:
+            raise ValueError(f'The incremental mode needs a {self.incremental_key} column in {self.input_file}.')
+
+        is_new = ~df[self.incremental_key].isin(existing)
+        if not is_new.all():
+            logger.info(f'Skipping {len(df) - is_new.sum()} rows already in {self.output_file}.')
+        return df[is_new]
+
+    async def _process(self, df: pd.DataFrame) -> Optional[pd.DataFrame]:
+        """
+        Validates, enriches and calculates the data. Returns None if the input or output data is invalid.
+        """
+        if not self._validate_input(df):
+            logger.error('Input data validation failed!')
+            return None
+
+        df = await self._enrich(df)
+        df = self._calculate(df)
+
+        if not self._validate_output(df):
             logger.error('Output data validation failed!')
-            return
+            return None
+
+        return df
+
+    @staticmethod
+    def _timer(stage: str):
+        return metrics.timer('enrichment_stage_seconds', stage=stage)
+
+    def _validate_input(self, df: pd.DataFrame) -> bool:
+        with self._timer('validate'):
+            return self.data_validator.validate_input_data(df)
+
+    def _validate_output(self, df: pd.DataFrame) -> bool:
+        with self._timer('validate'):
+            return self.data_validator.validate_output_data(df)
+
+    async def _enrich(self, df: pd.DataFrame) -> pd.DataFrame:
+        with self._timer('enrich'):
+            return await self.data_enricher.enrich_data(df, df['lei'].tolist())
+
+    def _calculate(self, df: pd.DataFrame) -> pd.DataFrame:
+        with self._timer('calculate'):
+            if self.formula_engine:
+                return self.formula_engine.calculate(df)
+            return calculate(df=df, formula=TransactionCostsFormula(), column_name='transaction_costs')
+
+    def _save(self, df: pd.DataFrame, append: bool) -> bool:
+        with self._timer('save'):
+            return bool(self.output_source.save_data(df, self.output_file, append=append))
+
+    def _report_metrics(self) -> None:
+        # The caches of a sharded run are in the workers, their metrics are merged from the workers
+        if self.workers == 1:
+            stats = self.cache.stats()
+            metrics.set('enrichment_cache_hits', stats.hits)
+            metrics.set('enrichment_cache_misses', stats.misses)
+            metrics.set('enrichment_cache_evictions', stats.evictions)
+            metrics.set('enrichment_cache_entries', stats.entries)
+            metrics.set('enrichment_cache_size_bytes', stats.size_bytes)
+        metrics.set('enrichment_rows_written', self.rows_written)
+        metrics.set('enrichment_rows_rejected', self.rejected_rows)
+
+        logger.info(metrics.summary())
+        if self.metrics_out:
+            metrics.export(self.metrics_out)
+
+
+# The shared rate limiter and retry budget of a sharded run, handed to each worker process when it's started
+_shard_state = {}
+
+
+def _init_shard_worker(rate_limiter: IRateLimiter, retry_budget: RetryBudget) -> None:
+    _shard_state.update(rate_limiter=rate_limiter, retry_budget=retry_budget)
+
+
+def _run_shard(options: Dict) -> Dict:
+    """
+    Enriches one shard of a sharded run in a worker process.
 
-        self.data_source.save_data(df, self.output_file)
+    :return: The number of rows written and the metrics of the shard.
+    """
+    try:
+        runner = DataEnrichmentRunner(**{**options, **_shard_state})
+        asyncio.run(runner.run())
+        return {'rows_written': runner.rows_written, 'metrics': metrics.snapshot()}
+    finally:
+        # Worker processes exit without running the atexit handlers, so the queued logs are flushed here
+        Logger.disable_queue()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Data enrichment app.')
 
-    parser.add_argument('--client', type=str, default='LeiLookupClient', help='The client.')
+    parser.add_argument('--client', type=str, default='LeiLookupClient', choices=['LeiLookupClient', 'LocalLeiClient'],
+                        help='The client. LocalLeiClient answers the lookups from the local golden copy store.')
+    parser.add_argument('--base_url', type=str, default='https://api.gleif.org/api/v1/lei-records?filter[lei]=',
+                        help='The LEI lookup url of the LeiLookupClient, e.g. a mirror or a local mock server.')
     parser.add_argument('--cache_size', type=int, default=100, help='The size of the cache.')
-    parser.add_argument('--sleep_rate', type=float, default=0.6, help='The sleep rate between requests.')
+    parser.add_argument('--cache_max_bytes', type=int, default=None,
+                        help='The maximum size of the memory cache in bytes. Default is no limit.')
+    parser.add_argument('--cache_backend', type=str, default='memory', choices=['memory', 'sqlite'],
+                        help='The cache backend. sqlite keeps the cache on disk across runs.')
+    parser.add_argument('--cache_path', type=str, default='data/lei_cache.sqlite',
+                        help='The path to the cache file of the sqlite backend.')
+    parser.add_argument('--cache_ttl', type=float, default=7 * 24 * 60 * 60,
+                        help='The time to live of the sqlite cache entries in seconds.')
+    parser.add_argument('--cache_records', action='store_true',
+                        help='Cache the parsed records instead of the raw API responses.')
+    parser.add_argument('--requests_per_second', type=float, default=1.0, help='The allowed API request rate.')
+    parser.add_argument('--burst', type=int, default=1, help='The number of requests that can be sent at once.')
+    parser.add_argument('--max_concurrency', type=int, default=10, help='The maximum number of requests in flight.')
     parser.add_argument('--retry_attempts', type=int, default=3, help='The number of retry attempts.')
+    parser.add_argument('--retry_base_delay', type=float, default=0.5,
+                        help='The maximum delay before the first retry in seconds, doubled on every retry.')
+    parser.add_argument('--retry_max_delay', type=float, default=30, help='The maximum retry delay in seconds.')
+    parser.add_argument('--retry_budget_ratio', type=float, default=0.2,
+                        help='The number of retries allowed per request across the whole run.')
+    parser.add_argument('--negative_cache_ttl', type=float, default=24 * 60 * 60,
+                        help='How long LEIs unknown to the API are cached, in seconds.')
+    parser.add_argument('--failure_cache_ttl', type=float, default=5 * 60,
+                        help='How long LEIs whose fetch failed are cached as failed, in seconds.')
+    parser.add_argument('--breaker_failure_rate', type=float, default=0.5,
+                        help='The share of failed recent requests that opens the circuit breaker.')
+    parser.add_argument('--breaker_open_seconds', type=float, default=30,
+                        help='How long the circuit breaker stays open before a probe request, in seconds.')
+    parser.add_argument('--revalidate_after', type=float, default=None,
+                        help='Revalidate cached data older than this many seconds with conditional requests.')
+    parser.add_argument('--stale_while_revalidate', action='store_true',
+                        help='Use stale cached data at once and revalidate it in the background.')
+    parser.add_argument('--page_size', type=int, default=100, help='The number of LEIs fetched per request.')
+    parser.add_argument('--pool_size', type=int, default=100, help='The maximum number of open connections.')
+    parser.add_argument('--pool_size_per_host', type=int, default=10,
+                        help='The maximum number of open connections to a single host.')
+    parser.add_argument('--keepalive_timeout', type=float, default=30,
+                        help='How long idle connections are kept alive, in seconds.')
+    parser.add_argument('--dns_cache_ttl', type=int, default=300, help='How long DNS lookups are cached, in seconds.')
+    parser.add_argument('--connect_timeout', type=float, default=10, help='The connect timeout in seconds.')
+    parser.add_argument('--read_timeout', type=float, default=30, help='The socket read timeout in seconds.')
+    parser.add_argument('--total_timeout', type=float, default=60, help='The timeout of a whole request in seconds.')
+    parser.add_argument('--compress_responses', action=argparse.BooleanOptionalAction, default=True,
+                        help='Ask the API for compressed responses.')
+    parser.add_argument('--sparse_fieldsets', action='store_true',
+                        help='Request only the record attributes the parser needs, with a JSON:API sparse fieldset.')
     parser.add_argument('--log_level', type=str, default='INFO', help='The log level.')
+    parser.add_argument('--log_queue', action=argparse.BooleanOptionalAction, default=True,
+                        help='Write the logs from a background thread, so logging does not block the run.')
     parser.add_argument('--input_file', type=str, default='data/input_dataset.csv', help='The path to the input file.')
     parser.add_argument('--output_file', type=str, default='data/output_data.csv', help='The path to the output file.')
+    parser.add_argument('--input_columns', type=str, default=None,
+                        help='Comma-separated columns to load from the input file. Default is all columns.')
+    parser.add_argument('--chunk_size', type=int, default=None,
+                        help='Stream the input file in chunks of this many rows to bound memory usage.')
+    parser.add_argument('--formulas_file', type=str, default='config/formulas.json',
+                        help='The JSON rule tables of the derived columns. If empty, TransactionCostsFormula is used.')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Overlap the fetch, calculate and save stages of the chunks. Needs --chunk_size.')
+    parser.add_argument('--pipeline_depth', type=int, default=2,
+                        help='The maximum number of chunks waiting between two pipeline stages.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume an interrupted chunked run from its checkpoint. Needs --chunk_size.')
+    parser.add_argument('--checkpoint_file', type=str, default=None,
+                        help='The checkpoint journal of chunked runs. Default is the output file + .checkpoint.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only enrich the input rows that are not in the output file yet, and append them to it.')
+    parser.add_argument('--incremental_key', type=str, default='transaction_uti',
+                        help='The column identifying the rows in the incremental mode.')
+    parser.add_argument('--golden_copy_path', type=str, default='data/golden_copy.sqlite',
+                        help='The local golden copy store of the LocalLeiClient, filled with ingest_golden_copy.py.')
+    parser.add_argument('--golden_copy_fallback', action='store_true',
+                        help='Fetch the LEIs missing from the golden copy store from the gleif API.')
+    parser.add_argument('--rejects_file', type=str, default=None,
+                        help='Write the rows with an invalid LEI to this file, with the reason of the rejection.')
+    parser.add_argument('--metrics_out', type=str, default=None,
+                        help='Export the metrics of the run to this file: JSON if it ends with .json, the Prometheus '
+                             'text format otherwise.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Enrich the input in this many worker processes, sharded by LEI. Default is 1.')
 
     args = parser.parse_args()
     arg_dict = vars(args)
@@ -0,0 +1,41 @@
+from typing import Optional
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from components.cacher import ICache, LeiLookupCache
+from components.data_enricher import LeiLookupClient
+from components.rate_limiter import TokenBucketRateLimiter
+from components.retry_policy import RetryPolicy
+
+
+@pytest.fixture
+def make_server():
+    """
+    Returns a factory of local lei-records endpoints served by an aiohttp handler, use it with `async with`.
+    """
+    def make_server(handler) -> TestServer:
+        app = web.Application()
+        app.router.add_get('/api/v1/lei-records', handler)
+        return TestServer(app)
+
+    return make_server
+
+
+@pytest.fixture
+def make_client():
+    """
+    Returns a factory of LeiLookupClients for a local server, a TestServer or a MockGleifServer. The clients aren't
+    held back by the rate limiter and retry quickly, the keyword arguments override any of their options.
+    """
+    def make_client(server, cache: Optional[ICache] = None, **kwargs) -> LeiLookupClient:
+        if isinstance(server, TestServer):
+            url = str(server.make_url('/api/v1/lei-records?filter[lei]='))
+        else:
+            url = server.url
+        options = dict(rate_limiter=TokenBucketRateLimiter(1000, burst=1000), retry_policy=RetryPolicy(base_delay=0.01),
+                       base_url=url)
+        return LeiLookupClient(cache if cache is not None else LeiLookupCache(100), **{**options, **kwargs})
+
+    return make_client
@@ -1,4 +1,6 @@
-from components.cacher import LeiLookupCache
+from unittest.mock import patch
+
+from components.cacher import LeiLookupCache, SqliteCache, CacheStats, sizeof
 
 
 def test_cache():
@@ -15,3 +17,85 @@ def test_cache():
 
     assert cache.get("key4") == "value4"
     assert cache.get("key1") is None
+
+
+def test_cache_ttl():
+    cache = LeiLookupCache(cache_size=3)
+
+    with patch('components.cacher.time.monotonic', return_value=1000):
+        cache.add('key1', 'value1')
+        cache.add('key2', 'value2', ttl=10)
+
+    with patch('components.cacher.time.monotonic', return_value=1030):
+        assert cache.get('key1') == 'value1'
+        assert cache.get('key2') is None
+
+    assert cache.stats().entries == 1
+
+
+def test_sqlite_cache(tmp_path):
+    cache = SqliteCache(str(tmp_path / 'cache.sqlite'))
+
+    cache.add('key1', 'value1')
+    cache.add_many({'key2': 'value2', 'key3': {'nested': 'value3'}})
+
+    assert cache.get('key1') == 'value1'
+    assert cache.get('missing') is None
+    assert cache.get_many(['key2', 'key3', 'missing']) == {'key2': 'value2', 'key3': {'nested': 'value3'}}
+
+
+def test_sqlite_cache_ttl(tmp_path):
+    cache = SqliteCache(str(tmp_path / 'cache.sqlite'), ttl=60)
+
+    with patch('components.cacher.time.time', return_value=1000):
+        cache.add('key1', 'value1')
+        cache.add('key2', 'value2', ttl=10)
+
+    with patch('components.cacher.time.time', return_value=1030):
+        assert cache.get('key1') == 'value1'
+        assert cache.get('key2') is None
+
+
+def test_sqlite_cache_is_shared(tmp_path):
+    # Entries written through one instance, e.g. by a previous run, are visible to another one
+    SqliteCache(str(tmp_path / 'cache.sqlite')).add('key1', 'value1')
+
+    assert SqliteCache(str(tmp_path / 'cache.sqlite')).get('key1') == 'value1'
+
+
+def test_cache_is_lru():
+    cache = LeiLookupCache(cache_size=2)
+
+    cache.add('key1', 'value1')
+    cache.add('key2', 'value2')
+    # Using key1 makes key2 the least recently used entry
+    assert cache.get('key1') == 'value1'
+    cache.add('key3', 'value3')
+
+    assert cache.get('key2') is None
+    assert cache.get('key1') == 'value1'
+    assert cache.stats() == CacheStats(hits=2, misses=1, evictions=1, entries=2,
+                                       size_bytes=cache.size_bytes)
+
+
+def test_cache_max_bytes():
+    cache = LeiLookupCache(cache_size=100, max_bytes=3 * (sizeof('key1') + sizeof('x' * 100)))
+
+    for i in range(5):
+        cache.add(f'key{i}', 'x' * 100)
+
+    assert cache.stats().entries == 3
+    assert cache.stats().evictions == 2
+    assert cache.get('key1') is None
+    assert cache.get('key4') is not None
+
+
+def test_sqlite_cache_stats(tmp_path):
+    cache = SqliteCache(str(tmp_path / 'cache.sqlite'))
+    cache.add_many({'key1': 'value1', 'key2': 'value2'})
+
+    cache.get_many(['key1', 'key2', 'key3'])
+
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.entries) == (2, 1, 2)
+    assert stats.hit_rate == 2 / 3
@@ -9,6 +9,11 @@ class DummyFormula(Formula):
     def apply(self, row):
         return row['x'] * 2
 
+
+class ScaledFormula(DummyFormula):
+    def apply_frame(self, df):
+        return super().apply_frame(df) * 10
+
 @pytest.fixture
 def mock_logger():
     return Mock()
@@ -28,6 +33,14 @@ def test_calculate(mock_cpu_count, mock_logger):
     assert 'z' in df.columns
     assert df['z'].tolist() == [2, 4, 6]
 
+
+def test_apply_frame_fallback():
+    df = pd.DataFrame({'x': [1, 2, 3]}, index=[7, 8, 9])
+
+    df = calculate(df, 'z', ScaledFormula())
+
+    assert df['z'].to_dict() == {7: 20, 8: 40, 9: 60}
+
 @patch('components.transaction_calculator.logger')
 def test_transaction_costs_formula(mock_logger):
     formula = TransactionCostsFormula()
@@ -56,3 +69,20 @@ def test_transaction_costs_formula(mock_logger):
 
     assert formula.apply(row_other) is None
     mock_logger.warning.assert_called_with("No transaction costs calculated for unknown country: US")
+
+
+@patch('components.transaction_calculator.logger')
+def test_transaction_costs_formula_apply_frame(mock_logger):
+    df = pd.DataFrame({
+        'country': ['GB', 'NL', 'US', 'DE'],
+        'notional': [100, 100, 100, 100],
+        'rate': [0.2, 0.2, 0.2, 0.2]
+    }, index=[10, 11, 12, 13])
+
+    df = calculate(df, 'transaction_costs', TransactionCostsFormula())
+
+    assert df.index.tolist() == [10, 11, 12, 13]
+    assert df['transaction_costs'].tolist()[:2] == pytest.approx([-80, 400])
+    assert df['transaction_costs'].iloc[2:].isna().all()
+    mock_logger.warning.assert_called_once_with(
+        "No transaction costs calculated for 2 rows with unknown countries: DE, US")
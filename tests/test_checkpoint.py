@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+
+from benchmarks.mock_gleif_server import MockGleifServer
+from components.checkpoint import CheckpointJournal
+from main import DataEnrichmentRunner
+
+RUN = {'input_file': 'input.csv', 'output_file': 'output.csv', 'chunk_size': 10, 'incremental': False}
+
+
+def test_checkpoint_journal(tmp_path):
+    journal = CheckpointJournal(str(tmp_path / 'output.csv.checkpoint'))
+
+    assert journal.resume(RUN) is None
+
+    journal.start(RUN)
+    assert journal.resume(RUN) is None
+
+    journal.record(chunk=0, rows=10, output_bytes=100)
+    journal.record(chunk=1, rows=20, output_bytes=200)
+    assert journal.resume(RUN) == {'chunk': 1, 'rows': 20, 'output_bytes': 200}
+
+    with pytest.raises(ValueError):
+        journal.resume({**RUN, 'chunk_size': 20})
+
+    journal.start(RUN)
+    assert journal.resume(RUN) is None
+
+
+def test_checkpoint_journal_torn_line(tmp_path):
+    path = tmp_path / 'output.csv.checkpoint'
+    journal = CheckpointJournal(str(path))
+    journal.start(RUN)
+    journal.record(chunk=0, rows=10, output_bytes=100)
+    with open(path, 'a') as file:
+        file.write('{"chunk": 1, "ro')
+
+    assert journal.resume(RUN) == {'chunk': 0, 'rows': 10, 'output_bytes': 100}
+
+    journal.record(chunk=1, rows=20, output_bytes=200)
+    assert journal.resume(RUN) == {'chunk': 1, 'rows': 20, 'output_bytes': 200}
+
+
+def test_resume_needs_csv_output(tmp_path):
+    with pytest.raises(NotImplementedError):
+        DataEnrichmentRunner(input_file='data/input_dataset.csv', output_file=str(tmp_path / 'output.parquet'),
+                             chunk_size=5, resume=True, client='LeiLookupClient', log_queue=False)
+
+
+@pytest.mark.asyncio
+async def test_incremental_parquet_output(tmp_path):
+    pytest.importorskip('pyarrow')
+    input_file, output_file = str(tmp_path / 'input.csv'), str(tmp_path / 'output.parquet')
+    data = pd.read_csv('data/input_dataset.csv')
+
+    async with MockGleifServer() as server:
+        for rows in (10, len(data)):
+            data.head(rows).to_csv(input_file, index=False)
+            runner = DataEnrichmentRunner(client='LeiLookupClient', input_file=input_file, output_file=output_file,
+                                          incremental=True, base_url=server.url, requests_per_second=1000, burst=1000,
+                                          log_queue=False)
+            await runner.run()
+            # The output is complete once the run returns, so the next run can read its keys
+            assert len(pd.read_parquet(output_file)) == rows
+
+    assert pd.read_parquet(output_file)['transaction_uti'].tolist() == data['transaction_uti'].tolist()
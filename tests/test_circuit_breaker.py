@@ -0,0 +1,134 @@
+import pytest
+from aiohttp import web
+
+from components.cacher import LeiLookupCache
+from components.circuit_breaker import CircuitBreaker
+from components.data_enricher import FAILED_FETCH
+from components.rate_limiter import TokenBucketRateLimiter
+
+
+def test_circuit_breaker():
+    now = 0
+    breaker = CircuitBreaker(failure_rate=0.5, window=4, min_requests=4, open_seconds=10, clock=lambda: now)
+
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    # After open_seconds, a single probe is let through
+    now = 10
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # The probe failed, the circuit stays open
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    now = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_circuit_breaker_ignores_requests_before_the_probe():
+    now = 0
+    breaker = CircuitBreaker(failure_rate=0.5, window=2, min_requests=2, open_seconds=10, clock=lambda: now)
+
+    early = breaker.allow()
+    breaker.record_failure(breaker.allow())
+    breaker.record_failure(breaker.allow())
+    assert breaker.state == CircuitBreaker.OPEN
+
+    now = 10
+    probe = breaker.allow()
+    # A request sent before the circuit opened succeeds while the probe is pending
+    breaker.record_success(early)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    breaker.record_success(probe)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_circuit_breaker_needs_min_requests():
+    breaker = CircuitBreaker(failure_rate=0.5, window=10, min_requests=5)
+
+    for _ in range(4):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    for _ in range(6):
+        breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_client_circuit_breaker(make_server, make_client):
+    requests = []
+
+    async def handler(request):
+        requests.append(request.query['filter[lei]'])
+        return web.json_response({'data': []}, status=503, headers={'Retry-After': '0'})
+
+    async with make_server(handler) as server:
+        breaker = CircuitBreaker(failure_rate=0.5, window=4, min_requests=4, open_seconds=60)
+        async with make_client(server, LeiLookupCache(100), circuit_breaker=breaker, failure_ttl=None,
+                               page_size=1) as client:
+            leis = [f'LEI{i}' for i in range(10)]
+            assert await client.fetch_many(leis) == dict.fromkeys(leis)
+
+    # The first attempts were sent concurrently, the circuit opened before any of them was retried. Without the
+    # breaker, there would have been 30 attempts
+    assert len(requests) == 10
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+@pytest.mark.asyncio
+async def test_client_circuit_breaker_after_rate_limiter(make_server, make_client):
+    requests = []
+
+    async def handler(request):
+        requests.append(request.query['filter[lei]'])
+        return web.json_response({'data': []}, status=503)
+
+    async with make_server(handler) as server:
+        breaker = CircuitBreaker(failure_rate=1, window=1, min_requests=1, open_seconds=60)
+        async with make_client(server, circuit_breaker=breaker, rate_limiter=TokenBucketRateLimiter(20, burst=1),
+                               failure_ttl=None, page_size=1) as client:
+            leis = [f'LEI{i}' for i in range(3)]
+            assert await client.fetch_many(leis) == dict.fromkeys(leis)
+
+    # The other requests were waiting for the rate limiter when the first one opened the circuit
+    assert len(requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_client_caches_negative_results(make_server, make_client):
+    requests = []
+
+    async def handler(request):
+        lei = request.query['filter[lei]']
+        requests.append(lei)
+        if lei == 'FAILING':
+            return web.json_response({}, status=500, headers={'Retry-After': '0'})
+        return web.json_response({'data': []})
+
+    cache = LeiLookupCache(100)
+    async with make_server(handler) as server:
+        async with make_client(server, cache, negative_ttl=60, failure_ttl=60) as client:
+            assert await client.fetch('UNKNOWN') == '{"data": []}'
+            assert await client.fetch('FAILING') is None
+            assert len(requests) == 4
+
+            # Neither the unknown LEI nor the failed one is fetched again
+            assert await client.fetch('UNKNOWN') == '{"data": []}'
+            assert await client.fetch_many(['UNKNOWN', 'FAILING']) == {'UNKNOWN': '{"data": []}', 'FAILING': None}
+            assert len(requests) == 4
+
+    assert cache.expires_at.keys() == {'UNKNOWN', 'FAILING'}
+    assert cache.get('FAILING') == FAILED_FETCH
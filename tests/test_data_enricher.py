@@ -1,9 +1,15 @@
+import asyncio
+import json
+
 import pandas as pd
 import pytest
+import pytest_asyncio
+from aiohttp import web
 from unittest.mock import MagicMock, AsyncMock, call
 
+from components.cacher import LeiLookupCache
 from components.data_enricher import LeiLookupClient, DataEnricher, IClient
-from components.data_parser import LEIDataParser, IDataParser
+from components.data_parser import LEIDataParser, IDataParser, LEIRecord
 
 # Existing data
 data = {
@@ -21,7 +27,9 @@ expected_enriched_data = {
     'bic': ['SBILGB2LXXX', 'LLCMGB22XXX', 'JPMSGB2LXXX', 'SBILGB2LXXX', 'JPMSGB2LXXX'],
     'country': ['GB', 'GB', 'GB', 'GB', 'GB'],
 }
-expected_df = pd.DataFrame(expected_enriched_data)
+# The enriched fields are categorical, the distinct values are only stored once
+expected_df = pd.DataFrame(expected_enriched_data).astype({'legal_name': 'category', 'bic': 'category',
+                                                           'country': 'category'})
 
 # The fetch response for each LEI
 lei_responses = {
@@ -46,3 +54,110 @@ async def test_enrich_data_integration():
 
     # Check if the data enrichment was correct
     pd.testing.assert_frame_equal(enriched_df, expected_df)
+
+
+# Records returned by the local gleif stand-in, keyed by LEI
+lei_records = {
+    lei: {'type': 'lei-records', 'id': lei, 'attributes': {'lei': lei, **json.loads(response)[0]['data'][0]['attributes']}}
+    for lei, response in lei_responses.items()
+}
+
+
+@pytest_asyncio.fixture
+async def gleif_server(make_server):
+    requests = []
+
+    async def lei_records_handler(request):
+        requests.append(request.query_string)
+        leis = request.query['filter[lei]'].split(',')
+        return web.json_response({'data': [lei_records[lei] for lei in leis if lei in lei_records]})
+
+    async with make_server(lei_records_handler) as server:
+        server.requests = requests
+        yield server
+
+
+@pytest.mark.asyncio
+async def test_fetch_many_batches_requests(gleif_server, make_client):
+    client = make_client(gleif_server, page_size=2)
+    ids = ['XKZZ2JZF41MRHTR1V493', '213800MBWEIJDM5CU638', 'K6Q0W1PS1L1O4IQL9C32', 'UNKNOWN0000000000000']
+
+    async with client:
+        results = await client.fetch_many(ids)
+
+    # Four LEIs with a page size of two should take two requests
+    assert len(gleif_server.requests) == 2
+    assert LEIDataParser.parse_data([results[id_] for id_ in ids]) == [
+        {'legal_name': 'CITIGROUP GLOBAL MARKETS LIMITED', 'bic': 'SBILGB2LXXX', 'country': 'GB'},
+        {'legal_name': 'LLOYDS BANK CORPORATE MARKETS PLC', 'bic': 'LLCMGB22XXX', 'country': 'GB'},
+        {'legal_name': 'J.P. MORGAN SECURITIES PLC', 'bic': 'JPMSGB2LXXX', 'country': 'GB'},
+        {'legal_name': '', 'bic': '', 'country': ''},
+    ]
+
+    # The found records are cached, so fetching them again doesn't hit the server
+    async with client:
+        await client.fetch_many(ids[:3])
+    assert len(gleif_server.requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_enrich_data_with_local_server(gleif_server, make_client):
+    client = make_client(gleif_server)
+    data_enricher = DataEnricher(client=client, data_parser=LEIDataParser())
+
+    async with client:
+        enriched_df = await data_enricher.enrich_data(df.copy(), df['lei'].tolist())
+
+    pd.testing.assert_frame_equal(enriched_df, expected_df)
+    assert len(gleif_server.requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_fetch_coalesces_concurrent_requests(gleif_server, make_client):
+    client = make_client(gleif_server)
+
+    async with client:
+        responses = await asyncio.gather(*(client.fetch('XKZZ2JZF41MRHTR1V493') for _ in range(5)),
+                                         client.fetch_many(['XKZZ2JZF41MRHTR1V493', '213800MBWEIJDM5CU638']))
+
+    # The concurrent callers share the first request for the same LEI
+    assert len(gleif_server.requests) == 2
+    assert len(set(responses[:5])) == 1
+    assert responses[5]['XKZZ2JZF41MRHTR1V493'] == responses[0]
+
+
+@pytest.mark.asyncio
+async def test_enrich_data_with_cached_records(gleif_server, make_client):
+    cache = LeiLookupCache(100)
+    client = make_client(gleif_server, cache, record_parser=LEIDataParser())
+    data_enricher = DataEnricher(client=client, data_parser=LEIDataParser())
+
+    async with client:
+        assert await client.fetch('UNKNOWN0000000000000') == LEIRecord('', '', '')
+        enriched_df = await data_enricher.enrich_data(df.copy(), df['lei'].tolist())
+        # The second run is served from the cached records
+        cached_enriched_df = await data_enricher.enrich_data(df.copy(), df['lei'].tolist())
+
+    pd.testing.assert_frame_equal(enriched_df, expected_df)
+    pd.testing.assert_frame_equal(cached_enriched_df, expected_df)
+    assert len(gleif_server.requests) == 2
+    assert cache.get('213800MBWEIJDM5CU638') == LEIRecord('LLOYDS BANK CORPORATE MARKETS PLC', 'LLCMGB22XXX', 'GB')
+
+
+@pytest.mark.asyncio
+async def test_enrich_data_keeps_index():
+    class RecordClient(IClient):
+        async def fetch(self, id_):
+            return LEIRecord(f'NAME {id_}', '', 'GB') if id_ != 'UNKNOWN' else None
+
+    frame = pd.DataFrame({'lei': ['A', 'B', 'UNKNOWN', 'A'], 'notional': [1, 2, 3, 4]}, index=[40, 30, 20, 10])
+    original = frame.copy()
+
+    enriched_df = await DataEnricher(RecordClient(), LEIDataParser()).enrich_data(frame, frame['lei'].tolist())
+
+    pd.testing.assert_frame_equal(frame, original)
+    assert enriched_df.index.tolist() == [40, 30, 20, 10]
+    assert enriched_df['legal_name'].dtype == 'category'
+    assert enriched_df['legal_name'].tolist()[:2] == ['NAME A', 'NAME B']
+    assert enriched_df['legal_name'].isnull().tolist() == [False, False, True, False]
+    assert enriched_df['country'].cat.categories.tolist() == ['GB']
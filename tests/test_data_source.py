@@ -1,7 +1,9 @@
+import os
+
 import pandas as pd
 import pytest
 from unittest.mock import patch, mock_open
-from components.data_source import CsvDataSource
+from components.data_source import CsvDataSource, DataSourceError, ParquetDataSource, get_data_source
 
 
 # Fixtures for reusable components
@@ -33,3 +35,91 @@ def test_load_data(data_source):
             result = data_source.load_data('filename.csv')
     mock_read_csv.assert_called_once_with('filename.csv')
 
+
+
+def test_load_and_append_chunks(data_source, sample_data, tmp_path):
+    input_file = str(tmp_path / 'input.csv')
+    output_file = str(tmp_path / 'output.csv')
+    pd.concat([sample_data] * 3).to_csv(input_file, index=False)
+
+    chunks = list(data_source.load_data(input_file, chunk_size=4))
+    assert [len(chunk) for chunk in chunks] == [4, 2]
+
+    for chunk in chunks:
+        assert data_source.save_data(chunk, output_file, append=True)
+
+    # The header is written once, with the first chunk
+    pd.testing.assert_frame_equal(pd.read_csv(output_file), pd.concat([sample_data] * 3, ignore_index=True))
+
+
+def test_truncate(data_source, sample_data, tmp_path):
+    output_file = str(tmp_path / 'output.csv')
+    data_source.save_data(sample_data, output_file, append=True)
+    size = os.path.getsize(output_file)
+    data_source.save_data(sample_data, output_file, append=True)
+
+    data_source.truncate(output_file, size)
+
+    pd.testing.assert_frame_equal(pd.read_csv(output_file), sample_data)
+    with pytest.raises(NotImplementedError):
+        ParquetDataSource().truncate(output_file, 0)
+
+
+def test_parquet_round_trip(sample_data, tmp_path):
+    pytest.importorskip('pyarrow')
+    filename = str(tmp_path / 'data.parquet')
+
+    assert get_data_source(filename).save_data(sample_data, filename)
+
+    pd.testing.assert_frame_equal(get_data_source(filename).load_data(filename), sample_data)
+    pd.testing.assert_frame_equal(get_data_source(filename, columns=['column2']).load_data(filename),
+                                  sample_data[['column2']])
+
+
+def test_parquet_chunks(sample_data, tmp_path):
+    pytest.importorskip('pyarrow')
+    input_file = str(tmp_path / 'input.parquet')
+    output_file = str(tmp_path / 'output.parquet')
+    data_source = ParquetDataSource()
+    data_source.save_data(pd.concat([sample_data] * 3, ignore_index=True), input_file)
+
+    chunks = list(data_source.load_data(input_file, chunk_size=4))
+    assert [len(chunk) for chunk in chunks] == [4, 2]
+
+    for i, chunk in enumerate(chunks):
+        assert data_source.save_data(chunk, output_file, append=i > 0)
+    data_source.close()
+
+    pd.testing.assert_frame_equal(data_source.load_data(output_file), pd.concat([sample_data] * 3, ignore_index=True))
+
+
+def test_parquet_append_empty_categories(tmp_path):
+    pytest.importorskip('pyarrow')
+    filename = str(tmp_path / 'output.parquet')
+    data_source = ParquetDataSource()
+    # The LEIs of the first chunk are all unknown, so its enriched columns have no values
+    unknown = pd.DataFrame({'lei': ['LEI1'], 'bic': [None],
+                            'legal_name': pd.Categorical.from_codes([-1], categories=pd.Index([], dtype=object))})
+    known = pd.DataFrame({'lei': ['LEI2'], 'bic': ['1234'], 'legal_name': pd.Categorical(['Company 2'])})
+
+    assert data_source.save_data(unknown, filename, append=True)
+    assert data_source.save_data(known, filename, append=True)
+    data_source.close()
+
+    data = data_source.load_data(filename)
+    assert data['legal_name'].tolist()[1] == 'Company 2'
+    assert data['bic'].tolist()[1] == '1234'
+
+
+def test_load_chunks_parser_error(data_source, tmp_path):
+    filename = str(tmp_path / 'input.csv')
+    # The unterminated quote is only found once the chunks before it were loaded
+    rows = [f'{i},data{i}' for i in range(30)] + ['0,"unterminated', '1,data1']
+    with open(filename, 'w') as file:
+        file.write('\n'.join(['column1,column2'] + rows) + '\n')
+
+    loaded = []
+    with pytest.raises(DataSourceError):
+        for chunk in data_source.load_data(filename, chunk_size=10):
+            loaded.append(len(chunk))
+    assert loaded == [10, 10, 10]
@@ -1,7 +1,7 @@
 import pandas as pd
 import pytest
 from unittest.mock import patch
-from components.data_validator import LEIDataValidator
+from components.data_validator import LEIDataValidator, check_leis
 
 
 # Fixtures for reusable components
@@ -44,3 +44,29 @@ def test_validate_output_data_pass(validator, sample_output_data):
 
 def test_validate_output_data_fail(validator, sample_input_data):
     assert not validator.validate_output_data(sample_input_data)
+
+
+def test_check_leis():
+    leis = pd.Series(['XKZZ2JZF41MRHTR1V493', '213800MBWEIJDM5CU638', 'XKZZ2JZF41MRHTR1V494', 'XKZZ2JZF41MRHTR1V49',
+                      'xkzz2jzf41mrhtr1v493', None, 'XKZZ2JZF41MRHTR1V4ÄÄ', 'XKZZ2JZF41MRHTR1VX93',
+                      'XKZZ2JZF41MRHTR1V493'])
+
+    assert check_leis(leis).tolist() == ['', '', 'check digits', 'length', 'characters', 'missing', 'characters',
+                                         'check digits', '']
+    assert check_leis(pd.Series([], dtype=object)).tolist() == []
+
+
+def test_split_invalid_rows(validator):
+    df = pd.DataFrame({
+        'lei': ['XKZZ2JZF41MRHTR1V493', 'lei1', '213800MBWEIJDM5CU638'],
+        'notional': [1000, 2000, 3000],
+    }, index=[5, 6, 7])
+
+    valid, rejects = validator.split_invalid_rows(df)
+
+    assert valid.index.tolist() == [5, 7]
+    assert rejects.index.tolist() == [6]
+    assert rejects['reject_reason'].tolist() == ['length']
+
+    valid, rejects = validator.split_invalid_rows(valid)
+    assert len(valid) == 2 and rejects.empty
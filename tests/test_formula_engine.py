@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from components.formula_engine import Expression, FormulaEngine
+from components.transaction_calculator import calculate, TransactionCostsFormula
+
+
+def test_expression():
+    expression = Expression('abs(notional * (1 / rate) - notional)')
+    columns = {'notional': np.array([100.0, 50.0]), 'rate': np.array([0.2, 0.5])}
+
+    assert expression.columns == {'notional', 'rate'}
+    assert expression(columns).tolist() == pytest.approx([400, 50])
+    assert Expression('-max(notional, 75) ** 2 % 7')(columns).tolist() == pytest.approx([-10000 % 7, -5625 % 7])
+
+
+@pytest.mark.parametrize('source', ['__import__("os").system("ls")', 'notional.real', 'notional if rate else 0',
+                                    'notional +', 'sum(notional)', '"text"'])
+def test_invalid_expression(source):
+    with pytest.raises(ValueError):
+        Expression(source)
+
+
+def test_formula_engine():
+    engine = FormulaEngine.from_config({
+        'key': 'country',
+        'formulas': {
+            'transaction_costs': {
+                'rules': {'GB': 'notional * rate - notional', 'NL': 'abs(notional * (1 / rate) - notional)'},
+            },
+            'fee': {
+                'rules': {'GB': 'notional * 0.01', 'FR': '0'},
+                'default': 'notional * 0.02',
+            },
+        },
+    })
+    df = pd.DataFrame({
+        'country': ['NL', 'GB', 'US', None, 'GB', 'FR'],
+        'notional': [100, 100, 100, 100, 200, 100],
+        'rate': [0.2, 0.2, 0.2, 0.2, 0.5, 0.2]
+    }, index=[5, 4, 3, 2, 1, 0])
+
+    df = engine.calculate(df)
+
+    assert df.index.tolist() == [5, 4, 3, 2, 1, 0]
+    assert df['transaction_costs'].tolist()[:2] == pytest.approx([400, -80])
+    assert df['transaction_costs'].iloc[[2, 3, 5]].isna().all()
+    assert df['transaction_costs'].iloc[4] == pytest.approx(-100)
+    # The row with a missing country gets the default too
+    assert df['fee'].tolist() == pytest.approx([2, 1, 2, 2, 2, 0])
+
+    with pytest.raises(ValueError, match='Missing columns for the formulas: rate'):
+        engine.evaluate(df.drop(columns='rate'), names=['transaction_costs'])
+
+
+def test_formula_engine_matches_transaction_costs_formula():
+    engine = FormulaEngine.from_file('config/formulas.json')
+    df = pd.DataFrame({
+        'country': ['GB', 'NL', 'US', 'NL', 'GB'],
+        'notional': [100, 100, 100, 300, 1000],
+        'rate': [0.2, 0.2, 0.2, 0.7, 0.002]
+    })
+
+    expected = calculate(df.copy(), 'transaction_costs', TransactionCostsFormula())['transaction_costs']
+
+    pd.testing.assert_series_equal(engine.evaluate(df)['transaction_costs'], expected)
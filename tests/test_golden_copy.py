@@ -0,0 +1,96 @@
+import json
+
+import pandas as pd
+import pytest
+
+from components.data_enricher import IClient, LocalLeiClient, DataEnricher
+from components.data_parser import LEIDataParser, LEIRecord
+from components.golden_copy import GoldenCopyStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = GoldenCopyStore(str(tmp_path / 'golden_copy.sqlite'))
+    yield store
+    store.close()
+
+
+def test_ingest_csv(store, tmp_path):
+    golden_copy = tmp_path / 'golden_copy.csv.zip'
+    pd.DataFrame({
+        'LEI': ['LEI1', 'LEI2'],
+        'Entity.LegalName': ['Company 1', 'Company 2'],
+        'Entity.LegalAddress.Country': ['GB', 'NL'],
+        'Registration.RegistrationStatus': ['ISSUED', 'ISSUED'],
+    }).to_csv(golden_copy, index=False)
+    bic_mapping = tmp_path / 'bic_mapping.csv'
+    pd.DataFrame({'LEI': ['LEI1'], 'BIC': ['BIC1GB2L']}).to_csv(bic_mapping, index=False)
+    delta = tmp_path / 'delta.csv'
+    pd.DataFrame({
+        'LEI': ['LEI2', 'LEI3'],
+        'Entity.LegalName': ['Company 2 Renamed', 'Company 3'],
+        'Entity.LegalAddress.Country': ['NL', 'DE'],
+    }).to_csv(delta, index=False)
+
+    assert store.ingest(str(golden_copy)) == 2
+    assert store.ingest(str(bic_mapping)) == 1
+    assert store.ingest(str(golden_copy), chunk_size=1) == 2
+    assert store.ingest(str(delta)) == 2
+
+    assert len(store) == 3
+    assert store.get_many(['LEI1', 'LEI2', 'LEI3', 'LEI4']) == {
+        'LEI1': LEIRecord('Company 1', 'BIC1GB2L', 'GB'),
+        'LEI2': LEIRecord('Company 2 Renamed', '', 'NL'),
+        'LEI3': LEIRecord('Company 3', '', 'DE'),
+    }
+
+
+@pytest.mark.parametrize('filename', ['records.json', 'records.jsonl'])
+def test_ingest_json(store, tmp_path, filename):
+    records = [{'attributes': {'lei': f'LEI{i}', 'entity': {'legalName': {'name': f'Company {i}'},
+                                                            'legalAddress': {'country': 'GB'}},
+                               'bic': [f'BIC{i}']}} for i in range(3)]
+    path = tmp_path / filename
+    if filename.endswith('.jsonl'):
+        path.write_text('\n'.join(json.dumps(record) for record in records))
+    else:
+        path.write_text(json.dumps({'data': records}))
+
+    assert store.ingest(str(path), chunk_size=2) == 3
+    assert store.get_many(['LEI2']) == {'LEI2': LEIRecord('Company 2', 'BIC2', 'GB')}
+
+
+class FallbackClient(IClient):
+    def __init__(self):
+        self.fetched = []
+
+    async def fetch(self, id_):
+        self.fetched.append(id_)
+        return json.dumps({'data': [{'attributes': {'entity': {'legalName': {'name': f'Remote {id_}'},
+                                                               'legalAddress': {'country': 'NL'}}}}]})
+
+
+@pytest.mark.asyncio
+async def test_local_lei_client(store):
+    store.upsert(pd.DataFrame({'lei': ['LEI1'], 'legal_name': ['Company 1'], 'bic': ['BIC1'], 'country': ['GB']}))
+
+    async with LocalLeiClient(store) as client:
+        assert await client.fetch_many(['LEI1', 'LEI2']) == {'LEI1': LEIRecord('Company 1', 'BIC1', 'GB'),
+                                                             'LEI2': LEIRecord('', '', '')}
+
+    fallback = FallbackClient()
+    async with LocalLeiClient(store, fallback=fallback) as client:
+        enricher = DataEnricher(client, LEIDataParser(), batch_size=10_000)
+        df = pd.DataFrame({'lei': ['LEI1', 'LEI2', 'LEI1']})
+        df = await enricher.enrich_data(df, df['lei'].tolist())
+
+    assert fallback.fetched == ['LEI2']
+    assert df['legal_name'].tolist() == ['Company 1', 'Remote LEI2', 'Company 1']
+    assert df['country'].tolist() == ['GB', 'NL', 'GB']
+
+
+@pytest.mark.asyncio
+async def test_client_context_manager():
+    # Clients without resources of their own can be used with `async with` too, e.g. as a fallback
+    async with FallbackClient() as client:
+        assert await client.fetch_many(['LEI1']) == {'LEI1': await client.fetch('LEI1')}
@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+
+from components.cacher import LeiLookupCache
+from components.data_enricher import LeiLookupClient
+from benchmarks.mock_gleif_server import MockGleifServer
+from components.data_parser import LEIDataParser
+from components.http_session import HAS_BROTLI, SessionOptions, SessionPool, accept_encoding
+from components.metrics import metrics
+from components.retry_policy import RetryPolicy
+
+
+@pytest.mark.asyncio
+async def test_session_pool_shares_sessions():
+    pool = SessionPool()
+    options = SessionOptions(pool_size=5)
+
+    session = pool.acquire(options)
+    assert pool.acquire(SessionOptions(pool_size=5)) is session
+    other = pool.acquire(SessionOptions(pool_size=6))
+    assert other is not session
+    await pool.release(other)
+    assert other.closed
+
+    await pool.release(session)
+    assert not session.closed
+    await pool.release(session)
+    assert session.closed
+
+    # A new session is created once the shared one is closed
+    new_session = pool.acquire(options)
+    assert new_session is not session
+    await pool.release(new_session)
+
+
+@pytest.mark.asyncio
+async def test_clients_share_session():
+    first, second = LeiLookupClient(LeiLookupCache(10)), LeiLookupClient(LeiLookupCache(10))
+
+    async with first, second:
+        assert first.session is second.session
+        assert first.session.connector.limit == SessionOptions().pool_size
+
+    assert first.session.closed
+
+
+@pytest.mark.asyncio
+async def test_read_timeout(make_server, make_client):
+    async def hanging_handler(request):
+        await asyncio.sleep(5)
+        return web.json_response({'data': []})
+
+    async with make_server(hanging_handler) as server:
+        client = make_client(server, retry_policy=RetryPolicy(max_attempts=1),
+                             session_options=SessionOptions(read_timeout=0.1))
+        async with client:
+            assert await asyncio.wait_for(client.fetch('XKZZ2JZF41MRHTR1V493'), timeout=2) is None
+
+
+def test_accept_encoding():
+    assert accept_encoding() == ('gzip, deflate, br' if HAS_BROTLI else 'gzip, deflate')
+    assert accept_encoding(compress=False) == 'identity'
+
+
+@pytest.mark.asyncio
+async def test_compressed_response(make_server, make_client):
+    encodings = []
+
+    async def handler(request):
+        encodings.append(request.headers['Accept-Encoding'])
+        response = web.json_response({'data': [{'attributes': {'lei': 'XKZZ2JZF41MRHTR1V493'}}]})
+        response.enable_compression(web.ContentCoding.gzip)
+        return response
+
+    async with make_server(handler) as server:
+        async with make_client(server) as client:
+            data = await client.fetch('XKZZ2JZF41MRHTR1V493')
+
+    assert json.loads(data) == {'data': [{'attributes': {'lei': 'XKZZ2JZF41MRHTR1V493'}}]}
+    assert encodings == [accept_encoding()]
+
+
+@pytest.mark.asyncio
+async def test_sparse_fieldsets(make_client):
+    leis = ['XKZZ2JZF41MRHTR1V493', '213800MBWEIJDM5CU638']
+
+    async def fetch(server, fields):
+        metrics.reset()
+        async with make_client(server, fields=fields) as client:
+            results = await client.fetch_many(leis)
+        return LEIDataParser.parse_data([results[lei] for lei in leis]), metrics.counters[
+            'enrichment_response_bytes_total'][()]
+
+    async with MockGleifServer(payload_size=1000) as server:
+        full, full_bytes = await fetch(server, None)
+        sparse, sparse_bytes = await fetch(server, LEIDataParser.sparse_fields())
+
+    assert sparse == full
+    # The filler attribute isn't requested
+    assert sparse_bytes < full_bytes - 2000
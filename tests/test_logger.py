@@ -0,0 +1,53 @@
+import logging
+
+import pytest
+
+from globals import Logger
+from logger.Logger import LoggerSingleton
+from logger.sampling import LogSampler, LogAggregator
+
+
+def test_log_sampler():
+    sampler = LogSampler(every=3)
+
+    assert [sampler.sample() for _ in range(7)] == ['', None, None, ' (2 similar messages skipped)', None, None,
+                                                   ' (2 similar messages skipped)']
+
+    with pytest.raises(ValueError):
+        LogSampler(every=0)
+
+
+def test_log_aggregator(caplog):
+    logger = logging.getLogger('test_log_aggregator')
+    logger.setLevel(logging.INFO)
+    aggregator = LogAggregator(logger, interval=3600)
+
+    with caplog.at_level(logging.INFO, logger='test_log_aggregator'):
+        # The first occurrence of a message is logged right away
+        aggregator.add('{count} IDs fetched from cache.')
+        assert caplog.messages == ['1 IDs fetched from cache.']
+
+        for _ in range(1499):
+            aggregator.add('{count} IDs fetched from cache.')
+        aggregator.add('{count} IDs fetched from the server.', count=20)
+        assert caplog.messages == ['1 IDs fetched from cache.', '20 IDs fetched from the server.']
+
+        aggregator.flush()
+        assert caplog.messages[2:] == ['1499 IDs fetched from cache.']
+
+        aggregator.flush()
+        assert len(caplog.messages) == 3
+
+
+def test_queued_logging():
+    logger = Logger.get_logger('test_queued_logging')
+    instance = LoggerSingleton.get_instance()
+
+    Logger.enable_queue()
+    try:
+        assert logger.handlers == [instance.queue_handler]
+    finally:
+        Logger.disable_queue()
+
+    assert instance.listener is None
+    assert logger.handlers == instance.get_handlers()
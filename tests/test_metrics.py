@@ -0,0 +1,68 @@
+import json
+import math
+
+import pytest
+from aiohttp import web
+
+from components.metrics import Histogram, MetricsRegistry, metrics
+
+
+def test_histogram():
+    histogram = Histogram([1, 2, 5])
+    for value in [0.5, 1, 1.5, 3, 10]:
+        histogram.observe(value)
+
+    assert list(histogram.cumulative_counts()) == [(1, 2), (2, 3), (5, 4), (math.inf, 5)]
+    assert histogram.sum == 16
+    assert histogram.quantile(0.5) == 2
+    assert histogram.quantile(0.99) == math.inf
+    assert Histogram([1]).quantile(0.5) is None
+
+
+def test_prometheus_export(tmp_path):
+    registry = MetricsRegistry()
+    registry.increment('requests_total', status=200)
+    registry.increment('requests_total', 2, status=200)
+    registry.set('cache_hits', 5)
+    registry.observe('request_seconds', 0.2, buckets=[0.1, 1], stage='fetch')
+
+    assert registry.to_prometheus() == '\n'.join([
+        '# TYPE requests_total counter',
+        'requests_total{status="200"} 3',
+        '# TYPE cache_hits gauge',
+        'cache_hits 5',
+        '# TYPE request_seconds histogram',
+        'request_seconds_bucket{stage="fetch",le="0.1"} 0',
+        'request_seconds_bucket{stage="fetch",le="1.0"} 1',
+        'request_seconds_bucket{stage="fetch",le="+Inf"} 1',
+        'request_seconds_sum{stage="fetch"} 0.2',
+        'request_seconds_count{stage="fetch"} 1',
+    ]) + '\n'
+
+    registry.export(str(tmp_path / 'metrics.json'))
+    exported = json.loads((tmp_path / 'metrics.json').read_text())
+    assert exported['counters'] == {'requests_total{status=200}': 3}
+    assert exported['histograms']['request_seconds{stage=fetch}']['p50'] == 1
+
+    with registry.timer('stage_seconds', stage='load'):
+        pass
+    assert registry.histograms['stage_seconds'][(('stage', 'load'),)].count == 1
+    assert 'stage_seconds{stage=load}: 1 observations' in registry.summary()
+
+
+@pytest.mark.asyncio
+async def test_client_request_metrics(make_server, make_client):
+    statuses = [503, 200]
+
+    async def handler(request):
+        return web.json_response({'data': []}, status=statuses.pop(0), headers={'Retry-After': '0'})
+
+    metrics.reset()
+    async with make_server(handler) as server:
+        async with make_client(server) as client:
+            await client.fetch('XKZZ2JZF41MRHTR1V493')
+
+    assert metrics.counters['enrichment_requests_total'] == {(('status', '503'),): 1, (('status', '200'),): 1}
+    assert metrics.histograms['enrichment_request_seconds'][()].count == 2
+    retries = metrics.histograms['enrichment_request_retries'][()]
+    assert (retries.count, retries.sum) == (1, 1)
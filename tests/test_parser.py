@@ -1,5 +1,5 @@
 import pytest
-from components.data_parser import LEIDataParser
+from components.data_parser import LEIDataParser, FieldExtractor
 
 
 # Fixtures for reusable components
@@ -29,3 +29,36 @@ def test_parse_data(parser, sample_data):
 def test_parse_data_bad_data(parser, bad_data):
     parsed_data = parser.parse_data(bad_data)
     assert parsed_data == [{'bic': None, 'country': None, 'legal_name': None}]
+
+
+def test_parse_data_missing_fields(parser):
+    parsed_data = parser.parse_data([
+        '{"data": [{"attributes": {"entity": {"legalName": {"name": "Company 1"}}, "bic": null}}]}',
+        '{"data": []}',
+    ])
+    assert parsed_data == [{'legal_name': 'Company 1', 'bic': '', 'country': ''},
+                           {'legal_name': '', 'bic': '', 'country': ''}]
+
+
+def test_parse_batch(parser):
+    parsed_data = parser.parse_batch(
+        '{"data": [{"attributes": {"lei": "LEI1", "entity": {"legalName": {"name": "Company 1"}, '
+        '"legalAddress": {"country": "GB"}}, "bic": ["1234"]}}, '
+        '{"attributes": {"lei": "LEI2", "entity": {"legalName": {"name": "Company 2"}, '
+        '"legalAddress": {"country": "NL"}}, "bic": ["5678"]}}]}')
+    assert parsed_data == {'LEI1': {'legal_name': 'Company 1', 'bic': '1234', 'country': 'GB'},
+                           'LEI2': {'legal_name': 'Company 2', 'bic': '5678', 'country': 'NL'}}
+
+
+def test_field_extractor():
+    extractor = FieldExtractor({'a': ('x', 'a'), 'b': ('x', 'b', 1), 'c': ('y',)}, default=None)
+
+    assert extractor.names == ('a', 'b', 'c')
+    assert extractor.extract({'x': {'a': 1, 'b': [2, 3]}, 'y': 4}) == (1, 3, 4)
+    assert extractor.extract({'x': {'b': [2]}}) == (None, None, None)
+    assert extractor.extract(None) == (None, None, None)
+
+
+def test_sparse_fields():
+    # The top-level record attributes the parser reads
+    assert LEIDataParser.sparse_fields() == ['bic', 'entity', 'lei']
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from benchmarks.mock_gleif_server import MockGleifServer
+from components.pipeline import run_pipeline, PipelineStopped, Stage
+from main import DataEnrichmentRunner
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_order():
+    output = []
+
+    async def double(batch):
+        await asyncio.sleep(0.01 * (5 - batch))
+        return batch * 2
+
+    busy = await run_pipeline(range(5), [Stage('double', double), Stage('add', lambda batch: batch + 1),
+                                         Stage('save', output.append)])
+
+    assert output == [1, 3, 5, 7, 9]
+    assert list(busy) == ['load', 'double', 'add', 'save']
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_overlaps_stages():
+    async def fetch(batch):
+        await asyncio.sleep(0.05)
+        return batch
+
+    def save(batch):
+        time.sleep(0.05)
+
+    start = time.perf_counter()
+    await run_pipeline(range(10), [Stage('fetch', fetch), Stage('save', save)])
+
+    # 0.5s per stage, 1s if the stages ran one after another
+    assert time.perf_counter() - start < 0.8
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_backpressure():
+    loaded = []
+    saved = []
+    release = threading.Event()
+
+    def source():
+        for i in range(20):
+            loaded.append(i)
+            yield i
+
+    def save(batch):
+        release.wait()
+        saved.append(batch)
+
+    task = asyncio.create_task(run_pipeline(source(), [Stage('identity', lambda batch: batch), Stage('save', save)],
+                                            depth=2))
+    await asyncio.sleep(0.2)
+
+    # One batch in each stage, and `depth` batches in each queue
+    assert len(loaded) <= 8
+
+    release.set()
+    await task
+    assert saved == list(range(20))
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_stopped():
+    saved = []
+
+    def check(batch):
+        if batch == 3:
+            raise PipelineStopped('Invalid batch!')
+        return batch
+
+    with pytest.raises(PipelineStopped):
+        await run_pipeline(range(100), [Stage('check', check), Stage('save', saved.append)], depth=1)
+
+    # The batches before the invalid one are saved, like in a sequential run
+    assert saved == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_stopped_by_source():
+    saved = []
+
+    def source():
+        yield from range(3)
+        raise PipelineStopped('Unreadable input!')
+
+    def save(batch):
+        time.sleep(0.05)
+        saved.append(batch)
+
+    with pytest.raises(PipelineStopped):
+        await run_pipeline(source(), [Stage('save', save)])
+
+    assert saved == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_waits_for_threads():
+    finished = []
+
+    def save(batch):
+        time.sleep(0.1)
+        finished.append(batch)
+
+    async def fail(batch):
+        raise ValueError('Unexpected error!')
+
+    with pytest.raises(ValueError):
+        await run_pipeline(range(5), [Stage('save', save), Stage('fail', fail)])
+
+    # The save running when the pipeline failed is finished before run_pipeline returns
+    done = list(finished)
+    time.sleep(0.2)
+    assert finished == done
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('pipeline', [False, True])
+async def test_run_stops_on_malformed_input(tmp_path, pipeline):
+    input_file, output_file = str(tmp_path / 'input.csv'), str(tmp_path / 'output.csv')
+    with open('data/input_dataset.csv') as file:
+        lines = file.read().splitlines()
+    with open(input_file, 'w') as file:
+        file.write('\n'.join(lines[:11] + ['"unterminated'] + lines[11:]) + '\n')
+
+    async with MockGleifServer() as server:
+        runner = DataEnrichmentRunner(client='LeiLookupClient', input_file=input_file, output_file=output_file,
+                                      chunk_size=5, pipeline=pipeline, base_url=server.url, requests_per_second=1000,
+                                      burst=1000, log_queue=False)
+        await runner.run()
+
+    # The chunks before the malformed line are written
+    assert runner.rows_written == 10
+    assert len(pd.read_csv(output_file)) == 10
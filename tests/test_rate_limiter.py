@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+import pytest
+
+from components.rate_limiter import TokenBucketRateLimiter
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate():
+    rate_limiter = TokenBucketRateLimiter(requests_per_second=20, burst=2, max_concurrency=None)
+
+    async def request():
+        async with rate_limiter:
+            pass
+
+    start = time.monotonic()
+    await asyncio.gather(*(request() for _ in range(6)))
+    elapsed = time.monotonic() - start
+
+    # The first two requests use the burst, the remaining four wait 1/20 second each
+    assert 0.2 <= elapsed < 0.4
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_concurrency():
+    rate_limiter = TokenBucketRateLimiter(requests_per_second=1000, burst=1000, max_concurrency=2)
+    in_flight = 0
+    max_in_flight = 0
+
+    async def request():
+        nonlocal in_flight, max_in_flight
+        async with rate_limiter:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+    await asyncio.gather(*(request() for _ in range(10)))
+
+    assert max_in_flight == 2
+
+
+def test_token_bucket_invalid_settings():
+    with pytest.raises(ValueError):
+        TokenBucketRateLimiter(requests_per_second=0)
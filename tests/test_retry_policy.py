@@ -0,0 +1,67 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+from aiohttp import web, ClientConnectionError, InvalidURL
+
+from components.retry_policy import RetryPolicy, RetryBudget
+
+
+def test_full_jitter_backoff():
+    policy = RetryPolicy(base_delay=1, max_delay=5, random_=lambda: 0.5)
+
+    assert [policy.get_delay(attempt) for attempt in range(5)] == [0.5, 1, 2, 2.5, 2.5]
+
+
+def test_retry_after():
+    policy = RetryPolicy(base_delay=1, random_=lambda: 0.5)
+
+    assert policy.get_delay(0, retry_after='3') == 3
+    assert policy.get_delay(0, retry_after='0') == 0.5
+    assert policy.get_delay(0, retry_after='invalid') == 0.5
+    assert 9 <= policy.get_delay(0, retry_after=formatdate(time.time() + 10, usegmt=True)) <= 10
+    assert RetryPolicy(respect_retry_after=False, random_=lambda: 0).get_delay(0, retry_after='3') == 0
+
+
+def test_retry_decisions():
+    policy = RetryPolicy()
+
+    assert policy.should_retry_status(429)
+    assert policy.should_retry_status(503)
+    assert not policy.should_retry_status(404)
+    assert policy.is_transient_error(ClientConnectionError())
+    assert policy.is_transient_error(asyncio.TimeoutError())
+    assert not policy.is_transient_error(InvalidURL('url'))
+
+
+def test_retry_budget():
+    budget = RetryBudget(ratio=0.5, min_retries=1)
+
+    assert budget.try_spend()
+    assert not budget.try_spend()
+
+    budget.record_request()
+    budget.record_request()
+    assert budget.try_spend()
+    assert not budget.try_spend()
+
+
+@pytest.mark.asyncio
+async def test_client_retries(make_server, make_client):
+    statuses = {'XKZZ2JZF41MRHTR1V493': [429, 200], '213800MBWEIJDM5CU638': [404, 200]}
+    requests = []
+
+    async def handler(request):
+        lei = request.query['filter[lei]']
+        requests.append(lei)
+        status = statuses[lei].pop(0)
+        return web.json_response({'data': []}, status=status, headers={'Retry-After': '0'})
+
+    async with make_server(handler) as server:
+        async with make_client(server) as client:
+            # The 429 is retried, the 404 isn't
+            assert await client.fetch('XKZZ2JZF41MRHTR1V493') == '{"data": []}'
+            assert await client.fetch('213800MBWEIJDM5CU638') is None
+
+    assert requests == ['XKZZ2JZF41MRHTR1V493', 'XKZZ2JZF41MRHTR1V493', '213800MBWEIJDM5CU638']
@@ -0,0 +1,76 @@
+import pytest
+
+from benchmarks.mock_gleif_server import MockGleifServer
+from components.cacher import LeiLookupCache
+from components.data_enricher import CachedResponse
+from components.data_parser import LEIDataParser
+from components.metrics import metrics
+
+LEIS = ['XKZZ2JZF41MRHTR1V493', '213800MBWEIJDM5CU638', 'K6Q0W1PS1L1O4IQL9C32']
+
+# The clients revalidate with revalidate_after=0, so their cached data is stale right away
+
+
+def names(results):
+    return [parsed['legal_name'] for parsed in LEIDataParser.parse_data([results[lei] for lei in LEIS])]
+
+
+@pytest.mark.asyncio
+async def test_revalidation_not_modified(make_client):
+    metrics.reset()
+    cache = LeiLookupCache(100)
+    async with MockGleifServer() as server:
+        async with make_client(server, cache, revalidate_after=0) as client:
+            first = await client.fetch_many(LEIS)
+            second = await client.fetch_many(LEIS)
+
+    assert second == first
+    assert server.statuses == {200: 1, 304: 1}
+    assert metrics.counters['enrichment_revalidations_total'] == {(('result', 'not_modified'),): 3}
+    assert isinstance(cache.get(LEIS[0]), CachedResponse)
+
+
+@pytest.mark.asyncio
+async def test_revalidation_modified(make_client):
+    async with MockGleifServer() as server:
+        async with make_client(server, LeiLookupCache(100), revalidate_after=0) as client:
+            first = await client.fetch_many(LEIS)
+            server.modified.add(LEIS[1])
+            second = await client.fetch_many(LEIS)
+
+    assert server.statuses == {200: 2}
+    assert names(second) == [names(first)[0], names(first)[1] + ' (RENAMED)', names(first)[2]]
+
+
+@pytest.mark.asyncio
+async def test_revalidation_needs_whole_page(make_client):
+    async with MockGleifServer() as server:
+        async with make_client(server, LeiLookupCache(100), revalidate_after=0) as client:
+            await client.fetch_many(LEIS)
+            # The validators belong to the request of all three LEIs, so one of them is fetched again
+            await client.fetch_many(LEIS[:1])
+
+    assert server.statuses == {200: 2}
+
+
+@pytest.mark.asyncio
+async def test_stale_while_revalidate(make_client):
+    cache = LeiLookupCache(100)
+    async with MockGleifServer() as server:
+        async with make_client(server, cache, stale_while_revalidate=True, revalidate_after=0) as client:
+            first = await client.fetch_many(LEIS)
+            server.modified.add(LEIS[0])
+            # The stale data is returned at once and revalidated in the background
+            assert await client.fetch_many(LEIS) == first
+
+    assert server.statuses == {200: 2}
+    assert cache.get(LEIS[0]).value != first[LEIS[0]]
+
+
+@pytest.mark.asyncio
+async def test_stale_if_error(make_client):
+    async with MockGleifServer() as server:
+        async with make_client(server, LeiLookupCache(100), revalidate_after=0) as client:
+            first = await client.fetch_many(LEIS)
+            server.error_rate = 1
+            assert await client.fetch_many(LEIS) == first
@@ -0,0 +1,90 @@
+import asyncio
+import multiprocessing
+import time
+
+import pandas as pd
+import pytest
+from aiohttp import web
+
+from components.rate_limiter import SharedTokenBucketRateLimiter
+from components.retry_policy import SharedRetryBudget
+from components.sharding import merge_shards, shard_ids
+from main import DataEnrichmentRunner
+
+
+def test_shard_ids():
+    leis = pd.Series(['XKZZ2JZF41MRHTR1V493', 'K6Q0W1PS1L1O4IQL9C32', 'XKZZ2JZF41MRHTR1V493'] * 100)
+    ids = shard_ids(leis, 4)
+
+    assert ids.min() >= 0 and ids.max() < 4
+    assert ids[0] == ids[2]
+    # Stable across runs and processes
+    assert (shard_ids(leis, 4) == ids).all()
+
+
+def test_merge_shards():
+    df = pd.DataFrame({'_row_number': range(20), 'value': list('abcdefghijklmnopqrst')})
+    shards = [df[df['_row_number'] % 3 == i] for i in range(3)]
+
+    def chunks(shard):
+        return (shard.iloc[i:i + 2] for i in range(0, len(shard), 2))
+
+    merged = list(merge_shards([chunks(shard) for shard in shards]))
+
+    assert len(merged) > 1
+    assert pd.concat(merged)['value'].tolist() == df['value'].tolist()
+
+
+def _spend(budget: SharedRetryBudget) -> None:
+    for _ in range(10):
+        budget.record_request()
+    budget.try_spend()
+
+
+def test_shared_retry_budget():
+    context = multiprocessing.get_context('spawn')
+    budget = SharedRetryBudget(ratio=0.1, min_retries=1, context=context)
+
+    process = context.Process(target=_spend, args=(budget,))
+    process.start()
+    process.join()
+
+    # The budget allows 1 + 0.1 * 10 retries, and the other process spent one of them
+    assert (budget.requests, budget.retries) == (10, 1)
+    assert budget.try_spend()
+    assert not budget.try_spend()
+
+
+@pytest.mark.asyncio
+async def test_shared_token_bucket_limits_rate():
+    rate_limiter = SharedTokenBucketRateLimiter(requests_per_second=20, burst=2, max_concurrency=None)
+
+    async def request():
+        async with rate_limiter:
+            pass
+
+    start = time.monotonic()
+    await asyncio.gather(*(request() for _ in range(6)))
+
+    # The first two requests use the burst, the remaining four wait 1/20 second each
+    assert 0.2 <= time.monotonic() - start < 0.4
+
+
+@pytest.mark.asyncio
+async def test_run_sharded(tmp_path, make_server):
+    async def handler(request):
+        leis = request.query['filter[lei]'].split(',')
+        return web.json_response({'data': [{'attributes': {
+            'lei': lei, 'entity': {'legalName': {'name': f'Name {lei}'}, 'legalAddress': {'country': 'GB'}},
+            'bic': [f'BIC{lei[:4]}']}} for lei in leis]})
+
+    async with make_server(handler) as server:
+        options = dict(client='LeiLookupClient', requests_per_second=1000, burst=1000, log_queue=False,
+                       base_url=str(server.make_url('/api/v1/lei-records?filter[lei]=')),
+                       input_file='data/input_dataset.csv', chunk_size=7)
+        await DataEnrichmentRunner(output_file=str(tmp_path / 'expected.csv'), **options).run()
+        runner = DataEnrichmentRunner(output_file=str(tmp_path / 'output.csv'), workers=3, **options)
+        await runner.run()
+
+    assert runner.rows_written == 20
+    assert (tmp_path / 'output.csv').read_text() == (tmp_path / 'expected.csv').read_text()